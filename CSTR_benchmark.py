@@ -0,0 +1,331 @@
+###########################
+# import
+###########################
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import scipy
+
+from CSTR_model_plus import (CSTRRLEnv, INTEGRATORS, OdeintIntegrator, PID_velocity, VectorCSTREnv,
+                             batch_cstr_dynamics, cstr_dynamics, make_integrator)
+from CSTR_plant import CSTRPlantEnv
+from CSTR_surrogate import TransitionLogger
+
+
+
+##############################################
+# 1. Timing helpers
+##############################################
+
+def _best_time(fn, number, repeat):
+    """
+    Smallest wall time of `repeat` runs of fn() called `number` times (less noisy than the mean).
+    """
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _result(value, unit, better):
+    return {'value': float(value), 'unit': unit, 'better': better}
+
+
+# Environment configurations covered by the throughput benchmarks
+CONFIGS = {
+    'default': {},
+    'no_delay': {'actuator_delay_steps': 0, 'transport_delay_steps': 0},
+    'long_delay': {'actuator_delay_steps': 5, 'transport_delay_steps': 10},
+    'no_noise': {'noise_level': 0.0},
+    'no_disturbance': {'enable_disturbances': False},
+    'deterministic': {'uncertainty_level': 0.0, 'noise_level': 0.0, 'enable_disturbances': False},
+    'low_allocation': {'low_allocation': True},
+    # Action repeat: one solver session per held action vs a restart per interval
+    'repeat5': {'action_repeat': 5},
+    'repeat5_restart': {'action_repeat': 5, 'continuous_repeat': False},
+    'mpc_smooth': {'controller': 'mpc', 'noise_level': 0.0, 'enable_disturbances': False},
+    'mpc_smooth_repeat5': {'controller': 'mpc', 'noise_level': 0.0, 'enable_disturbances': False,
+                           'action_repeat': 5},
+}
+
+# Fixed normalized PID gains used for every benchmark episode
+ACTION = np.array([0.1, -0.5, -0.9, 0.3, 0.0, -0.5])
+
+
+
+##############################################
+# 2. Benchmarks
+##############################################
+
+def bench_kernels(quick=False):
+    """
+    Calls per second of the model and controller kernels.
+    """
+    number, repeat = (200, 3) if quick else (2000, 5)
+    x = np.array([0.8, 0.1, 0.0, 330.0, 100.0])
+    u = np.array([300.0, 100.0])
+    e_history = np.array([[0.5, 0.0], [0.4, 0.1]])
+    u_history = np.array([[300.0, 100.0], [301.0, 100.0]])
+    gains = np.array([10.0, 5.0, 1.0, 0.5, 1.0, 0.1])
+    env = CSTRRLEnv(record_history=False, seed=0)
+
+    kernels = {
+        'cstr_dynamics': lambda: cstr_dynamics(x, 0.0, u, 350.0, 1.0),
+        'custom_cstr_dynamics': lambda: env.custom_cstr_dynamics(x, 0.0, u),
+        'PID_velocity': lambda: PID_velocity(gains, np.array([0.3, 0.1]), e_history, u_history, 1.0),
+    }
+    results = {}
+    for name, fn in kernels.items():
+        results[f'kernel.{name}.calls_per_s'] = _result(number / _best_time(fn, number, repeat),
+                                                        'calls/s', 'higher')
+
+    # Batched right-hand side, per reactor
+    N = 1024
+    xs, us = np.tile(x, (N, 1)), np.tile(u, (N, 1))
+    params = {key: np.full(N, value) for key, value in CSTRRLEnv.nominal_params.items()}
+    elapsed = _best_time(lambda: batch_cstr_dynamics(xs, 0.0, us, params), number // 10, repeat)
+    results['kernel.batch_cstr_dynamics.reactors_per_s'] = _result(N * (number // 10) / elapsed,
+                                                                   'reactors/s', 'higher')
+    return results
+
+
+def bench_env(quick=False, integrators=('odeint',)):
+    """
+    Simulation steps (control intervals) per second and RHS evaluations per step of
+    CSTRRLEnv for every configuration, over one episode.
+    """
+    steps = 50 if quick else 200
+    results = {}
+    for integrator in integrators:
+        for config, kwargs in CONFIGS.items():
+            env = CSTRRLEnv(simulation_steps=steps, record_history=False, integrator=integrator,
+                            seed=0, **kwargs)
+            env.reset(seed=0)
+            env.integrator.reset_stats()
+            start = time.perf_counter()
+            done = False
+            while not done:
+                done = env.step(ACTION)[2]
+            elapsed = time.perf_counter() - start
+
+            prefix = f'env.{integrator}.{config}'
+            results[f'{prefix}.steps_per_s'] = _result(steps / elapsed, 'steps/s', 'higher')
+            results[f'{prefix}.nfev_per_step'] = _result(env.integrator.nfev / steps, 'nfev/step', 'lower')
+    return results
+
+
+def bench_vector(quick=False, sizes=(16, 256)):
+    """
+    Reactor steps per second of VectorCSTREnv for several batch sizes.
+    """
+    steps = 20 if quick else 100
+    results = {}
+    for N in sizes:
+        env = VectorCSTREnv(N, simulation_steps=steps, seed=0)
+        env.reset(seed=0)
+        actions = np.tile(ACTION, (N, 1))
+        env.integrator.reset_stats()
+        start = time.perf_counter()
+        for _ in range(steps):
+            env.step(actions)
+        elapsed = time.perf_counter() - start
+        results[f'vector.odeint.N{N}.reactor_steps_per_s'] = _result(N * steps / elapsed,
+                                                                     'reactor steps/s', 'higher')
+        results[f'vector.odeint.N{N}.nfev_per_step'] = _result(env.integrator.nfev / steps,
+                                                               'nfev/step', 'lower')
+    return results
+
+
+def bench_plant(quick=False, sizes=(16, 256)):
+    """
+    Unit steps per second of CSTRPlantEnv (units in series) for several plant sizes.
+    """
+    steps = 20 if quick else 100
+    results = {}
+    for M in sizes:
+        env = CSTRPlantEnv(M, 'series', simulation_steps=steps, seed=0)
+        env.reset(seed=0)
+        actions = np.tile(ACTION, (M, 1))
+        env.integrator.reset_stats()
+        start = time.perf_counter()
+        for _ in range(steps):
+            env.step(actions)
+        elapsed = time.perf_counter() - start
+        results[f'plant.series.M{M}.unit_steps_per_s'] = _result(M * steps / elapsed,
+                                                                 'unit steps/s', 'higher')
+        results[f'plant.series.M{M}.nfev_per_step'] = _result(env.integrator.nfev / steps,
+                                                              'nfev/step', 'lower')
+    return results
+
+
+def bench_memory(quick=False):
+    """
+    Memory growth of a long episode with trajectory recording on and off.
+    """
+    steps = 1000 if quick else 10000
+    results = {}
+    for record in (True, False):
+        env = CSTRRLEnv(simulation_steps=steps, record_history=record, integrator='rk4', seed=0)
+        env.reset(seed=0)
+        tracemalloc.start()
+        for _ in range(steps // 10):
+            env.step(ACTION)
+        early, _ = tracemalloc.get_traced_memory()
+        for _ in range(steps - steps // 10):
+            env.step(ACTION)
+        late, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        prefix = f"memory.{'record' if record else 'no_record'}"
+        results[f'{prefix}.growth_bytes_per_step'] = _result(
+            max(0, late - early) / (steps - steps // 10), 'bytes/step', 'lower')
+        results[f'{prefix}.peak_bytes'] = _result(peak, 'bytes', 'lower')
+    return results
+
+
+def bench_accuracy(quick=False, integrators=None):
+    """
+    One-step error of every integrator backend against a tight-tolerance odeint reference,
+    on the transitions of a closed-loop episode (so all backends see the same states,
+    controls and process parameters).
+    """
+    steps = 30 if quick else 100
+    reference = OdeintIntegrator(rtol=1e-12, atol=1e-12)
+    logger = TransitionLogger(reference)
+    env = CSTRRLEnv(simulation_steps=steps, record_history=False, integrator=logger, seed=0)
+    env.rollout(ACTION, seed=0)
+    data = logger.transitions()
+
+    def fun(x, t, u, params):
+        return batch_cstr_dynamics(x[None], t, u[None], params)[0]
+
+    scale = np.maximum(np.abs(data['x_next']).max(axis=0), 1e-12)
+    results = {}
+    for integrator in integrators or sorted(INTEGRATORS):
+        backend = make_integrator(integrator)
+        errors = np.empty(len(data['x']))
+        for k, (x, u, p) in enumerate(zip(data['x'], data['u'], data['params'])):
+            params = dict(zip(CSTRRLEnv.nominal_params, p))
+            x_next = backend.integrate(fun, x, data['dt'], args=(u, params), params=params)
+            errors[k] = np.max(np.abs(x_next - data['x_next'][k]) / scale)
+        results[f'accuracy.{integrator}.max_rel_error'] = _result(errors.max(), 'relative', 'lower')
+        results[f'accuracy.{integrator}.mean_rel_error'] = _result(errors.mean(), 'relative', 'lower')
+    return results
+
+
+BENCHMARKS = {
+    'kernels': bench_kernels,
+    'env': bench_env,
+    'vector': bench_vector,
+    'plant': bench_plant,
+    'memory': bench_memory,
+    'accuracy': bench_accuracy,
+}
+
+
+
+##############################################
+# 3. Baseline comparison
+##############################################
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    Compare results with a baseline run. A metric regresses when it is worse than the
+    baseline by more than `tolerance` (relative), in the direction given by its 'better' field.
+    """
+    comparison = {}
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        old, new = baseline[name]['value'], result['value']
+        change = (new - old) / abs(old) if old != 0 else (0.0 if new == 0 else np.inf)
+        worse = -change if result['better'] == 'higher' else change
+        comparison[name] = {'baseline': old, 'value': new, 'change': float(change),
+                            'regression': bool(worse > tolerance)}
+    return comparison
+
+
+def run(benchmarks=None, quick=False):
+    """
+    Run the selected benchmarks (all by default) and return a JSON-serializable report.
+    """
+    results = {}
+    for name in benchmarks or BENCHMARKS:
+        results.update(BENCHMARKS[name](quick=quick))
+    return {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': sys.version.split()[0],
+            'numpy': np.__version__,
+            'scipy': scipy.__version__,
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+            'quick': quick,
+        },
+        'results': results,
+    }
+
+
+# Reference run committed with the code, regenerated with
+#   python CSTR_benchmark.py --quick --no-baseline -o benchmark_baseline.json
+# Timings depend on the machine (see its 'meta'), so compare on similar hardware or
+# regenerate it locally before checking a change.
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the CSTR environment.")
+    parser.add_argument('--output', '-o', default='benchmark.json', help="JSON file for the results")
+    parser.add_argument('--baseline', '-b', default=BASELINE,
+                        help="JSON file of a previous run to compare against (default: the committed "
+                             "benchmark_baseline.json)")
+    parser.add_argument('--no-baseline', action='store_true', help="skip the baseline comparison")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="relative slowdown/error increase reported as a regression")
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), help="benchmarks to run")
+    parser.add_argument('--quick', action='store_true', help="short runs (smoke test)")
+    args = parser.parse_args(argv)
+
+    report = run(args.only, args.quick)
+    regressions = []
+    if not args.no_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['meta'].get('quick') != args.quick:
+            print(f"warning: {args.baseline} was run with quick={baseline['meta'].get('quick')}, "
+                  f"this run with quick={args.quick}")
+        report['baseline'] = args.baseline
+        report['comparison'] = compare(report['results'], baseline['results'], args.tolerance)
+        regressions = [name for name, c in report['comparison'].items() if c['regression']]
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    width = max(len(name) for name in report['results'])
+    for name, result in report['results'].items():
+        line = f"{name:<{width}}  {result['value']:12.4g} {result['unit']}"
+        if name in report.get('comparison', {}):
+            c = report['comparison'][name]
+            line += f"  ({c['change']:+.1%}{'  REGRESSION' if c['regression'] else ''})"
+        print(line)
+
+    if regressions:
+        print(f"{len(regressions)} regression(s) against {args.baseline}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
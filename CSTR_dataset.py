@@ -0,0 +1,347 @@
+###########################
+# import
+###########################
+
+import json
+import multiprocessing as mp
+import os
+
+import numpy as np
+
+from CSTR_model_plus import CSTRRLEnv, DISTURBANCE_NAMES
+
+
+
+##############################################
+# 1. Transition layout and behavior policies
+##############################################
+
+# One row per transition; shards are .npy files of this dtype
+TRANSITION_DTYPE = np.dtype([
+    ('episode', np.int64),
+    ('step', np.int32),
+    ('obs', np.float64, (8,)),
+    ('action', np.float64, (6,)),
+    ('reward', np.float64),
+    ('next_obs', np.float64, (8,)),
+    ('true_state', np.float64, (5,)),
+    ('disturbance', np.int8),  # index into DISTURBANCE_NAMES, -1 for none
+    ('done', np.bool_),
+])
+
+MANIFEST = 'manifest.json'
+
+
+class RandomGains:
+    """
+    Uniformly random normalized PID gains, redrawn every step or (per_episode=True)
+    once at the start of every episode.
+    """
+    def __init__(self, per_episode=False):
+        self.per_episode = per_episode
+        self._action = None
+
+    def __call__(self, obs, step, rng):
+        if not self.per_episode or step == 0:
+            self._action = rng.uniform(-1, 1, 6)
+        return self._action
+
+    def __repr__(self):
+        return f"RandomGains(per_episode={self.per_episode})"
+
+
+class FixedGains:
+    """
+    The same normalized PID gains at every step (e.g. a tuned PID baseline).
+    """
+    def __init__(self, action):
+        self.action = np.asarray(action, dtype=np.float64)
+
+    def __call__(self, obs, step, rng):
+        return self.action
+
+    def __repr__(self):
+        return f"FixedGains({self.action.tolist()})"
+
+
+# Built-in behavior policies by name; 'pid' uses hand-tuned baseline gains
+POLICIES = {
+    'random': lambda: RandomGains(),
+    'random_episode': lambda: RandomGains(per_episode=True),
+    'pid': lambda: FixedGains([0.1, -0.5, -0.9, 0.3, 0.0, -0.5]),
+}
+
+
+def make_policy(policy):
+    """
+    Behavior policy from its name ('random', 'random_episode' or 'pid') or a callable
+    policy(obs, step, rng) -> normalized action, which is returned unchanged. Callables
+    must be picklable (module-level functions or classes) to run in worker processes.
+    """
+    if callable(policy):
+        return policy
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown policy '{policy}', expected one of {sorted(POLICIES)} or a callable")
+    return POLICIES[policy]()
+
+
+def describe_policy(policy):
+    """
+    Stable identifier of a behavior policy for the dataset manifest: the name of a
+    built-in policy, the repr of a policy class that defines one (RandomGains, FixedGains)
+    and otherwise the qualified name of the function or class, which, unlike the default
+    repr, does not change between runs.
+    """
+    if isinstance(policy, str):
+        return policy
+    if not hasattr(policy, '__qualname__') and type(policy).__repr__ is not object.__repr__:
+        return repr(policy)
+    named = policy if hasattr(policy, '__qualname__') else type(policy)
+    return f"{named.__module__}.{named.__qualname__}"
+
+
+def _json_config(value, name):
+    """
+    JSON form of an env_kwargs value for the manifest: dtypes as their string code
+    (np.dtype(v).str), NumPy scalars and arrays as Python numbers and lists. Other
+    objects (e.g. integrator instances) raise a ValueError before anything is written.
+    """
+    if isinstance(value, np.generic):
+        return value.item()
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, np.dtype) or (isinstance(value, type) and issubclass(value, np.generic)):
+        return np.dtype(value).str
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, (list, tuple)):
+        return [_json_config(item, f"{name}[{i}]") for i, item in enumerate(value)]
+    if isinstance(value, dict):
+        return {str(key): _json_config(item, f"{name}[{key!r}]") for key, item in value.items()}
+    raise ValueError(f"{name} = {value!r} cannot be recorded in the dataset manifest; "
+                     f"pass it by name or as plain values")
+
+
+def _episode_length(env):
+    """
+    Decisions (step() calls) per episode of env: sim_steps control intervals, action_repeat
+    of them per decision.
+    """
+    return -(-env.sim_steps // env.action_repeat)
+
+
+def _episode_seeds(seed, episode):
+    """
+    Environment seed and policy generator of one episode, independent of the shard
+    and worker that runs it (so a resumed or re-sharded run draws the same episodes).
+    """
+    env_seed = int(np.random.SeedSequence([seed, episode]).generate_state(1)[0])
+    return env_seed, np.random.default_rng([seed, episode, 1])
+
+
+
+##############################################
+# 2. Shard writer
+##############################################
+
+def _shard_name(index):
+    return f'shard_{index:05d}.npy'
+
+
+def _write_shard(task):
+    """
+    Simulate the episodes [start, stop) and write their transitions into one shard.
+    The shard is filled through a memory map under a temporary name and only renamed
+    once complete, so a crash never leaves a partial shard behind. Returns its manifest entry.
+    """
+    path, index, start, stop, env_kwargs, policy, seed = task
+    env = CSTRRLEnv(**dict(env_kwargs, record_history=False))
+    steps = _episode_length(env)
+    disturbance_index = {name: i for i, name in enumerate(DISTURBANCE_NAMES)}
+
+    final = os.path.join(path, _shard_name(index))
+    temporary = final[:-4] + '.tmp.npy'
+    shard = np.lib.format.open_memmap(temporary, mode='w+', dtype=TRANSITION_DTYPE,
+                                      shape=((stop - start) * steps,))
+    row = 0
+    for episode in range(start, stop):
+        env_seed, rng = _episode_seeds(seed, episode)
+        obs, _ = env.reset(seed=env_seed)
+        for step in range(steps):
+            action = np.asarray(policy(obs, step, rng), dtype=np.float64)
+            next_obs, reward, done, truncated, info = env.step(action)
+            transition = shard[row]
+            transition['episode'] = episode
+            transition['step'] = step
+            transition['obs'] = obs
+            transition['action'] = action
+            transition['reward'] = reward
+            transition['next_obs'] = next_obs
+            transition['true_state'] = info['true_state']
+            transition['disturbance'] = disturbance_index.get(info['disturbance'], -1)
+            transition['done'] = done or truncated
+            obs = next_obs.copy() # next_obs is reused by a low-allocation env
+            row += 1
+            if done or truncated:
+                break
+    env.close()
+
+    if row < shard.shape[0]:
+        # Episodes ended early: keep the written rows only
+        rows = np.array(shard[:row])
+        del shard
+        np.save(temporary, rows)
+    else:
+        shard.flush()
+        del shard
+    os.replace(temporary, final)
+    return {'file': _shard_name(index), 'episodes': [start, stop], 'rows': row}
+
+
+
+##############################################
+# 3. Dataset generation
+##############################################
+
+def _write_manifest(path, manifest):
+    """
+    Replace the manifest atomically, so that it always lists complete shards only.
+    """
+    temporary = os.path.join(path, MANIFEST + '.tmp')
+    with open(temporary, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(temporary, os.path.join(path, MANIFEST))
+
+
+def generate_dataset(path, episodes, policy='random', env_kwargs=None, seed=0,
+                     episodes_per_shard=16, num_workers=None, context=None, policy_name=None):
+    """
+    Simulate `episodes` CSTRRLEnv episodes under a behavior policy and stream their
+    transitions (TRANSITION_DTYPE) into .npy shards of `episodes_per_shard` episodes
+    in the directory `path`, with a manifest.json describing the run and its shards.
+
+    Every shard is written by one worker process straight into a memory map, so memory
+    use is one environment and one shard mapping per worker, whatever the dataset size.
+    The manifest is rewritten after every completed shard. Calling generate_dataset
+    again with the same arguments resumes an interrupted run: shards already listed in
+    the manifest are skipped and every episode is seeded by (seed, episode index) only,
+    so the result is the same as an uninterrupted run.
+
+    Inputs:
+      policy: 'random' (new random gains every step), 'random_episode', 'pid' or a
+              picklable callable policy(obs, step, rng) -> normalized action
+      num_workers: worker processes (default: one per CPU); 0 runs in this process
+      policy_name: identifier of the policy in the manifest (default: describe_policy(policy));
+                   a resumed run must use the same one
+
+    Returns the manifest (dict).
+    """
+    env_kwargs = dict(env_kwargs or {})
+    behavior = make_policy(policy)
+    env = CSTRRLEnv(**dict(env_kwargs, record_history=False))
+    steps = _episode_length(env)
+    env.close()
+
+    config = {
+        'episodes': episodes,
+        'episodes_per_shard': episodes_per_shard,
+        'steps_per_episode': steps,
+        'seed': seed,
+        'policy': policy_name or describe_policy(policy),
+        'env_kwargs': _json_config(env_kwargs, 'env_kwargs'),
+        'dtype': [list(field) for field in np.lib.format.dtype_to_descr(TRANSITION_DTYPE)],
+    }
+    os.makedirs(path, exist_ok=True)
+    manifest_path = os.path.join(path, MANIFEST)
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest['config'] != json.loads(json.dumps(config)):
+            raise ValueError(f"{path} holds a dataset generated with a different configuration")
+    else:
+        manifest = {'config': config, 'shards': []}
+        _write_manifest(path, manifest)
+
+    done = {entry['file'] for entry in manifest['shards']}
+    tasks = [(path, index, start, min(start + episodes_per_shard, episodes), env_kwargs, behavior, seed)
+             for index, start in enumerate(range(0, episodes, episodes_per_shard))
+             if _shard_name(index) not in done]
+
+    def completed(entry):
+        manifest['shards'].append(entry)
+        manifest['shards'].sort(key=lambda e: e['episodes'][0])
+        _write_manifest(path, manifest)
+
+    num_workers = min(len(tasks), (os.cpu_count() or 1) if num_workers is None else num_workers)
+    if num_workers <= 1:
+        for task in tasks:
+            completed(_write_shard(task))
+    else:
+        with mp.get_context(context).Pool(num_workers) as pool:
+            for entry in pool.imap_unordered(_write_shard, tasks):
+                completed(entry)
+    return manifest
+
+
+
+##############################################
+# 4. Reading
+##############################################
+
+class OfflineDataset:
+    """
+    Read-only view of a dataset written by generate_dataset. Shards are memory-mapped
+    on first use, so only the rows that are actually read are loaded from disk.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, MANIFEST)) as f:
+            self.manifest = json.load(f)
+        self.entries = self.manifest['shards']
+        self._shards = [None] * len(self.entries)
+        self._offsets = np.cumsum([0] + [entry['rows'] for entry in self.entries])
+
+    def __len__(self):
+        return int(self._offsets[-1])
+
+    @property
+    def complete(self):
+        """
+        True once every episode of the configured run has been written.
+        """
+        return sum(stop - start for start, stop in (e['episodes'] for e in self.entries)) \
+            == self.manifest['config']['episodes']
+
+    def shard(self, i):
+        """
+        Memory map of shard i (a TRANSITION_DTYPE array).
+        """
+        if self._shards[i] is None:
+            self._shards[i] = np.load(os.path.join(self.path, self.entries[i]['file']), mmap_mode='r')
+        return self._shards[i]
+
+    def shards(self):
+        """
+        Iterate over the shard memory maps in episode order.
+        """
+        for i in range(len(self.entries)):
+            yield self.shard(i)
+
+    def rows(self, indices):
+        """
+        Transitions at global row indices (an array), read from the shards they live in.
+        """
+        indices = np.asarray(indices)
+        out = np.empty(indices.shape, dtype=TRANSITION_DTYPE)
+        shard_of = np.searchsorted(self._offsets, indices, side='right') - 1
+        for i in np.unique(shard_of):
+            selected = shard_of == i
+            out[selected] = self.shard(i)[indices[selected] - self._offsets[i]]
+        return out
+
+    def sample(self, batch_size, rng=None):
+        """
+        A batch of uniformly sampled transitions.
+        """
+        rng = np.random.default_rng(rng)
+        return self.rows(np.sort(rng.integers(0, len(self), batch_size)))
@@ -2,11 +2,32 @@
 # import 
 ###########################
 
+import functools
+import heapq
+import os
+import time
 import gymnasium as gym
 from gymnasium import spaces
-from scipy.integrate import odeint
+from gymnasium.vector import AutoresetMode, VectorEnv
+from gymnasium.vector.utils import batch_space
+from scipy.integrate import ode, odeint, BDF, DOP853, LSODA, ODEintWarning, RK23, RK45, Radau
+from scipy import sparse
 import numpy as np
-import matplotlib.pyplot as plt
+
+# matplotlib.pyplot is only imported when a figure is first rendered, so that
+# processes which only need the dynamics do not pay for it
+plt = None
+
+
+def _pyplot():
+    """
+    Import matplotlib.pyplot on first use.
+    """
+    global plt
+    if plt is None:
+        import matplotlib.pyplot
+        plt = matplotlib.pyplot
+    return plt
 
 
 
@@ -78,13 +99,179 @@ def cstr_dynamics(x, t, u, Tf, Caf):
     return np.array([dCadt, dCbdt, dCcdt, dTdt, dVdt])
 
 
+def batch_cstr_dynamics(x, t, u, params):
+    """
+    Vectorized version of CSTRRLEnv.custom_cstr_dynamics for a batch of N reactors.
+
+    Inputs:
+      x: array of shape (N, 5) with the states [Ca, Cb, Cc, T, V] of every reactor
+      t: time (unused, kept for odeint-style signatures)
+      u: array of shape (N, 2) with the control inputs [Tc, Fin] of every reactor
+      params: dict of arrays of shape (N,) with the uncertain process parameters
+              'Tf', 'Caf', 'UA', 'k0_AB' and 'k0_BC'
+
+    Returns an array of shape (N, 5) with the state derivatives.
+    """
+    # Unpack control inputs
+    Tc = u[:, 0]  # Cooling jacket temperature
+    Fin = u[:, 1] # Inlet flow rate
+
+    # Unpack state variables
+    Ca, Cb, Cc, T, V = x[:, 0], x[:, 1], x[:, 2], x[:, 3], x[:, 4]
+
+    # Process parameters with uncertainty
+    Tf = params['Tf']
+    Caf = params['Caf']
+    UA = params['UA']
+    k0_AB = params['k0_AB']
+    k0_BC = params['k0_BC']
+
+    # Fixed parameters
+    Fout = 100       # Outlet flow rate (m^3/min)
+    rho = 1000       # Density (kg/m^3)
+    Cp = 0.239       # Heat capacity (J/kg-K)
+
+    # Reaction A -> B parameters (Arrhenius kinetics)
+    mdelH_AB = 5e3   # Heat of reaction (J/mol)
+    EoverR_AB = 8750 # Activation energy over gas constant (K)
+    rA = k0_AB * np.exp(-EoverR_AB / T) * Ca
+
+    # Reaction B -> C parameters (Arrhenius kinetics)
+    mdelH_BC = 4e3    # Heat of reaction (J/mol)
+    EoverR_BC = 10750 # Activation energy over gas constant (K)
+    rB = k0_BC * np.exp(-EoverR_BC / T) * Cb
+
+    dxdt = np.empty_like(x)
+
+    # Material balances (mass derivatives)
+    dxdt[:, 0] = (Fin * Caf - Fout * Ca) / V - rA
+    dxdt[:, 1] = rA - rB - (Fout * Cb / V)
+    dxdt[:, 2] = rB - (Fout * Cc / V)
+
+    # Energy balance (temperature derivative)
+    dxdt[:, 3] = (Fin / V) * (Tf - T) \
+                 + (mdelH_AB / (rho * Cp)) * rA \
+                 + (mdelH_BC / (rho * Cp)) * rB \
+                 + (UA / (V * rho * Cp)) * (Tc - T)
+
+    # Volume balance (volume derivative)
+    dxdt[:, 4] = Fin - Fout
+
+    return dxdt
+
+
+
+
+def _cstr_jacobian(x, u, Tf, Caf, UA, k0_AB, k0_BC, wrt_inputs=False):
+    """
+    Closed-form Jacobian of the CSTR right-hand side, shared by the single and batched models.
+
+    x has shape (..., 5) and u shape (..., 2); the parameters are scalars or arrays broadcastable
+    to x.shape[:-1]. Returns d(dx/dt)/dx with shape (..., 5, 5), or d(dx/dt)/du with shape
+    (..., 5, 2) if wrt_inputs is True.
+    """
+    # Unpack control inputs and state variables
+    Tc, Fin = u[..., 0], u[..., 1]
+    Ca, Cb, Cc, T, V = x[..., 0], x[..., 1], x[..., 2], x[..., 3], x[..., 4]
+
+    # Fixed parameters
+    Fout = 100       # Outlet flow rate (m^3/min)
+    rho = 1000       # Density (kg/m^3)
+    Cp = 0.239       # Heat capacity (J/kg-K)
+    mdelH_AB = 5e3   # Heat of reaction A -> B (J/mol)
+    EoverR_AB = 8750 # Activation energy over gas constant A -> B (K)
+    mdelH_BC = 4e3   # Heat of reaction B -> C (J/mol)
+    EoverR_BC = 10750# Activation energy over gas constant B -> C (K)
+
+    if wrt_inputs:
+        J = np.zeros(x.shape[:-1] + (5, 2))
+        # Tc only enters the cooling term of the energy balance
+        J[..., 3, 0] = UA / (V * rho * Cp)
+        # Fin enters the feed terms and the volume balance
+        J[..., 0, 1] = Caf / V
+        J[..., 3, 1] = (Tf - T) / V
+        J[..., 4, 1] = 1.0
+        return J
+
+    # Arrhenius rate constants, reaction rates and their temperature sensitivities
+    kA = k0_AB * np.exp(-EoverR_AB / T)
+    kB = k0_BC * np.exp(-EoverR_BC / T)
+    drA_dT = kA * Ca * EoverR_AB / T**2
+    drB_dT = kB * Cb * EoverR_BC / T**2
+
+    J = np.zeros(x.shape[:-1] + (5, 5))
+
+    # dCa/dt = (Fin * Caf - Fout * Ca) / V - rA
+    J[..., 0, 0] = -Fout / V - kA
+    J[..., 0, 3] = -drA_dT
+    J[..., 0, 4] = -(Fin * Caf - Fout * Ca) / V**2
+
+    # dCb/dt = rA - rB - Fout * Cb / V
+    J[..., 1, 0] = kA
+    J[..., 1, 1] = -kB - Fout / V
+    J[..., 1, 3] = drA_dT - drB_dT
+    J[..., 1, 4] = Fout * Cb / V**2
+
+    # dCc/dt = rB - Fout * Cc / V
+    J[..., 2, 1] = kB
+    J[..., 2, 2] = -Fout / V
+    J[..., 2, 3] = drB_dT
+    J[..., 2, 4] = Fout * Cc / V**2
+
+    # dT/dt = Fin / V * (Tf - T) + heats of reaction + UA / (V * rho * Cp) * (Tc - T)
+    J[..., 3, 0] = (mdelH_AB / (rho * Cp)) * kA
+    J[..., 3, 1] = (mdelH_BC / (rho * Cp)) * kB
+    J[..., 3, 3] = (-Fin / V
+                    + (mdelH_AB / (rho * Cp)) * drA_dT
+                    + (mdelH_BC / (rho * Cp)) * drB_dT
+                    - UA / (V * rho * Cp))
+    J[..., 3, 4] = -(Fin / V**2) * (Tf - T) - (UA / (V**2 * rho * Cp)) * (Tc - T)
+
+    # dV/dt = Fin - Fout does not depend on the state
+    return J
+
+
+def cstr_jacobian(x, t, u, Tf, Caf):
+    """
+    Analytic Jacobian d(dx/dt)/dx of cstr_dynamics, shape (5, 5).
+    Can be passed to odeint as Dfun with the same args as cstr_dynamics.
+    """
+    # Same fixed parameters as cstr_dynamics (which uses Tf = 350 regardless of its argument)
+    return _cstr_jacobian(np.asarray(x, dtype=np.float64), np.asarray(u, dtype=np.float64),
+                          350, Caf, 5e4, 7.2e10, 8.2e10)
+
+
+def cstr_input_jacobian(x, t, u, Tf, Caf):
+    """
+    Analytic Jacobian d(dx/dt)/du of cstr_dynamics with respect to u = [Tc, Fin], shape (5, 2).
+    """
+    return _cstr_jacobian(np.asarray(x, dtype=np.float64), np.asarray(u, dtype=np.float64),
+                          350, Caf, 5e4, 7.2e10, 8.2e10, wrt_inputs=True)
+
+
+def batch_cstr_jacobian(x, t, u, params):
+    """
+    Analytic Jacobians of batch_cstr_dynamics with respect to the states, shape (N, 5, 5).
+    """
+    return _cstr_jacobian(x, u, params['Tf'], params['Caf'], params['UA'],
+                          params['k0_AB'], params['k0_BC'])
+
+
+def batch_cstr_input_jacobian(x, t, u, params):
+    """
+    Analytic Jacobians of batch_cstr_dynamics with respect to u = [Tc, Fin], shape (N, 5, 2).
+    """
+    return _cstr_jacobian(x, u, params['Tf'], params['Caf'], params['UA'],
+                          params['k0_AB'], params['k0_BC'], wrt_inputs=True)
+
+
 
 
 ##############################################
 # 2. Vector-Form PID Controller
 ##############################################
 
-def PID_velocity(Ks, e, e_history, u_prev, dt):
+def PID_velocity(Ks, e, e_history, u_prev, dt, out=None):
     """
     Computes the control update using two velocity-form PID controllers.
     PID controller 1 [Kp_Cb, Ki_Cb, Kd_Cb] controls the concentration of B
@@ -96,6 +283,7 @@ def PID_velocity(Ks, e, e_history, u_prev, dt):
       e_history: array of previous errors; must contain at least two previous error values
       u_prev: the previous control action (array: [Tc, Fin])
       dt: time step
+      out: optional array of shape (2,) the result is written into (and returned)
       
     The velocity-form PID update calculates the change in control signal and adds it to the previous control.
     The control update is clamped within operational limits.
@@ -115,25 +303,1005 @@ def PID_velocity(Ks, e, e_history, u_prev, dt):
                   + (Kp_Cb / Ki_Cb) * e[0] * dt
                   - Kp_Cb * Kd_Cb * (e[0] - 2 * e_history[-1, 0] + e_history[-2, 0]) / dt)
     Tc = u_prev[-1][0] + delta_u_Cb
-    # Clamp Tc within operational limits (e.g., 290 to 450 K)
-    Tc = np.clip(Tc, 290, 450)
     
     # Calculate control update for inlet flow rate (Fin) for the V loop
     delta_u_V = (Kp_V * (e[1] - e_history[-1, 1])
                  + (Kp_V / Ki_V) * e[1] * dt
                  - Kp_V * Kd_V * (e[1] - 2 * e_history[-1, 1] + e_history[-2, 1]) / dt)
     Fin = u_prev[-1][1] + delta_u_V
-    # Clamp Fin within operational limits (e.g., 95 to 105 m^3/min)
-    Fin = np.clip(Fin, 95, 105)
     
-    return np.array([Tc, Fin])
+    # Clamp Tc (290 to 450 K) and Fin (95 to 105 m^3/min) within operational limits,
+    # both in one call
+    if out is None:
+        out = np.empty(2)
+    out[0] = Tc
+    out[1] = Fin
+    return np.clip(out, U_LOWER, U_UPPER, out=out)
+
+
+# Operational limits of the control inputs [Tc, Fin] used by the PID clamps
+U_LOWER = np.array([290.0, 95.0])
+U_UPPER = np.array([450.0, 105.0])
+
+
+def PID_velocity_batch(Ks, e, e_history, u_prev, dt):
+    """
+    Vectorized version of PID_velocity for a batch of N reactors.
+
+    Inputs:
+      Ks: array of shape (N, 6) with the PID gains [Kp_Cb, Ki_Cb, Kd_Cb, Kp_V, Ki_V, Kd_V]
+      e: array of shape (N, 2) with the current errors [e_Cb, e_V]
+      e_history: array of shape (N, H, 2) with previous errors (H >= 2, most recent last)
+      u_prev: array of shape (N, H, 2) with previous control actions (most recent last)
+      dt: time step
+
+    Returns an array of shape (N, 2) with the clamped control actions [Tc, Fin].
+    """
+    # Gains arranged as (N, 2) so that column 0 is the Cb-loop and column 1 the V-loop
+    Kp = Ks[:, 0::3]
+    Ki = Ks[:, 1::3] + 1e-8  # Avoid division by zero
+    Kd = Ks[:, 2::3] + 1e-8
+
+    e_1 = e_history[:, -1]
+    e_2 = e_history[:, -2]
+
+    # Velocity (delta) form of PID for both loops at once
+    delta_u = (Kp * (e - e_1)
+               + (Kp / Ki) * e * dt
+               - Kp * Kd * (e - 2 * e_1 + e_2) / dt)
+    u = u_prev[:, -1] + delta_u
+
+    # Clamp Tc and Fin within operational limits
+    return np.clip(u, U_LOWER, U_UPPER)
+
+
+
+##############################################
+# 3. ODE Integrator Backends
+##############################################
+
+# solve_ivp solver classes usable by PersistentIVPIntegrator
+IVP_METHODS = {'RK23': RK23, 'RK45': RK45, 'DOP853': DOP853, 'Radau': Radau, 'BDF': BDF, 'LSODA': LSODA}
+
+
+class IntegrationError(RuntimeError):
+    """
+    An integrator backend could not advance the reactor over a control interval.
+    """
+
+
+# Numerical failures of a simulation step (see CSTR_parallel): backend failures, singular
+# linear systems (RosenbrockIntegrator), odeint warnings promoted to errors and non-finite states
+INTEGRATION_ERRORS = (IntegrationError, np.linalg.LinAlgError, ODEintWarning, FloatingPointError)
+
+
+class Integrator:
+    """
+    Base class of the integrator backends used to advance the reactor over one control interval.
+
+    An integrator advances x(0) to x(dt) for an odeint-style right-hand side fun(x, t, *args).
+    x may be a single state of shape (5,) or a batch of states of shape (N, 5), in which case
+    fun must accept and return arrays of that shape.
+
+    Every backend counts its right-hand side evaluations:
+      nfev: total RHS evaluations since construction (or the last reset_stats call)
+      last_nfev: RHS evaluations used by the most recent integrate call
+      last_stats: solver statistics of the most recent integrate call (at least 'nfev';
+                  odeint adds 'nje', 'nst', 'mused' and 'hu' from its infodict)
+    """
+    name = None
+
+    def __init__(self):
+        self.reset_stats()
+
+    def reset_stats(self):
+        """
+        Clear the RHS evaluation counters.
+        """
+        self.nfev = 0
+        self.last_nfev = 0
+        self.last_stats = {'nfev': 0}
+
+    def integrate(self, fun, x, dt, args=(), jac=None, params=None):
+        """
+        Return the state after integrating fun from 0 to dt starting at x.
+        jac(x, t, *args) optionally supplies the Jacobian of fun with respect to x.
+        args[0] is the control input u, and params the process parameters (a dict of
+        scalars, or of (N,) arrays for a batch); the numerical backends only need fun,
+        data-driven backends (CSTR_surrogate) use u and params instead.
+        """
+        raise NotImplementedError
+
+    def session(self, fun, x, dt, jac=None):
+        """
+        Integrator session over consecutive control intervals of length dt starting at x:
+        session.advance(args, params) integrates the next interval and returns its end
+        state, so the caller can update the control between intervals (action repeat).
+        This default restarts the backend on every interval; the adaptive backends
+        (odeint, ivp) continue one solver run across the intervals instead.
+        """
+        return RestartSession(self, fun, x, dt, jac)
+
+    def get_state(self):
+        """
+        State carried from one integrate call to the next (None for stateless backends),
+        saved and restored by CSTRRLEnv.get_state()/set_state().
+        """
+        return None
+
+    def set_state(self, state):
+        pass
+
+    def _count(self, nfev):
+        self.last_stats = {'nfev': nfev}
+        self.last_nfev = nfev
+        self.nfev += nfev
+
+
+def _flatten_batch(fun, shape):
+    """
+    Wrap a batched right-hand side so that it works on the flattened state vector.
+    """
+    def flat_fun(y, t, *args):
+        return fun(y.reshape(shape), t, *args).ravel()
+    return flat_fun
+
+
+def _banded_batch_jacobian(jac, shape):
+    """
+    Wrap a batched Jacobian (N, n, n) as the banded Jacobian odeint expects for the flattened,
+    block-diagonal system: banded[i - j + mu, j] = J[i, j] with mu = ml = n - 1.
+    """
+    N, n = shape
+    i, j = np.indices((n, n))
+    band_rows = (i - j + n - 1).ravel()
+    band_cols = (np.arange(N)[:, None] * n + j.ravel()).ravel()
+    band_rows = np.tile(band_rows, N)
+
+    def banded_jac(y, t, *args):
+        banded = np.zeros((2 * n - 1, N * n))
+        banded[band_rows, band_cols] = jac(y.reshape(shape), t, *args).ravel()
+        return banded
+    return banded_jac
+
+
+class OdeintIntegrator(Integrator):
+    """
+    Reference backend: scipy.integrate.odeint (LSODA), restarted on every control interval.
+    Batches are integrated as one block-diagonal system with a banded Jacobian.
+    """
+    name = 'odeint'
+
+    def __init__(self, rtol=None, atol=None):
+        self.rtol = rtol
+        self.atol = atol
+        super(OdeintIntegrator, self).__init__()
+
+    def integrate(self, fun, x, dt, args=(), jac=None, params=None):
+        if x.ndim == 1:
+            y, info = odeint(fun, x, [0, dt], args=args, Dfun=jac, full_output=True,
+                             rtol=self.rtol, atol=self.atol)
+            self._count_odeint(info)
+            return y[1]
+
+        # Block-diagonal batch: the Jacobian bandwidth is the size of one block
+        band = x.shape[1] - 1
+        if jac is not None:
+            jac = _banded_batch_jacobian(jac, x.shape)
+        y, info = odeint(_flatten_batch(fun, x.shape), x.ravel(), [0, dt], args=args, Dfun=jac,
+                         full_output=True, rtol=self.rtol, atol=self.atol, ml=band, mu=band)
+        self._count_odeint(info)
+        return y[1].reshape(x.shape)
+
+    def session(self, fun, x, dt, jac=None):
+        if x.ndim > 1:
+            return RestartSession(self, fun, x, dt, jac)
+        return LsodaSession(self, fun, x, dt, jac, self.rtol, self.atol)
+
+    def _count_odeint(self, info):
+        """
+        Count RHS evaluations and keep the LSODA statistics of the interval: Jacobian
+        evaluations, internal steps, method used at the end (1: Adams, 2: BDF) and last step size.
+        """
+        self._count(int(info['nfe'][-1]))
+        self.last_stats.update(nje=int(info['nje'][-1]), nst=int(info['nst'][-1]),
+                               mused=int(info['mused'][-1]), hu=float(info['hu'][-1]))
+
+
+class RK4Integrator(Integrator):
+    """
+    Fast explicit backend: classic fixed-step Runge-Kutta 4 with `substeps` steps per interval.
+    Costs exactly 4 * substeps RHS evaluations, but is only accurate for non-stiff operation.
+    """
+    name = 'rk4'
+
+    def __init__(self, substeps=4):
+        self.substeps = substeps
+        super(RK4Integrator, self).__init__()
+
+    def integrate(self, fun, x, dt, args=(), jac=None, params=None):
+        h = dt / self.substeps
+        t = 0.0
+        for _ in range(self.substeps):
+            k1 = fun(x, t, *args)
+            k2 = fun(x + 0.5 * h * k1, t + 0.5 * h, *args)
+            k3 = fun(x + 0.5 * h * k2, t + 0.5 * h, *args)
+            k4 = fun(x + h * k3, t + h, *args)
+            x = x + (h / 6) * (k1 + 2 * k2 + 2 * k3 + k4)
+            t += h
+        self._count(4 * self.substeps)
+        return x
+
+
+class RosenbrockIntegrator(Integrator):
+    """
+    Stiff backend: the A-stable, second order, linearly implicit Rosenbrock scheme ROS2
+    with `substeps` fixed steps per interval.
+
+    Each step solves two linear systems with W = I - gamma * h * J, so it stays stable in the
+    stiff Arrhenius regime without Newton iterations. The Jacobian is taken from `jac` when
+    given and otherwise approximated by forward differences (which costs extra RHS calls).
+    """
+    name = 'rosenbrock'
+
+    # gamma = 1 - 1/sqrt(2) has a much smaller error constant than the L-stable 1 + 1/sqrt(2)
+    gamma = 1 - 1 / np.sqrt(2)
+
+    def __init__(self, substeps=4, fd_eps=1e-7):
+        self.substeps = substeps
+        self.fd_eps = fd_eps
+        super(RosenbrockIntegrator, self).__init__()
+
+    def integrate(self, fun, x, dt, args=(), jac=None, params=None):
+        h = dt / self.substeps
+        t = 0.0
+        nfev = 0
+        eye = np.eye(x.shape[-1])
+        for _ in range(self.substeps):
+            f0 = fun(x, t, *args)
+            if jac is None:
+                J = self._fd_jacobian(fun, x, t, f0, args)
+                nfev += x.shape[-1]
+            else:
+                J = jac(x, t, *args)
+            W_inv = np.linalg.inv(eye - self.gamma * h * J)
+            k1 = np.einsum('...ij,...j->...i', W_inv, f0)
+            f1 = fun(x + h * k1, t + h, *args)
+            k2 = np.einsum('...ij,...j->...i', W_inv, f1 - 2 * k1)
+            x = x + (1.5 * h) * k1 + (0.5 * h) * k2
+            t += h
+            nfev += 2
+        self._count(nfev)
+        return x
+
+    def _fd_jacobian(self, fun, x, t, f0, args):
+        """
+        Forward-difference Jacobian, perturbing one state component (of every batch row) per call.
+        """
+        n = x.shape[-1]
+        J = np.empty(x.shape + (n,))
+        for j in range(n):
+            step = self.fd_eps * np.maximum(np.abs(x[..., j]), 1.0)
+            x_j = x.copy()
+            x_j[..., j] += step
+            J[..., j] = (fun(x_j, t, *args) - f0) / step[..., None]
+        return J
+
+
+def _ivp_solver(method, fun, x, t_bound, get_args, jac=None, first_step=None, rtol=1e-6, atol=1e-8):
+    """
+    A solve_ivp solver instance (IVP_METHODS[method]) for an odeint-style right-hand side
+    fun(x, t, *args) from x at t = 0 to t_bound. The arguments are read through get_args()
+    on every evaluation, so that a SolverSession can change them between intervals.
+    Batches are flattened, with a banded (LSODA) or sparse Jacobian.
+    """
+    shape = x.shape
+    options = {}
+    uses_jac = jac is not None and method in ('Radau', 'BDF', 'LSODA')
+    if x.ndim > 1:
+        # Block-diagonal batch: flatten, and keep the Jacobian banded (LSODA) or sparse
+        fun = _flatten_batch(fun, shape)
+        if method == 'LSODA':
+            options = {'lband': shape[1] - 1, 'uband': shape[1] - 1}
+            if uses_jac:
+                banded_jac = _banded_batch_jacobian(jac, shape)
+                options['jac'] = lambda t, y: banded_jac(y, t, *get_args())
+        elif uses_jac:
+            options['jac'] = lambda t, y: sparse.block_diag(jac(y.reshape(shape), t, *get_args()),
+                                                            format='csc')
+    elif uses_jac:
+        options['jac'] = lambda t, y: jac(y, t, *get_args())
+
+    return IVP_METHODS[method](lambda t, y: fun(y, t, *get_args()), 0.0, x.ravel(), t_bound,
+                               first_step=first_step, rtol=rtol, atol=atol, **options)
+
+
+class RestartSession:
+    """
+    Default Integrator.session: every interval is a separate integrate() call.
+    """
+    def __init__(self, integrator, fun, x, dt, jac=None):
+        self.integrator = integrator
+        self.fun = fun
+        self.x = x
+        self.dt = dt
+        self.jac = jac
+
+    def advance(self, args=(), params=None):
+        self.x = self.integrator.integrate(self.fun, self.x, self.dt, args, self.jac, params)
+        return self.x
+
+
+class SolverSession:
+    """
+    One continuous solve_ivp solver run over consecutive control intervals of length dt.
+
+    advance(args) integrates the next interval with the arguments (control input) args.
+    The end of the solver's range is moved to every control instant in turn, so no step
+    crosses an instant where the input jumps, but the step size and (for the multistep
+    methods) the history carry over from one interval to the next instead of being
+    rebuilt from scratch. The process parameters are read by fun itself.
+    """
+    def __init__(self, integrator, method, fun, x, dt, jac=None, first_step=None, rtol=1e-6,
+                 atol=1e-8, on_interval=None):
+        self.integrator = integrator
+        self.method = method
+        self.dt = dt
+        self.shape = x.shape
+        self.on_interval = on_interval
+        self._args = ()
+        self._intervals = 0
+        self.solver = _ivp_solver(method, fun, x, dt, lambda: self._args, jac, first_step, rtol, atol)
+
+    def advance(self, args=(), params=None):
+        solver = self.solver
+        self._args = args
+        self._intervals += 1
+        if self._intervals > 1:
+            _extend_solver(solver, self._intervals * self.dt)
+
+        nfev = solver.nfev
+        while solver.status == 'running':
+            solver.step()
+        if solver.status == 'failed':
+            raise IntegrationError(f"{self.method} integration failed over one control interval")
+
+        if self.on_interval is not None:
+            self.on_interval(solver)
+        self.integrator._count(solver.nfev - nfev)
+        return solver.y.reshape(self.shape).copy()
+
+
+class LsodaSession:
+    """
+    Session of OdeintIntegrator: the LSODA code behind odeint, resumed on every interval.
+
+    odeint itself always starts a new LSODA run, so the session drives ODEPACK's LSODA
+    through scipy.integrate.ode in its tcrit mode (itask=4, as scipy's own LSODA solver
+    class does with itask=5): each advance() integrates up to the next control instant
+    in one call, without stepping past it, and keeps the step size, order and history.
+    """
+    def __init__(self, integrator, fun, x, dt, jac=None, rtol=None, atol=None):
+        self.integrator = integrator
+        self.dt = dt
+        self._args = ()
+        self._intervals = 0
+        self._nfev = 0
+
+        def rhs(t, y):
+            self._nfev += 1
+            return fun(y, t, *self._args)
+
+        self.ode = ode(rhs, None if jac is None else lambda t, y: jac(y, t, *self._args))
+        # odeint's default tolerances
+        self.ode.set_integrator('lsoda', rtol=1.49012e-8 if rtol is None else rtol,
+                                atol=1.49012e-8 if atol is None else atol)
+        self.ode.set_initial_value(x, 0.0)
+        self._lsoda = self.ode._integrator
+        self._lsoda.call_args[2] = 4 # itask=4: integrate to tout without passing tcrit = rwork[0]
+
+    def advance(self, args=(), params=None):
+        self._args = args
+        self._intervals += 1
+        t = self._intervals * self.dt
+        self._lsoda.rwork[0] = t
+        nfev = self._nfev
+        y = self.ode.integrate(t)
+        if not self.ode.successful():
+            raise IntegrationError(f"LSODA integration failed over one control interval "
+                                   f"(istate {self.ode.get_return_code()})")
+        self.integrator._count(self._nfev - nfev)
+        return y.copy()
+
+
+def _extend_solver(solver, t_bound):
+    """
+    Let a solve_ivp solver that reached its t_bound continue up to a later t_bound.
+    """
+    solver.t_bound = t_bound
+    solver.status = 'running'
+    if isinstance(solver, LSODA):
+        # LSODA stops at t_bound through ODEPACK's critical time (itask=5), which the
+        # solver keeps in rwork[0] (as set by scipy's LSODA.__init__)
+        solver._lsoda_solver._integrator.rwork[0] = t_bound
+
+
+class PersistentIVPIntegrator(Integrator):
+    """
+    Adaptive backend built on the solve_ivp solver classes (LSODA, BDF, Radau, RK45, ...).
+
+    Unlike odeint, which searches for a step size from scratch on every control interval,
+    this backend starts each interval with the step size the previous interval ended with,
+    so a smooth trajectory costs only a few RHS evaluations per interval.
+    """
+    name = 'ivp'
+
+    def __init__(self, method='LSODA', rtol=1e-6, atol=1e-8):
+        self.method = method
+        self.rtol = rtol
+        self.atol = atol
+        self.step_size = None
+        super(PersistentIVPIntegrator, self).__init__()
+
+    def integrate(self, fun, x, dt, args=(), jac=None, params=None):
+        first_step = None if self.step_size is None else min(self.step_size, dt)
+        solver = _ivp_solver(self.method, fun, x, dt, lambda: args, jac, first_step,
+                             self.rtol, self.atol)
+        while solver.status == 'running':
+            solver.step()
+        if solver.status == 'failed':
+            raise IntegrationError(f"{self.method} integration failed over one control interval")
+
+        self._keep_step_size(solver)
+        self._count(solver.nfev)
+        return solver.y.reshape(x.shape)
+
+    def session(self, fun, x, dt, jac=None):
+        first_step = None if self.step_size is None else min(self.step_size, dt)
+        return SolverSession(self, self.method, fun, x, dt, jac, first_step, self.rtol, self.atol,
+                             on_interval=self._keep_step_size)
+
+    def _keep_step_size(self, solver):
+        # Keep the step size the solver would take next, not the one truncated at the interval end
+        self.step_size = getattr(solver, 'h_abs', None) or solver.step_size
+
+    def get_state(self):
+        return self.step_size
+
+    def set_state(self, state):
+        self.step_size = state
+
+
+# Registry of the available integrator backends
+INTEGRATORS = {
+    OdeintIntegrator.name: OdeintIntegrator,
+    RK4Integrator.name: RK4Integrator,
+    RosenbrockIntegrator.name: RosenbrockIntegrator,
+    PersistentIVPIntegrator.name: PersistentIVPIntegrator,
+}
+
+
+def make_integrator(integrator='odeint', **options):
+    """
+    Create an integrator backend from its name ('odeint', 'rk4', 'rosenbrock' or 'ivp')
+    and backend options. An existing Integrator instance is returned unchanged.
+    """
+    if isinstance(integrator, Integrator):
+        return integrator
+    if integrator not in INTEGRATORS:
+        raise ValueError(f"Unknown integrator '{integrator}', expected one of {sorted(INTEGRATORS)}")
+    return INTEGRATORS[integrator](**options)
+
+
+
+##############################################
+# 4. Fixed-size Buffers and Trajectory Recording
+##############################################
+
+class RingBuffer:
+    """
+    A preallocated, array-backed circular buffer of fixed capacity.
+
+    Used for the delay lines and PID histories so that stepping costs the same and
+    uses the same memory at any episode length. Items are indexed chronologically:
+    buffer[0] is the oldest item and buffer[-1] the most recent one, and extra indices
+    select within an item (buffer[-1, 0] is the first component of the newest item).
+    """
+    def __init__(self, capacity, item_shape=(), dtype=np.float64):
+        self.capacity = capacity
+        self.data = np.zeros((capacity,) + tuple(item_shape), dtype=dtype)
+        self.head = 0 # slot of the oldest item
+
+    def __len__(self):
+        return self.capacity
+
+    def __getitem__(self, index):
+        if isinstance(index, tuple):
+            return self.data[((self.head + index[0]) % self.capacity,) + index[1:]]
+        return self.data[(self.head + index) % self.capacity]
+
+    def __array__(self, dtype=None, copy=None):
+        array = self.to_array()
+        return array if dtype is None else array.astype(dtype)
+
+    def to_array(self):
+        """
+        Return a chronologically ordered copy of the buffer contents.
+        """
+        return np.roll(self.data, -self.head, axis=0)
+
+    def fill(self, item):
+        """
+        Set every slot of the buffer to `item`.
+        """
+        self.data[...] = item
+        self.head = 0
+
+    def push(self, item, out=None):
+        """
+        Append `item` and return (a copy of) the oldest item it replaces, written into
+        `out` when given.
+        """
+        if out is None:
+            evicted = self.data[self.head].copy()
+        else:
+            evicted = out
+            evicted[...] = self.data[self.head]
+        self.data[self.head] = item
+        self.head = (self.head + 1) % self.capacity
+        return evicted
+
+
+
+# Fields of one recorded time step (true values, for visualization and offline analysis)
+TRAJECTORY_DTYPE = np.dtype([
+    ('time', np.float64),
+    ('Cb', np.float64),
+    ('T', np.float64),
+    ('V', np.float64),
+    ('Tc', np.float64),
+    ('Fin', np.float64),
+    ('setpoint_Cb', np.float64),
+    ('setpoint_V', np.float64),
+])
+
+
+class TrajectoryRecorder:
+    """
+    Records one episode into a preallocated structured array (TRAJECTORY_DTYPE).
+
+    Fields are read like the columns of a dict, e.g. recorder['Cb'], and are views into
+    the recorded rows. If `path` is given the array is a .npy memory map at that path,
+    so the episode is written to disk as it is recorded without any extra copy.
+    """
+    def __init__(self, capacity, path=None):
+        self.path = path
+        self.size = 0
+        self.data = self._allocate(max(1, capacity))
+
+    def _allocate(self, capacity):
+        if self.path is None:
+            return np.zeros(capacity, dtype=TRAJECTORY_DTYPE)
+        return np.lib.format.open_memmap(self.path, mode='w+', dtype=TRAJECTORY_DTYPE,
+                                         shape=(capacity,))
+
+    @property
+    def capacity(self):
+        return self.data.shape[0]
+
+    @property
+    def records(self):
+        """
+        View of the recorded rows.
+        """
+        return self.data[:self.size]
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, field):
+        return self.data[field][:self.size]
+
+    def keys(self):
+        return TRAJECTORY_DTYPE.names
+
+    def clear(self):
+        """
+        Start a new episode, reusing the allocated storage.
+        """
+        self.size = 0
+
+    def record(self, time, Cb, T, V, Tc, Fin, setpoint_Cb, setpoint_V):
+        """
+        Append one time step, doubling the storage if it is full.
+        """
+        if self.size == self.capacity:
+            self._grow()
+        self.data[self.size] = (time, Cb, T, V, Tc, Fin, setpoint_Cb, setpoint_V)
+        self.size += 1
+
+    def extend(self, rows):
+        """
+        Append several time steps at once (a TRAJECTORY_DTYPE array).
+        """
+        while self.size + len(rows) > self.capacity:
+            self._grow()
+        self.data[self.size:self.size + len(rows)] = rows
+        self.size += len(rows)
+
+    def _grow(self):
+        old = self.data
+        if self.path is None:
+            self.data = self._allocate(2 * old.shape[0])
+            self.data[:old.shape[0]] = old
+            return
+
+        # Memory-mapped: build the larger file next to the old one, then swap it in
+        path, self.path = self.path, self.path + '.grow.npy'
+        self.data = self._allocate(2 * old.shape[0])
+        self.data[:old.shape[0]] = old
+        self.data.flush()
+        del old
+        os.replace(self.path, path)
+        self.path = path
+
+    def flush(self):
+        """
+        Write the recorded rows of a memory-mapped recorder to disk.
+        """
+        if self.path is not None:
+            self.data.flush()
+
+    def finalize(self):
+        """
+        Flush a memory-mapped recorder and trim its file to the recorded rows.
+        """
+        if self.path is None:
+            return
+        self.flush()
+        if self.size < self.capacity:
+            np.save(self.path + '.trim.npy', self.records)
+            self.data = self.data[:self.size]
+            os.replace(self.path + '.trim.npy', self.path)
+
+    def save(self, path):
+        """
+        Save the recorded episode as a .npy file. The rows are written directly
+        from the recorder storage, without copying them first.
+        """
+        np.save(path, self.records)
+
+
+
+class StepProfiler:
+    """
+    Opt-in instrumentation of CSTRRLEnv.step: wall time of every phase of a step and the
+    solver statistics of the integrator, per step and aggregated over the episode.
+
+    The step calls start() once and lap(phase) at the end of every phase, and end_step()
+    once the step is done; each lap costs one perf_counter call.
+    """
+    phases = ('pid', 'delay', 'disturbance', 'integrate', 'measurement', 'observation', 'record')
+
+    def __init__(self):
+        self.last_episode = None # summary() of the previous episode
+        self.reset()
+
+    def reset(self):
+        """
+        Start aggregating a new episode (the summary of the current one is kept in last_episode).
+        """
+        if getattr(self, 'steps', 0):
+            self.last_episode = self.summary()
+        self.steps = 0
+        self.totals = dict.fromkeys(self.phases, 0.0)
+        self.solver = {'nfev': 0, 'nje': 0, 'nst': 0, 'max_nst': 0, 'max_nfev': 0,
+                       'stiff_steps': 0, 'method_switches': 0}
+        self._method = None
+        self.step_times = {}
+
+    def start(self):
+        self.step_times = {}
+        self._t = time.perf_counter()
+
+    def lap(self, phase):
+        t = time.perf_counter()
+        self.step_times[phase] = t - self._t
+        self._t = t
+
+    def end_step(self, stats):
+        """
+        Aggregate the current step with the integrator statistics `stats`
+        (Integrator.last_stats) and return the per-step record.
+        """
+        self.steps += 1
+        for phase, elapsed in self.step_times.items():
+            self.totals[phase] += elapsed
+
+        solver = self.solver
+        solver['nfev'] += stats['nfev']
+        solver['max_nfev'] = max(solver['max_nfev'], stats['nfev'])
+        if 'nst' in stats:
+            solver['nje'] += stats['nje']
+            solver['nst'] += stats['nst']
+            solver['max_nst'] = max(solver['max_nst'], stats['nst'])
+            solver['stiff_steps'] += stats['mused'] == 2
+            if self._method is not None and stats['mused'] != self._method:
+                solver['method_switches'] += 1
+            self._method = stats['mused']
+
+        return {'times': self.step_times, 'solver': stats}
+
+    def summary(self):
+        """
+        Aggregate of the episode so far: total, mean and fraction of the time spent in every
+        phase, and the solver totals (stiff_steps counts steps that ended on the BDF method,
+        method_switches the Adams/BDF changes between steps, max_nst the most internal
+        steps taken in one step).
+        """
+        total = sum(self.totals.values())
+        return {
+            'steps': self.steps,
+            'time_total': total,
+            'phase_time': dict(self.totals),
+            'phase_mean': {phase: t / max(1, self.steps) for phase, t in self.totals.items()},
+            'phase_fraction': {phase: t / total if total else 0.0 for phase, t in self.totals.items()},
+            'solver': dict(self.solver),
+        }
+
+
+
+##############################################
+# 5. Disturbance Scheduling
+##############################################
+
+# Disturbance types, indexed by the codes reported in VectorCSTREnv infos
+DISTURBANCE_NAMES = (
+    "Feed temperature disturbance",
+    "Feed concentration disturbance",
+    "Cooling system upset",
+)
+
+# Process parameter perturbed by each disturbance type
+DISTURBANCE_PARAMS = ('Tf', 'Caf', 'UA')
+
+# Steps a cooling system upset lasts before UA is restored
+COOLING_UPSET_STEPS = 3
+
+# One timed parameter perturbation (kind >= 0, the disturbance type) or restoration
+# (kind == -1, which divides the parameter by the factor of the upset it ends)
+DISTURBANCE_EVENT_DTYPE = np.dtype([
+    ('step', np.int64),
+    ('kind', np.int8),
+    ('param', np.int8),    # index into DISTURBANCE_PARAMS
+    ('factor', np.float64),
+])
+
+
+def disturbance_steps(simulation_steps, interval, spacing='doubling'):
+    """
+    Simulation steps of the disturbance events of an episode.
+
+    Inputs:
+      spacing: 'doubling' (the original timing: after an event at step t the next one
+               is due at 2 * t + interval, i.e. at interval, 3 * interval, 7 * interval, ...)
+               or 'periodic' (every `interval` steps)
+    """
+    if interval <= 0:
+        raise ValueError(f"disturbance_interval must be positive, got {interval}")
+    if spacing == 'periodic':
+        return np.arange(interval, simulation_steps, interval, dtype=np.int64)
+    if spacing != 'doubling':
+        raise ValueError(f"Unknown disturbance spacing '{spacing}', expected 'doubling' or 'periodic'")
+    steps = []
+    step = interval
+    while step < simulation_steps:
+        steps.append(step)
+        step += step + interval
+    return np.array(steps, dtype=np.int64)
+
+
+def disturbance_schedule(steps, types, draws):
+    """
+    Whole-episode event array (DISTURBANCE_EVENT_DTYPE) for disturbances of the given
+    types (indices into DISTURBANCE_NAMES) and uniform magnitude draws at `steps`, plus
+    the restoration of every cooling system upset COOLING_UPSET_STEPS later. Events are
+    sorted by step, with disturbances before restorations at the same step.
+    """
+    n = len(steps)
+    types = np.asarray(types[:n], dtype=np.int8)
+    draws = np.asarray(draws[:n], dtype=np.float64)
+    upsets = np.flatnonzero(types == 2)
+
+    events = np.empty(n + upsets.size, dtype=DISTURBANCE_EVENT_DTYPE)
+    events['step'][:n] = steps
+    events['kind'][:n] = types
+    events['param'][:n] = types
+    events['factor'][:n] = np.where(types == 2, 0.8, 1 + 0.1 * (draws - 0.5))
+
+    restorations = events[n:]
+    restorations['step'] = np.asarray(steps)[upsets] + COOLING_UPSET_STEPS
+    restorations['kind'] = -1
+    restorations['param'] = 2
+    restorations['factor'] = 0.8
+    return events[np.lexsort((events['kind'] < 0, events['step']))]
+
+
+class DisturbanceScheduler:
+    """
+    Heap-backed queue of timed process parameter perturbations and restorations.
+
+    An episode's schedule is loaded as a whole (disturbance_schedule) and further events
+    can be pushed at any time, so upsets may overlap: every upset is ended by its own
+    restoration event. Events due at the same step are applied in the order
+    disturbances, restorations, then insertion order.
+    """
+    def __init__(self):
+        self.clear()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def clear(self):
+        self._heap = []
+        self._count = 0 # insertion counter, keeps events of equal step in order
+
+    def load(self, events):
+        """
+        Replace the queue with the events of a DISTURBANCE_EVENT_DTYPE array.
+        """
+        self._heap = [(int(step), int(kind < 0), i, int(kind), int(param), float(factor))
+                      for i, (step, kind, param, factor) in enumerate(events.tolist())]
+        heapq.heapify(self._heap)
+        self._count = len(self._heap)
+
+    def push(self, step, kind, param, factor):
+        """
+        Schedule one event (see DISTURBANCE_EVENT_DTYPE).
+        """
+        heapq.heappush(self._heap, (int(step), int(kind < 0), self._count, int(kind), int(param), float(factor)))
+        self._count += 1
+
+    def pop_due(self, step):
+        """
+        Remove and return the events due at or before `step`, in order, as
+        (kind, param, factor) tuples.
+        """
+        heap = self._heap
+        due = []
+        while heap and heap[0][0] <= step:
+            due.append(heapq.heappop(heap)[3:])
+        return due
+
+    def pending(self):
+        """
+        The queued events in order, as a DISTURBANCE_EVENT_DTYPE array.
+        """
+        return np.array([(event[0],) + event[3:] for event in sorted(self._heap)],
+                        dtype=DISTURBANCE_EVENT_DTYPE)
+
+    def get_state(self):
+        return list(self._heap), self._count
+
+    def set_state(self, state):
+        heap, self._count = state
+        self._heap = list(heap)
 
 
 
 ##############################################
-# 3. CSTR Environment written in Gym style
+# 6. CSTR Environment written in Gym style
 ##############################################
 
+def _spawn_rngs(seed=None):
+    """
+    Split a SeedSequence built from `seed` into independent generators for the
+    process parameters, the measurement noise and the disturbances.
+    Returns (seed_sequence, params_rng, noise_rng, disturbance_rng).
+    """
+    seed_sequence = np.random.SeedSequence(seed)
+    return (seed_sequence,) + tuple(np.random.default_rng(s) for s in seed_sequence.spawn(3))
+
+
+_UINT64_MASK = (1 << 64) - 1
+
+
+def _pack_rng_state(rng, out):
+    """
+    Write the state of a PCG64 generator into `out`, a (6,) uint64 array:
+    state and increment (high and low words), has_uint32 and uinteger.
+    """
+    state = rng.bit_generator.state
+    out[0], out[1] = state['state']['state'] >> 64, state['state']['state'] & _UINT64_MASK
+    out[2], out[3] = state['state']['inc'] >> 64, state['state']['inc'] & _UINT64_MASK
+    out[4], out[5] = state['has_uint32'], state['uinteger']
+
+
+def _unpack_rng_state(rng, packed):
+    """
+    Restore a PCG64 generator from the array written by _pack_rng_state.
+    """
+    words = packed.tolist()
+    rng.bit_generator.state = {
+        'bit_generator': 'PCG64',
+        'state': {'state': words[0] << 64 | words[1], 'inc': words[2] << 64 | words[3]},
+        'has_uint32': words[4],
+        'uinteger': words[5],
+    }
+
+
+class EnvSnapshot:
+    """
+    Compact copy of the mutable simulation state of a CSTRRLEnv (see CSTRRLEnv.get_state).
+
+      values: float64 array with the step counters, true and measured state, process
+              parameters and the contents and heads of the delay lines and PID histories
+      rng_states: (3, 6) uint64 array with the states of the parameter, noise and
+                  disturbance generators
+      episode_draws: the pre-drawn noise block, disturbance draws and disturbance schedule
+                     of the episode (shared, they are never modified in place)
+      extra: state of the integrator backend and of the MPC (None when stateless), the
+             pending disturbance events and the seeded noise stream set aside during a
+             scenario episode (None otherwise)
+    """
+    __slots__ = ('values', 'rng_states', 'episode_draws', 'extra')
+
+    def __init__(self, size):
+        self.values = np.empty(size)
+        self.rng_states = np.empty((3, 6), dtype=np.uint64)
+        self.episode_draws = None
+        self.extra = None
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes + self.rng_states.nbytes
+
+
+def _read_only(array):
+    view = array.view()
+    view.flags.writeable = False
+    return view
+
+
+class StepBuffers:
+    """
+    Preallocated arrays of the low-allocation step path (see CSTRRLEnv.set_low_allocation).
+
+    The working arrays (gains, error, control, delayed control, noise, noisy measurement,
+    previous state, RHS output) are overwritten on every step. step() returns read-only
+    views of obs, and the one info dict it hands out refers to read-only views of
+    pid_gains, control and true_state, so all of them are only valid until the next step.
+    """
+    __slots__ = ('pid_gains', 'gain_scale', 'error', 'control', 'delayed', 'noise', 'noisy',
+                 'prev_state', 'rhs_out', 'rhs', 'obs', 'obs_view', 'info_control',
+                 'info_true_state', 'info')
+
+    def __init__(self, env, obs_dtype):
+        self.pid_gains = np.empty(6)
+        self.gain_scale = env.pid_upper - env.pid_lower
+        self.error = np.empty(2)
+        self.control = np.empty(2)
+        self.delayed = np.empty(2)
+        self.noise = np.empty(5)
+        self.noisy = np.empty(5)
+        self.prev_state = np.empty(5)
+        # odeint copies the RHS result into its own work array, so it can always return
+        # the same output array
+        self.rhs_out = np.empty(5)
+        self.rhs = functools.partial(env.custom_cstr_dynamics, out=self.rhs_out)
+        self.obs = np.empty(8, dtype=obs_dtype)
+        self.obs_view = _read_only(self.obs)
+        self.info_control = np.empty(2)
+        self.info_true_state = np.empty(5)
+        self.info = {
+            "pid_gains": _read_only(self.pid_gains),
+            "control_action": _read_only(self.info_control),
+            "true_state": _read_only(self.info_true_state),
+            "disturbance": None,
+            "nfev": 0,
+        }
+
+
 class CSTRRLEnv(gym.Env):
     """
     A Gym environment for the CSTR system with an embedded velocity PID controller.
@@ -155,21 +1323,81 @@ class CSTRRLEnv(gym.Env):
     Action:
       A 6-dimensional continuous vector (normalized in [-1, 1]) representing PID gains:
          [Kp_Cb, Ki_Cb, Kd_Cb, Kp_V, Ki_V, Kd_V]
+      With action_repeat=k, each action is held for k control intervals of dt (the PID
+      still updates every dt) and the reward is summed over them. The odeint and ivp
+      backends integrate the k intervals in one continuous solver run, so the result
+      agrees with k single steps to the solver tolerance rather than bit for bit
+      (continuous_repeat=False restarts the solver on every interval instead). The
+      run saves solver restarts, but the PID still changes the input at every
+      instant, so it pays off with smooth inputs (e.g. the MPC) rather than with
+      aggressive PID gains.
       
     Reward:
       Negative squared error between the measured variables and setpoints.
+
+    With low_allocation=True, step() writes into preallocated buffers and returns
+    read-only views that the next step overwrites (see set_low_allocation);
+    obs_dtype=np.float32 gives single-precision observations.
+
+    Disturbances are timed events of a DisturbanceScheduler, precomputed per episode in
+    self.disturbance_events; disturbance_spacing='periodic' places them every
+    disturbance_interval steps instead of at the original, doubling gaps.
     """
+    metadata = {"render_modes": ["human", "rgb_array"]}
+
+    # Nominal values of the uncertain process parameters
+    nominal_params = {
+        'Tf': 350.0,     # Feed temperature
+        'Caf': 1.0,      # Feed concentration
+        'UA': 5e4,       # Heat transfer coefficient
+        'k0_AB': 7.2e10, # Reaction rate constant
+        'k0_BC': 8.2e10, # Reaction rate constant
+    }
+
+    # Number of previous errors and control actions read by PID_velocity
+    pid_stencil_depth = 2
+
     def __init__(self, simulation_steps=100, dt=1.0, 
                  uncertainty_level=0.1, 
                  noise_level=0.02,
                  actuator_delay_steps=1,
                  transport_delay_steps=2,
-                 enable_disturbances=True):
+                 enable_disturbances=True,
+                 integrator='odeint',
+                 integrator_options=None,
+                 record_history=True,
+                 record_path=None,
+                 render_mode=None,
+                 seed=None,
+                 predraw_noise=False,
+                 controller='pid',
+                 controller_options=None,
+                 profile=False,
+                 action_repeat=1,
+                 scenario_bank=None,
+                 low_allocation=False,
+                 obs_dtype=np.float64,
+                 disturbance_spacing='doubling',
+                 continuous_repeat=True):
         super(CSTRRLEnv, self).__init__()
 
+        # Per-instance random streams (parameters, noise, disturbances), see seed()
+        self.seed(seed)
+        self.predraw_noise = predraw_noise # draw a whole episode of measurement noise at reset
+
+        # Default mode of render(): 'human', 'rgb_array' or None
+        self.render_mode = render_mode
+        self.fig = None
+        self._render_mode = None
+
         # simulate parameters
         self.sim_steps = simulation_steps # number of steps per episode
         self.dt = dt                      # time step for integration
+        self.action_repeat = action_repeat # control intervals per step() (decision interval)
+        self.continuous_repeat = continuous_repeat # one solver session per held action
+
+        # Integrator backend used to advance the reactor over each time step
+        self.set_integrator(integrator, **(integrator_options or {}))
 
         # Uncertainty and noise parameters
         self.uncertainty_level = uncertainty_level # level of parameter uncertainty (fraction)
@@ -182,68 +1410,253 @@ class CSTRRLEnv(gym.Env):
         # Disturbance Parameters
         self.enable_disturbances = enable_disturbances
         self.disturbance_interval = 20        # Time setps between disturbances
-        self.next_disturbances = self.disturbance_interval # Steps until next disturbance
+        self.disturbance_spacing = disturbance_spacing # 'doubling' or 'periodic', see disturbance_steps
+        self.disturbances = DisturbanceScheduler() # pending events of the episode, filled by reset()
+        self.disturbance_events = np.empty(0, dtype=DISTURBANCE_EVENT_DTYPE) # whole-episode schedule
 
         # Define action space: 6 PID gains normalized in [-1, 1]
         self.action_space = spaces.Box(low=-1, high=1, shape=(6,), dtype=np.float64)
 
         # Define observation space: [Cb, T, V, Cb_prev, T_prev, V_prev, Cb_setpoint, V_setpoint]
         self.observation_space = spaces.Box(
-            low=np.array([0.0, 300.0, 80.0, 0.0, 300.0, 80.0, 0.0, 80.0]),
-            high=np.array([1.0, 400.0, 120.0, 1.0, 400.0, 120.0, 1.0, 120.0]),
-            dtype=np.float64
+            low=np.array([0.0, 300.0, 80.0, 0.0, 300.0, 80.0, 0.0, 80.0], dtype=obs_dtype),
+            high=np.array([1.0, 400.0, 120.0, 1.0, 400.0, 120.0, 1.0, 120.0], dtype=obs_dtype),
+            dtype=obs_dtype
         )
+        self.obs_dtype = self.observation_space.dtype
+
+        # PID gain scaling: map normalized action to actual PID gains
+        # For Cb loop: lower = [-5, 0, 0.02], upper = [25, 20, 10]
+        # For V loop: lower = [0, 0, 0.01], upper = [1, 2, 1]
+        self.pid_lower = np.array([-5, 0, 0.02, 0, 0, 0.01])
+        self.pid_upper = np.array([25, 20, 10, 1, 2, 1])
+
+        # Setpoints for the controlled variables (constant case)
+        self.setpoint_Cb = 0.70  # desired concentration of B (mol/m^3)
+        self.setpoint_V  = 100.0 # desired volume (m^3)
+
+        # Initialize reator conditions
+        # x = [Ca, Cb, Cc, T, V]
+        self.x0 = np.array([0.8, 0.0, 0.0, 325.0, 100.0])
+
+        # Generate uncertain parameters (once per environment instantiate)
+        # These represents real process parameters that differ from model assumptions
+        # Adjust nominal_params for "reality"
+        self.process_params = self.sample_process_params()
+
+        # Per-episode random draws: measurement noise block and disturbance events
+        self._noise_block = None
+        self._noise_index = 0
+        self._disturbance_draws = None
+        self._disturbance_index = 0
+
+        # Pre-sampled scenarios replayed by reset(options={'scenario_id': i}) (CSTR_scenarios)
+        self.set_scenario_bank(scenario_bank)
+        self.scenario_id = None
+
+        # Initialize histories for PID: ring buffers deep enough for the velocity PID stencil
+        self.e_history = RingBuffer(self.pid_stencil_depth, (2,)) # 2D error vectors [e_Cb, e_V]
+        self.u_history = RingBuffer(self.pid_stencil_depth, (2,)) # 2D control actions [Tc, Fin]
+
+        # Ring buffers for delayed measurements and control actions
+        self.measurement_buffer = RingBuffer(max(1, self.transport_delay_steps), (5,))
+        self.control_buffer = RingBuffer(max(1, self.actuator_delay_steps), (2,))
+
+        # For integration, keep the current state and step constant
+        self.state = self.x0.copy()
+        self.true_state = self.x0.copy()
+        self.current_step = 0
+
+        # For visualization and offline analysis: per-episode trajectory recorder (None when disabled)
+        self.episode = 0
+        self.set_recording(record_history, record_path)
+
+        # Inner controller: the velocity PID (tuned by the actions) or a linear MPC
+        self.set_controller(controller, **(controller_options or {}))
+
+        # Per-phase timers and solver statistics (None when profiling is off)
+        self.set_profiling(profile)
+
+        # Preallocated step buffers (None unless the low-allocation mode is on)
+        self.set_low_allocation(low_allocation)
+
+    # -----------------------------------------
+    # Select integrator backend
+    # -----------------------------------------
+    def set_integrator(self, integrator='odeint', **options):
+        """
+        Select the integrator backend used by step(): 'odeint' (reference accuracy),
+        'rk4' (fast, fixed step), 'rosenbrock' (stiff, fixed step), 'ivp' (adaptive,
+        persistent step size) or an Integrator instance. This can be switched at any
+        time, e.g. a fast backend during exploration and odeint for evaluation.
+        """
+        self.integrator = make_integrator(integrator, **options)
+
+    # -----------------------------------------
+    # Select inner controller
+    # -----------------------------------------
+    def set_controller(self, controller='pid', **options):
+        """
+        Select the inner controller: 'pid' (PID_velocity with the gains given by the
+        actions) or 'mpc' (CSTR_mpc.LinearMPC built from `options`; the actions are
+        ignored). The MPC is linearized at the operating point of each episode's
+        process parameters, so it knows the plant up to disturbances and noise, and it
+        compensates the measurement and actuator delays of the environment.
+        """
+        if controller not in ('pid', 'mpc'):
+            raise ValueError(f"Unknown controller '{controller}', expected 'pid' or 'mpc'")
+        self.controller = controller
+        self.mpc = None
+        if controller == 'mpc':
+            from CSTR_mpc import LinearMPC
+            # Steps between a measurement and the effect of the action computed from it
+            delay = max(1, self.transport_delay_steps) - 1 + max(1, self.actuator_delay_steps)
+            options = dict(dict(dt=self.dt, setpoint_Cb=self.setpoint_Cb,
+                                setpoint_V=self.setpoint_V, delay=delay), **options)
+            self.mpc = LinearMPC(**options)
+
+    # -----------------------------------------
+    # Select scenario bank
+    # -----------------------------------------
+    def set_scenario_bank(self, scenario_bank=None):
+        """
+        Use a CSTR_scenarios.ScenarioBank (or the path of a saved one, memory-mapped)
+        for reset(options={'scenario_id': i}), which replays the process parameters,
+        disturbance schedule and measurement noise of scenario i. Raises a ValueError
+        if the bank was generated for other settings (ScenarioBank.check_env).
+        """
+        if isinstance(scenario_bank, (str, os.PathLike)):
+            from CSTR_scenarios import ScenarioBank
+            scenario_bank = ScenarioBank.load(scenario_bank)
+        if scenario_bank is not None:
+            scenario_bank.check_env(self)
+        self.scenario_bank = scenario_bank
+
+    # -----------------------------------------
+    # Configure profiling
+    # -----------------------------------------
+    def set_profiling(self, enabled=True):
+        """
+        Turn the per-phase timers and solver statistics on or off. When on, every step
+        reports them in info['profile'] and profile_summary() aggregates the episode.
+        When off, step() only pays for a few `is None` checks.
+        """
+        self.profiler = StepProfiler() if enabled else None
 
-        # PID gain scaling: map normalized action to actual PID gains
-        # For Cb loop: lower = [-5, 0, 0.02], upper = [25, 20, 10]
-        # For V loop: lower = [0, 0, 0.01], upper = [1, 2, 1]
-        self.pid_lower = np.array([-5, 0, 0.02, 0, 0, 0.01])
-        self.pid_upper = np.array([25, 20, 10, 1, 2, 1])
+    def profile_summary(self):
+        """
+        Per-phase timings and solver statistics of the current episode (StepProfiler.summary),
+        or None when profiling is off.
+        """
+        return None if self.profiler is None else self.profiler.summary()
 
-        # Setpoints for the controlled variables (constant case)
-        self.setpoint_Cb = 0.70  # desired concentration of B (mol/m^3)
-        self.setpoint_V  = 100.0 # desired volume (m^3)
+    # -----------------------------------------
+    # Configure low-allocation stepping
+    # -----------------------------------------
+    def set_low_allocation(self, enabled=True):
+        """
+        Turn the low-allocation step path on or off. When on, step() computes the gains,
+        errors, controls, noise, measurements and observation in preallocated buffers
+        (StepBuffers), updates the true and measured state in place, evaluates the RHS
+        into a reused array under odeint, and returns a read-only view of its observation
+        buffer and the same info dict every time. The results of a step are overwritten
+        by the next one: copy them to keep them. The simulation is unchanged (bit-for-bit).
+        """
+        self._buffers = StepBuffers(self, self.obs_dtype) if enabled else None
 
-        # Initialize reator conditions
-        # x = [Ca, Cb, Cc, T, V]
-        self.x0 = np.array([0.8, 0.0, 0.0, 325.0, 100.0])
+    # -----------------------------------------
+    # Random number generation
+    # -----------------------------------------
+    def seed(self, seed=None):
+        """
+        Create the per-instance random number generators.
 
-        # Generate uncertain parameters (once per environment instantiate)
-        # These represents real process parameters that differ from model assumptions
-        # Adjust this section for "reality"
-        self.process_params = {
-            'Tf': 350 * (1 + self.uncertainty_level * (np.random.rand() - 0.5)),  # Feed temperature
-            'Caf': 1.0 * (1 + self.uncertainty_level * (np.random.rand() - 0.5)), # Feed concentration
-            'UA': 5e4 * (1 + self.uncertainty_level * (np.random.rand() - 0.5)),  # Heat transfer coefficient
-            'k0_AB': 7.2e10 * (1 + self.uncertainty_level * (np.random.rand() - 0.5)), # Reaction rate constant
-            'k0_BC': 8.2e10 * (1 + self.uncertainty_level * (np.random.rand() - 0.5)), # Reaction rate constant
-        }
+        A SeedSequence built from `seed` is split into independent streams for the
+        process parameters, the measurement noise and the disturbances, so instances
+        never share the global np.random state and runs in different processes are
+        reproducible. seed=None draws fresh entropy from the OS.
+        """
+        self.seed_sequence, self.params_rng, self.noise_rng, self.disturbance_rng = _spawn_rngs(seed)
+        self._seeded_noise_rng = None # noise stream set aside while replaying a scenario
 
-        # Initialize histories for PID: use lists to store previous errors and control actions
-        self.e_history = [] # each element will be a 2D error vector [e_Cb, e_V]
-        self.u_history = [] # each element will be a 2D control action [Tc, Fin]
+    def sample_process_params(self):
+        """
+        Draw a set of uncertain process parameters (all in one call).
+        """
+        draws = self.params_rng.random(len(self.nominal_params))
+        return {key: nominal * (1 + self.uncertainty_level * (draw - 0.5))
+                for draw, (key, nominal) in zip(draws, self.nominal_params.items())}
 
-        # Buffer for delayed measurements and control actions
-        self.measurement_buffer = [] # Buffer for delayed measurements
-        self.control_buffer = []     # Buffer for delayed control actions
+    def _draw_episode(self):
+        """
+        Pre-draw the random events of one episode in single vectorized calls: the
+        disturbance types and magnitudes and, with predraw_noise, the measurement noise.
+        """
+        n_events = self.sim_steps // self.disturbance_interval + 1
+        self._disturbance_draws = (self.disturbance_rng.integers(0, 3, size=n_events),
+                                   self.disturbance_rng.random(n_events))
+        self._disturbance_index = 0
 
-        # For integration, keep the current state and step constant
-        self.state = self.x0.copy()
-        self.true_state = self.x0.copy()
-        self.current_step = 0
+        self._noise_block = self.noise_rng.standard_normal((self.sim_steps + 1, 5)) if self.predraw_noise else None
+        self._noise_index = 0
 
-        # For visualization
-        self.history = {
-            'time': [],
-            'Cb': [],
-            'T': [],
-            'V': [],
-            'Tc': [],
-            'Fin': [],
-            'state': [],
-            'setpoint_Cb': [],
-            'setpoint_V': []
-        }
+    def _schedule_disturbances(self):
+        """
+        Precompute the disturbance events of the episode (self.disturbance_events, a
+        DISTURBANCE_EVENT_DTYPE array) from the pre-drawn types and magnitudes, and load
+        them into the scheduler.
+        """
+        steps = disturbance_steps(self.sim_steps, self.disturbance_interval, self.disturbance_spacing)
+        types, magnitudes = np.empty(steps.size, dtype=np.int64), np.empty(steps.size)
+        for i in range(steps.size):
+            types[i], magnitudes[i] = self._next_disturbance()
+        self.disturbance_events = disturbance_schedule(steps, types, magnitudes)
+        self.disturbances.load(self.disturbance_events)
+
+    def _next_noise(self, out=None):
+        """
+        Standard normal noise for one measurement of the 5 states (drawn into `out` when
+        given, unless it comes from the pre-drawn block).
+        """
+        if self._noise_block is not None and self._noise_index < self._noise_block.shape[0]:
+            z = self._noise_block[self._noise_index]
+            self._noise_index += 1
+            return z
+        if out is not None:
+            return self.noise_rng.standard_normal(out=out)
+        return self.noise_rng.standard_normal(5)
+
+    def _next_disturbance(self):
+        """
+        Type and uniform magnitude draw of the next disturbance event.
+        """
+        if self._disturbance_draws is None or self._disturbance_index == self._disturbance_draws[0].size:
+            # Episode ran past its pre-drawn events
+            n_events = max(1, self.sim_steps // self.disturbance_interval + 1)
+            self._disturbance_draws = (self.disturbance_rng.integers(0, 3, size=n_events),
+                                       self.disturbance_rng.random(n_events))
+            self._disturbance_index = 0
+        types, magnitudes = self._disturbance_draws
+        i = self._disturbance_index
+        self._disturbance_index += 1
+        return types[i], magnitudes[i]
+
+    # -----------------------------------------
+    # Configure trajectory recording
+    # -----------------------------------------
+    def set_recording(self, enabled=True, path=None):
+        """
+        Enable or disable recording of the trajectory into self.history.
+
+        Disabling removes all recording work from step(), e.g. during training.
+        If `path` is given, every episode is recorded straight into a .npy memory
+        map; `path` may contain an '{episode}' field, e.g. 'runs/ep_{episode:06d}.npy',
+        to keep one file per episode.
+        """
+        self.record_history = enabled
+        self.record_path = path
+        # Memory-mapped recorders are opened per episode by reset()
+        self.history = TrajectoryRecorder(self.sim_steps + 1) if enabled and path is None else None
 
     # -----------------------------------------
     # Define reset function
@@ -251,82 +1664,111 @@ class CSTRRLEnv(gym.Env):
     def reset(self, seed=None, options=None):
         """
         Reset the environment to the initial state.
+        A seed re-creates the random streams; without one they continue.
+        options={'scenario_id': i} replays scenario i of the scenario bank instead of
+        drawing new process parameters, disturbances and noise.
         """
         if seed is not None:
-            np.random.seed(seed)
+            self.seed(seed)
 
         # Reset state and variables
         self.state = self.x0.copy()
         self.true_state = self.x0.copy()
         self.current_step = 0
 
-        # Reset disturbance timing
-        self.next_disturbances = self.disturbance_interval
-
-        # Update uncertain parameters for this episode
-        self.process_params = {
-            'Tf': 350 * (1 + self.uncertainty_level * (np.random.rand() - 0.5)),
-            'Caf': 1.0 * (1 + self.uncertainty_level * (np.random.rand() - 0.5)),
-            'UA': 5e4 * (1 + self.uncertainty_level * (np.random.rand() - 0.5)),
-            'k0_AB': 7.2e10 * (1 + self.uncertainty_level * (np.random.rand() - 0.5)),
-            'k0_BC': 8.2e10 * (1 + self.uncertainty_level * (np.random.rand() - 0.5)),
-        }
+        # Update uncertain parameters and random events for this episode
+        self.scenario_id = None if options is None else options.get('scenario_id')
+        if self.scenario_id is None:
+            if self._seeded_noise_rng is not None:
+                # Back to the seeded noise stream after a scenario episode
+                self.noise_rng, self._seeded_noise_rng = self._seeded_noise_rng, None
+            self.process_params = self.sample_process_params()
+            self._draw_episode()
+        else:
+            self._load_scenario(self.scenario_id)
+        self._schedule_disturbances()
+        if self.mpc is not None:
+            self.mpc.set_operating_point(self.process_params)
+            self.mpc.reset(u0=[300.0, 100.0], x0=self.x0)
+        if self.profiler is not None:
+            self.profiler.reset()
 
         # Initialize control and error history with default values
         default_u = np.array([300.0, 100.0])
-        self.u_history = [default_u, default_u] # two copies for derivative computation
+        self.u_history.fill(default_u) # copies for derivative computation
 
         # Reset buffers for delayed measurements and control actions
-        self.measurement_buffer = [self.apply_measurement_noise(self.state)] * max(1, self.transport_delay_steps)
-        self.control_buffer = [default_u] * max(1, self.actuator_delay_steps)
+        self.measurement_buffer.fill(self.apply_measurement_noise(self.state))
+        self.control_buffer.fill(default_u)
 
         # Compute intial error using possibly delayed and noisy measurements
         measured_state = self.measurement_buffer[0]
         initial_error = np.array([self.setpoint_Cb - measured_state[1],
                                   self.setpoint_V - measured_state[4]])
         
-        # Initialize error history with two copies
-        self.e_history = [initial_error, initial_error]
-
-
-        # Reset history for visualization
-        self.history = {
-            'time': [0],
-            'Cb': [self.state[1]],
-            'T': [self.state[3]],
-            'V': [self.state[4]],
-            'Tc': [default_u[0]],
-            'Fin': [default_u[1]],
-            'setpoint_Cb': [self.setpoint_Cb],
-            'setpoint_V': [self.setpoint_V]
-        }
+        # Initialize error history with copies
+        self.e_history.fill(initial_error)
+
+
+        # Reset history for visualization (a new memory-mapped file per episode when recording to disk)
+        if self.record_history:
+            if self.record_path is not None:
+                if self.history is not None:
+                    self.history.finalize()
+                self.history = TrajectoryRecorder(self.sim_steps + 1,
+                                                  self.record_path.format(episode=self.episode))
+            self.history.clear()
+            self.history.record(0, self.state[1], self.state[3], self.state[4],
+                                default_u[0], default_u[1], self.setpoint_Cb, self.setpoint_V)
+        self.episode += 1
 
         # Create initial observation
         obs = np.array([
             measured_state[1], measured_state[3], measured_state[4], # current state
             measured_state[1], measured_state[3], measured_state[4], # previous state
             self.setpoint_Cb, self.setpoint_V # setpoints
-        ], dtype=np.float64)
+        ], dtype=self.obs_dtype)
+        if self._buffers is not None:
+            self._buffers.obs[...] = obs
+            obs = self._buffers.obs_view
 
-        return obs, {}
+        return obs, {} if self.scenario_id is None else {'scenario_id': self.scenario_id}
+
+    def _load_scenario(self, scenario_id):
+        """
+        Take the process parameters, disturbance events and noise stream of the episode
+        from scenario `scenario_id` of the scenario bank. The seeded noise stream is set
+        aside for the scenario's own and restored by the next random episode.
+        """
+        if self.scenario_bank is None:
+            raise ValueError("options['scenario_id'] requires a scenario_bank")
+        self.process_params = self.scenario_bank.process_params(scenario_id)
+        self._disturbance_draws = self.scenario_bank.disturbance_schedule(scenario_id)
+        self._disturbance_index = 0
+        if self._seeded_noise_rng is None:
+            self._seeded_noise_rng = self.noise_rng
+        self.noise_rng = np.random.default_rng(int(self.scenario_bank[scenario_id]['noise_seed']))
+        self._noise_block = self.noise_rng.standard_normal((self.sim_steps + 1, 5)) if self.predraw_noise else None
+        self._noise_index = 0
     
     # -----------------------------------------
     # Add noise to measurements
     # -----------------------------------------
-    def apply_measurement_noise(self, state):
+    def apply_measurement_noise(self, state, out=None):
         """
-        Add noise to the state measurements.
+        Add noise to the state measurements (written into `out` when given).
         """
-        noisy_state = state.copy()
-
-        # Add random noise scaled by the state values and noise level
-        for i in range(len(state)):
-            # Add relative noise (proportional to state value)
-            noise = state[i] * self.noise_level * np.random.normal()
-            # Ensure no negative concentrations or volumes
-            noisy_state[i] = max(0, state[i] + noise)
-
-        return noisy_state
+        if out is not None:
+            # Same operations as below, in place
+            np.multiply(state, self.noise_level, out=out)
+            out *= self._next_noise(None if self._buffers is None else self._buffers.noise)
+            out += state
+            return np.maximum(out, 0, out=out)
+
+        # Add relative noise (proportional to state value) to all states at once
+        noise = state * self.noise_level * self._next_noise()
+        # Ensure no negative concentrations or volumes
+        return np.maximum(0, state + noise)
     
     # -----------------------------------------
     # Apply disturbances
@@ -338,27 +1780,32 @@ class CSTRRLEnv(gym.Env):
         1. Step change in feed temperature
         2. Step change in feed concentration
         3. Brief cooling system upset
+        The scheduled events of the episode are applied by step(); this applies one
+        more, immediately.
         """
-        disturbance_type = np.random.randint(0, 3)
+        disturbance_type, draw = self._next_disturbance()
 
         if disturbance_type == 0:
             # Feed temperature step
-            self.process_params['Tf'] *= (1 + 0.1 * (np.random.rand() - 0.5))
+            self.process_params['Tf'] *= (1 + 0.1 * (draw - 0.5))
             return "Feed temperature disturbance"
         
         elif disturbance_type == 1:
             # Feed concentration step
-            self.process_params['Caf'] *= (1 + 0.1 * (np.random.rand() - 0.5))
+            self.process_params['Caf'] *= (1 + 0.1 * (draw - 0.5))
             return "Feed concentration disturbance"
         
         else: 
             # Brief cooling system upset (lasts 3 steps)
             self.process_params['UA'] *= 0.8 # Reduced heat transfer
+            self.disturbances.push(self.current_step + COOLING_UPSET_STEPS, -1, 2, 0.8)
             return "Cooling system upset"
 
-    def custom_cstr_dynamics(self, x, t, u):
+    def custom_cstr_dynamics(self, x, t, u, params=None, out=None):
         """
         Custom CSTR dynamics with uncertain parameters and possible disturbances. 
+        `params` overrides the current process parameters, and the derivatives are
+        written into `out` when given.
         """
         # Unpack control inputs
         Tc = u[0]  # Cooling jacket temperature
@@ -368,11 +1815,12 @@ class CSTRRLEnv(gym.Env):
         Ca, Cb, Cc, T, V = x
 
         # Process parameters with uncertainty
-        Tf = self.process_params['Tf']
-        Caf = self.process_params['Caf']
-        UA = self.process_params['UA']
-        k0_AB = self.process_params['k0_AB']
-        k0_BC = self.process_params['k0_BC']
+        p = self.process_params if params is None else params
+        Tf = p['Tf']
+        Caf = p['Caf']
+        UA = p['UA']
+        k0_AB = p['k0_AB']
+        k0_BC = p['k0_BC']
 
         # Fixed parameters
         Fout = 100       # Outlet flow rate (m^3/min)
@@ -403,7 +1851,29 @@ class CSTRRLEnv(gym.Env):
         # Volume balance (volume derivative)
         dVdt = Fin - Fout
 
-        return np.array([dCadt, dCbdt, dCcdt, dTdt, dVdt])
+        if out is None:
+            return np.array([dCadt, dCbdt, dCcdt, dTdt, dVdt])
+        out[0] = dCadt
+        out[1] = dCbdt
+        out[2] = dCcdt
+        out[3] = dTdt
+        out[4] = dVdt
+        return out
+
+    def custom_cstr_jacobian(self, x, t, u, params=None):
+        """
+        Analytic Jacobian d(dx/dt)/dx of custom_cstr_dynamics with the current process parameters.
+        """
+        p = self.process_params if params is None else params
+        return _cstr_jacobian(x, u, p['Tf'], p['Caf'], p['UA'], p['k0_AB'], p['k0_BC'])
+
+    def custom_cstr_input_jacobian(self, x, t, u):
+        """
+        Analytic Jacobian d(dx/dt)/du of custom_cstr_dynamics with respect to u = [Tc, Fin].
+        """
+        p = self.process_params
+        return _cstr_jacobian(x, u, p['Tf'], p['Caf'], p['UA'], p['k0_AB'], p['k0_BC'],
+                              wrt_inputs=True)
 
 
     # -----------------------------------------
@@ -417,180 +1887,582 @@ class CSTRRLEnv(gym.Env):
         - Actuator (control) delays
         - Transport/Dead time delays
         - Disturbances
+        With action_repeat > 1 the gains are held for that many control intervals (fewer
+        at the end of the episode); the reward is the sum over the intervals and info
+        additionally lists the per-interval 'control_actions' and 'disturbances'.
+        In the low-allocation mode obs and info are reused (see set_low_allocation).
         """
-        # Scale normalized action to actual PID gains
-        pid_gains = ((action + 1) / 2) * (self.pid_upper - self.pid_lower) + self.pid_lower
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.start()
+        buffers = self._buffers
 
-        # Get the current (possibly delayed and noisy) measurements
-        measured_state = self.measurement_buffer[0]
+        # Scale normalized action to actual PID gains
+        if buffers is None:
+            pid_gains = ((action + 1) / 2) * (self.pid_upper - self.pid_lower) + self.pid_lower
+        else:
+            pid_gains = buffers.pid_gains
+            np.add(action, 1, out=pid_gains)
+            pid_gains /= 2
+            pid_gains *= buffers.gain_scale
+            pid_gains += self.pid_lower
+
+        # Control intervals this action is held for
+        repeat = min(self.action_repeat, self.sim_steps - self.current_step)
+        if repeat <= 1:
+            # Save current state before integration
+            if buffers is None:
+                prev_state = self.true_state.copy()
+            else:
+                prev_state = buffers.prev_state
+                prev_state[...] = self.true_state
+
+            # Advance the controller, the delay lines, the disturbances and the reactor by one step
+            control_action, delayed_control, disturbance_info = self._advance(pid_gains)
+
+            # Compute reward: negative sum of squared errors (use true state for more accurate reward)
+            error_Cb = self.setpoint_Cb - self.true_state[1]
+            error_V = self.setpoint_V - self.true_state[4]
+            reward = -(error_Cb * error_Cb + error_V * error_V)
+        else:
+            # Advance all held intervals; the observation keeps the state before the last one
+            control_actions, delayed_controls, disturbances, true_states = \
+                self._advance_repeat(pid_gains, repeat)
+            prev_state = true_states[-2]
+            control_action = control_actions[-1]
+            disturbance_info = next((d for d in disturbances if d is not None), None)
+
+            # Reward summed over the held intervals
+            true_error = np.stack([self.setpoint_Cb - true_states[:, 1],
+                                   self.setpoint_V - true_states[:, 4]], axis=1)
+            reward = -np.sum(true_error ** 2)
 
-        # Compute the error based on measurement
-        current_error = np.array([self.setpoint_Cb - measured_state[1],
-                                  self.setpoint_V - measured_state[4]])
+        # Construct the observation with delayed, noisy measurements
+        if buffers is None:
+            obs = np.array([
+                self.state[1], self.state[3], self.state[4], # current state
+                prev_state[1], prev_state[3], prev_state[4], # previous state
+                self.setpoint_Cb, self.setpoint_V # setpoints
+            ], dtype=self.obs_dtype)
+        else:
+            obs = buffers.obs
+            obs[0], obs[1], obs[2] = self.state[1], self.state[3], self.state[4]
+            obs[3], obs[4], obs[5] = prev_state[1], prev_state[3], prev_state[4]
+            obs[6], obs[7] = self.setpoint_Cb, self.setpoint_V
+            obs = buffers.obs_view
+        if profiler is not None:
+            profiler.lap('observation')
         
-        # Determine control action using velocity PID
-        if self.current_step < 2:
-            control_action = self.u_history[-1]
-        else: 
-            control_action = PID_velocity(pid_gains, current_error, self.e_history, self.u_history, self.dt)
-
-        # Add new control action to buffer (introducing actuactor delay)
-        self.control_buffer.append(control_action)
-        # Get the delayed control action to apply
-        delayed_control = self.control_buffer.pop(0)
-
-        # Store the new control action and error in history
-        self.u_history.append(control_action)
-        self.e_history.append(current_error)
+        # Update history for visualization (store true values)
+        if self.history is not None:
+            if repeat <= 1:
+                x, u = self.true_state, delayed_control
+                self.history.record((self.current_step - 1) * self.dt, x[1], x[3], x[4], u[0], u[1],
+                                    self.setpoint_Cb, self.setpoint_V)
+            else:
+                first = self.current_step - repeat
+                for k, (x, u) in enumerate(zip(true_states, delayed_controls)):
+                    self.history.record((first + k) * self.dt, x[1], x[3], x[4], u[0], u[1],
+                                        self.setpoint_Cb, self.setpoint_V)
+            if profiler is not None:
+                profiler.lap('record')
 
-        # Apply disturbances if enabled
-        disturbance_info = None
-        if self.enable_disturbances:
-            # Check if it's time for a disturbance
-            if self.current_step >= self.next_disturbances:
-                disturbance_info = self.apply_disturbances()
-                self.next_disturbances += self.current_step + self.disturbance_interval
+        done = self.current_step >= self.sim_steps
 
-                # If it was a cooling system upset, schedule a fix after 3 steps
-                if disturbance_info == "Cooling system upset":
-                    # we'll restore the UA value after 3 steps
-                    self.next_cooling_fix = self.current_step + 3
+        # Into dict can include debugging information and disturbance info
+        if buffers is None:
+            info = {
+                "pid_gains": pid_gains,
+                "control_action": control_action,
+                "true_state": self.true_state,
+                "disturbance": disturbance_info,
+                "nfev": self.integrator.last_nfev
+            }
+        else:
+            # One dict for the whole episode, over read-only views of the step buffers
+            info = buffers.info
+            buffers.info_control[...] = control_action
+            buffers.info_true_state[...] = self.true_state
+            info["disturbance"] = disturbance_info
+            info["nfev"] = self.integrator.last_nfev
+            for key in ("control_actions", "disturbances", "profile"):
+                info.pop(key, None)
+        if repeat > 1:
+            info["control_actions"] = control_actions
+            info["disturbances"] = disturbances
+        if profiler is not None:
+            info["profile"] = profiler.end_step(self.integrator.last_stats)
 
+        return obs, reward, done, False, info
 
-            # Fix cooling system (if needed)
-            if hasattr(self, 'next_cooling_fix') and self.current_step == self.next_cooling_fix:
-                # Restore UA to its original value
-                self.process_params['UA'] /= 0.8  # Restore to original value
-                delattr(self, 'next_cooling_fix') # Remove the attribute
+    def _advance(self, pid_gains, session=None):
+        """
+        One simulation step shared by step() and rollout(): PID update, actuator delay,
+        disturbances, integration, measurement noise and transport delay. With a
+        `session` (Integrator.session) the interval continues that solver run.
+        Returns (control_action, delayed_control, disturbance_info).
+        """
+        # Controller update from the current (possibly delayed and noisy) measurements
+        control_action, delayed_control = self._control_update(self.measurement_buffer[0],
+                                                               self.current_step, pid_gains)
 
-        # Save current state before integration
-        prev_state = self.true_state.copy()
+        # Apply disturbances if enabled
+        disturbance_info = self._scheduled_disturbances(self.current_step)
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.lap('disturbance')
 
         # Simulate the reactor dynamics using ODE integration with uncertain parameters
-        t_span = [0, self.dt]
-        new_state = odeint(self.custom_cstr_dynamics, self.true_state, t_span, args=(delayed_control,))[1]
-        self.true_state = new_state.copy()
+        buffers = self._buffers
+        if session is not None:
+            new_state = session.advance((delayed_control,), self.process_params)
+        else:
+            fun = self.custom_cstr_dynamics
+            if buffers is not None and type(self.integrator) is OdeintIntegrator:
+                fun = buffers.rhs
+            new_state = self.integrator.integrate(fun, self.true_state, self.dt,
+                                                  args=(delayed_control,), jac=self.custom_cstr_jacobian,
+                                                  params=self.process_params)
+        if buffers is None:
+            self.true_state = new_state.copy()
+        else:
+            self.true_state[...] = new_state
+        if profiler is not None:
+            profiler.lap('integrate')
 
         # Apply measurement noise
-        noisy_state= self.apply_measurement_noise(new_state)
+        if buffers is None:
+            noisy_state = self.apply_measurement_noise(new_state)
+        else:
+            noisy_state = self.apply_measurement_noise(new_state, buffers.noisy)
 
         # Add new measurement to buffer (introducing measurement/transport delay)
-        self.measurement_buffer.append(noisy_state)
-        # Get the delayed measurement
-        self.state = self.measurement_buffer.pop(0)
+        # and get the delayed measurement
+        if buffers is None:
+            self.state = self.measurement_buffer.push(noisy_state)
+        else:
+            self.measurement_buffer.push(noisy_state, self.state)
+        if profiler is not None:
+            profiler.lap('measurement')
 
-        # Compute reward: negative sum of squared errors (use true state for more accurate reward)
-        true_error = np.array([self.setpoint_Cb - self.true_state[1],
-                               self.setpoint_V - self.true_state[4]])
-        reward = -np.sum(true_error ** 2)
+        self.current_step += 1
+        return control_action, delayed_control, disturbance_info
 
-        # Construct the observation with delayed, noisy measurements
-        obs = np.array([
-            self.state[1], self.state[3], self.state[4], # current state
-            prev_state[1], prev_state[3], prev_state[4], # previous state
-            self.setpoint_Cb, self.setpoint_V # setpoints
-        ], dtype=np.float64)
+    def _control_update(self, measured_state, step, pid_gains):
+        """
+        Controller part of simulation step `step`: error, MPC or velocity PID, actuator
+        delay line and PID histories. Returns (control_action, delayed_control).
+        """
+        # Compute the error based on measurement
+        buffers = self._buffers
+        if buffers is None:
+            current_error = np.array([self.setpoint_Cb - measured_state[1],
+                                      self.setpoint_V - measured_state[4]])
+        else:
+            current_error = buffers.error
+            current_error[0] = self.setpoint_Cb - measured_state[1]
+            current_error[1] = self.setpoint_V - measured_state[4]
         
-        # Update history for visualization
-        self.history['time'].append(self.current_step * self.dt)
-        self.history['Cb'].append(self.true_state[1]) # Store true values for visualization
-        self.history['T'].append(self.true_state[3])
-        self.history['V'].append(self.true_state[4])
-        self.history['Tc'].append(delayed_control[0])
-        self.history['Fin'].append(delayed_control[1])
-        self.history['setpoint_Cb'].append(self.setpoint_Cb)
-        self.history['setpoint_V'].append(self.setpoint_V)
+        # Determine control action using the MPC or the velocity PID
+        if self.mpc is not None:
+            control_action = self.mpc.control(measured_state, self.u_history[-1])
+        elif step < 2:
+            if buffers is None:
+                control_action = self.u_history[-1].copy()
+            else:
+                control_action = buffers.control
+                control_action[...] = self.u_history[-1]
+        else: 
+            control_action = PID_velocity(pid_gains, current_error, self.e_history, self.u_history, self.dt,
+                                          out=None if buffers is None else buffers.control)
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.lap('pid')
 
-        self.current_step += 1
-        done = self.current_step >= self.sim_steps
+        # Add new control action to buffer (introducing actuactor delay)
+        # and get the delayed control action to apply
+        delayed_control = self.control_buffer.push(control_action,
+                                                   None if buffers is None else buffers.delayed)
 
-        # Into dict can include debugging information and disturbance info
-        info = {
-            "pid_gains": pid_gains,
-            "control_action": control_action,
-            "true_state": self.true_state,
-            "disturbance": disturbance_info
-        }
+        # Store the new control action and error in history
+        self.u_history.push(control_action)
+        self.e_history.push(current_error)
+        if profiler is not None:
+            profiler.lap('delay')
+        return control_action, delayed_control
 
-        return obs, reward, done, False, info
+    def _scheduled_disturbances(self, step):
+        """
+        Apply the disturbance events and restorations due at simulation step `step`.
+        Returns the description of the (first) disturbance or None.
+        """
+        disturbance_info = None
+        if self.enable_disturbances:
+            for kind, param, factor in self.disturbances.pop_due(step):
+                name = DISTURBANCE_PARAMS[param]
+                if kind < 0:
+                    # End of an upset: restore the parameter
+                    self.process_params[name] /= factor
+                else:
+                    self.process_params[name] *= factor
+                    if disturbance_info is None:
+                        disturbance_info = DISTURBANCE_NAMES[kind]
+        return disturbance_info
+
+    def _advance_repeat(self, pid_gains, n):
+        """
+        n simulation steps with the same PID gains (action repeat). The controller, delay
+        lines, disturbances and measurements still update at every control instant, as in
+        n calls of _advance, but with continuous_repeat the reactor is integrated by one
+        integrator session over the n intervals (one continuous LSODA run for the odeint
+        and ivp backends).
+        Returns (control_actions, delayed_controls, disturbances, true_states) per step.
+        """
+        control_actions, delayed_controls = np.empty((n, 2)), np.empty((n, 2))
+        true_states = np.empty((n, 5))
+        disturbances = [None] * n
+        session = None
+        if self.continuous_repeat:
+            session = self.integrator.session(self.custom_cstr_dynamics, self.true_state, self.dt,
+                                              self.custom_cstr_jacobian)
+        nfev = 0
+        for k in range(n):
+            control_actions[k], delayed_controls[k], disturbances[k] = self._advance(pid_gains, session)
+            true_states[k] = self.true_state
+            nfev += self.integrator.last_nfev
+
+        self.integrator.last_nfev = nfev
+        self.integrator.last_stats = dict(self.integrator.last_stats, nfev=nfev)
+        return control_actions, delayed_controls, disturbances, true_states
+
+    # -----------------------------------------
+    # Define whole-episode rollout
+    # -----------------------------------------
+    def rollout(self, actions, seed=None, options=None):
+        """
+        Reset the environment and run a whole episode with fixed or scheduled PID gains.
+
+        Inputs:
+          actions: normalized PID gains as in step(), either one vector of shape (6,)
+                   used for every step or a schedule of shape (sim_steps, 6)
+          seed, options: passed to reset()
+
+        Runs the same simulation as calling step() sim_steps times (bit-for-bit, under
+        the same seed) without building observations and info dicts per step.
+        Returns (trajectory, rewards): a TRAJECTORY_DTYPE array with the sim_steps + 1
+        recorded rows (true values, as in self.history) and the (sim_steps,) rewards.
+        """
+        actions = np.asarray(actions, dtype=np.float64)
+        if actions.shape not in ((6,), (self.sim_steps, 6)):
+            raise ValueError(f"actions must have shape (6,) or ({self.sim_steps}, 6), got {actions.shape}")
+
+        # Scale all normalized actions to PID gains at once
+        pid_gains = ((actions + 1) / 2) * (self.pid_upper - self.pid_lower) + self.pid_lower
+        pid_gains = np.broadcast_to(pid_gains, (self.sim_steps, 6))
+
+        self.reset(seed=seed, options=options)
+
+        trajectory = np.zeros(self.sim_steps + 1, dtype=TRAJECTORY_DTYPE)
+        trajectory[0] = (0, self.x0[1], self.x0[3], self.x0[4],
+                         *self.u_history[-1], self.setpoint_Cb, self.setpoint_V)
+        true_states = np.empty((self.sim_steps, 5))
+        applied = np.empty((self.sim_steps, 2))
+
+        advance, profiler = self._advance, self.profiler
+        for k in range(self.sim_steps):
+            if profiler is not None:
+                profiler.start()
+            applied[k] = advance(pid_gains[k])[1]
+            true_states[k] = self.true_state
+            if profiler is not None:
+                profiler.end_step(self.integrator.last_stats)
+
+        # Fill the trajectory and the rewards with whole-array operations
+        rows = trajectory[1:]
+        rows['time'] = np.arange(self.sim_steps) * self.dt
+        rows['Cb'], rows['T'], rows['V'] = true_states[:, 1], true_states[:, 3], true_states[:, 4]
+        rows['Tc'], rows['Fin'] = applied[:, 0], applied[:, 1]
+        rows['setpoint_Cb'], rows['setpoint_V'] = self.setpoint_Cb, self.setpoint_V
+
+        true_error = np.stack([self.setpoint_Cb - true_states[:, 1],
+                               self.setpoint_V - true_states[:, 4]], axis=1)
+        rewards = -np.sum(true_error ** 2, axis=1)
+
+        if self.history is not None:
+            self.history.extend(rows)
+
+        return trajectory, rewards
+
+    # -----------------------------------------
+    # Snapshot and restore
+    # -----------------------------------------
+    # Scalars at the head of EnvSnapshot.values, followed by the arrays of _snapshot_arrays()
+    _snapshot_scalars = 8
+
+    def _snapshot_arrays(self):
+        return (self.true_state, self.state, self.measurement_buffer.data,
+                self.control_buffer.data, self.u_history.data, self.e_history.data)
+
+    def get_state(self, snapshot=None):
+        """
+        Capture everything step() depends on: the true state, the delay lines, the PID
+        histories, the process parameters, the disturbance schedule, the random streams
+        and the integrator/MPC state. The recorded history and figures are not copied
+        (set_state only rewinds the number of recorded rows).
+
+        Pass a previous snapshot of this environment to overwrite it in place instead of
+        allocating a new one. Returns an EnvSnapshot.
+        """
+        arrays = self._snapshot_arrays()
+        if snapshot is None:
+            snapshot = EnvSnapshot(self._snapshot_scalars + len(self.process_params)
+                                   + sum(a.size for a in arrays))
+        values = snapshot.values
+        values[:self._snapshot_scalars] = (
+            self.current_step, self._noise_index, self._disturbance_index,
+            np.nan if self.history is None else self.history.size,
+            self.measurement_buffer.head, self.control_buffer.head,
+            self.u_history.head, self.e_history.head)
+
+        i = self._snapshot_scalars
+        for value in self.process_params.values():
+            values[i] = value
+            i += 1
+        for a in arrays:
+            values[i:i + a.size] = a.ravel()
+            i += a.size
+
+        for rng, row in zip((self.params_rng, self.noise_rng, self.disturbance_rng), snapshot.rng_states):
+            _pack_rng_state(rng, row)
+        snapshot.episode_draws = (self._noise_block, self._disturbance_draws, self.disturbance_events)
+        snapshot.extra = (self.integrator.get_state(),
+                          None if self.mpc is None else self.mpc.get_state(),
+                          self.disturbances.get_state(),
+                          None if self._seeded_noise_rng is None else self._seeded_noise_rng.bit_generator.state)
+        return snapshot
+
+    def set_state(self, snapshot):
+        """
+        Restore a snapshot taken by get_state() on this environment (or on one with the
+        same delays), so that the following steps reproduce the original ones exactly.
+        The snapshot itself is not modified and can be restored any number of times.
+        """
+        values = snapshot.values
+        (current_step, noise_index, disturbance_index,
+         history_size, *heads) = values[:self._snapshot_scalars].tolist()
+        self.current_step = int(current_step)
+        self._noise_index = int(noise_index)
+        self._disturbance_index = int(disturbance_index)
+        if self.history is not None and not np.isnan(history_size):
+            self.history.size = int(history_size)
+
+        i = self._snapshot_scalars
+        for name in self.process_params:
+            self.process_params[name] = values[i]
+            i += 1
+
+        # The state arrays may have been handed out in info dicts, so they are replaced;
+        # the ring buffers are private and are overwritten in place
+        n = self.true_state.size
+        self.true_state = values[i:i + n].copy()
+        self.state = values[i + n:i + 2 * n].copy()
+        i += 2 * n
+        buffers = (self.measurement_buffer, self.control_buffer, self.u_history, self.e_history)
+        for buffer, head in zip(buffers, heads):
+            data = buffer.data
+            data.reshape(-1)[:] = values[i:i + data.size]
+            buffer.head = int(head)
+            i += data.size
+
+        integrator_state, mpc_state, scheduler_state, seeded_noise_state = snapshot.extra
+        # The noise stream set aside during a scenario episode (see _load_scenario)
+        if seeded_noise_state is None:
+            if self._seeded_noise_rng is not None:
+                self.noise_rng, self._seeded_noise_rng = self._seeded_noise_rng, None
+        else:
+            if self._seeded_noise_rng is None:
+                self._seeded_noise_rng, self.noise_rng = self.noise_rng, np.random.default_rng()
+            self._seeded_noise_rng.bit_generator.state = seeded_noise_state
+
+        for rng, row in zip((self.params_rng, self.noise_rng, self.disturbance_rng), snapshot.rng_states):
+            _unpack_rng_state(rng, row)
+        self._noise_block, self._disturbance_draws, self.disturbance_events = snapshot.episode_draws
+        self.integrator.set_state(integrator_state)
+        self.disturbances.set_state(scheduler_state)
+        if mpc_state is not None:
+            self.mpc.set_state(mpc_state)
 
 
     # -----------------------------------------
     # Define render function
     # -----------------------------------------
-    def render(self, mode='human'):
+    def render(self, mode=None):
         """
         Render the environment's current state
         Shows plots of controlled variables (Cb, V) and temperature over time
         Also shows control actions (Tc, Fin)
+
+        Modes:
+          'human': live interactive figure, returns the figure
+          'rgb_array': off-screen rendering, returns an (H, W, 3) uint8 image
+
+        The figure is built once; later calls only draw the points recorded since the
+        previous call on top of a cached background (blitting), so the cost of a frame
+        does not grow with the episode length.
+        """
+        mode = mode or self.render_mode or 'human'
+        if self.history is None:
+            raise RuntimeError("render() needs the trajectory history; enable it with set_recording()")
+
+        if self.fig is None or self._render_mode != mode:
+            self._create_figure(mode)
+
+        n = len(self.history)
+        if n < self._drawn or self._needs_redraw or self._exceeds_limits(max(self._drawn - 1, 0), n):
+            self._redraw()
+        elif n > self._drawn:
+            self._draw_new_points(n)
+
+        if mode == 'rgb_array':
+            return np.asarray(self.fig.canvas.buffer_rgba())[..., :3].copy()
+
+        self.fig.canvas.flush_events()
+        return self.fig
+
+    def _create_figure(self, mode):
         """
-        if not hasattr(self, 'fig') or self.fig is None:
-            # Create figure on the first call
+        Build the figure, axes and line artists used by render().
+        """
+        self.close_figure()
+
+        if mode == 'human':
+            plt = _pyplot()
             plt.ion() # Interactive mode
             self.fig, self.axs = plt.subplots(2, 2, figsize=(12, 8))
-            self.fig.suptitle("CSTR Control System")
-
-            # Configure subplots
-            self.axs[0, 0].set_title("Product B Concentration (Cb)")
-            self.axs[0, 0].set_xlabel("Time (min)")
-            self.axs[0, 0].set_ylabel("Concentration B (mol/m^3)")
-
-            self.axs[0, 1].set_title("Reactor Volume (V)")
-            self.axs[0, 1].set_xlabel("Time (min)")
-            self.axs[0, 1].set_ylabel("Volume (m^3)")
-
-            self.axs[1, 0].set_title("Reactor Temperature (T)")
-            self.axs[1, 0].set_xlabel("Time (min)")
-            self.axs[1, 0].set_ylabel("Temperature (K)")
-
-            self.axs[1, 1].set_title("Control Actions")
-            self.axs[1, 1].set_xlabel("Time (min)")
-            self.axs[1, 1].set_ylabel("Value")
-
-            plt.tight_layout()
-
-        # Update plots
-        if self.current_step > 0:
-            # Clear previous plots
-            for ax in self.axs.flatten():
-                ax.clear()
-
-            # Plot Cb and setpoint
-            self.axs[0, 0].plot(self.history['time'], self.history['Cb'], 'b-', label='Actual Cb')
-            self.axs[0, 0].plot(self.history['time'], self.history['setpoint_Cb'], 'r--', label='Setpoint')
-            self.axs[0, 0].legend()
-            self.axs[0, 0].set_title('Product B Concentration')
-            self.axs[0, 0].set_xlabel('Time (min)')
-            self.axs[0, 0].set_ylabel('Cb (mol/m³)')
-
-            # Plot Volume and setpoint
-            self.axs[0, 1].plot(self.history['time'], self.history['V'], 'g-', label='Actual Volume')
-            self.axs[0, 1].plot(self.history['time'], self.history['setpoint_V'], 'r--', label='Setpoint')
-            self.axs[0, 1].legend()
-            self.axs[0, 1].set_title('Reactor Volume')
-            self.axs[0, 1].set_xlabel('Time (min)')
-            self.axs[0, 1].set_ylabel('Volume (m³)')
-
-            # Plot Temperature
-            self.axs[1, 0].plot(self.history['time'], self.history['T'], 'r-', label='Reactor Temp')
-            self.axs[1, 0].legend()
-            self.axs[1, 0].set_title('Reactor Temperature')
-            self.axs[1, 0].set_xlabel('Time (min)')
-            self.axs[1, 0].set_ylabel('Temperature (K)')
-
-            # Plot Control Actions
-            self.axs[1, 1].plot(self.history['time'], self.history['Tc'], 'b-', label='Cooling Temp')
-            self.axs[1, 1].plot(self.history['time'], self.history['Fin'], 'g-', label='Inlet Flow')
-            self.axs[1, 1].legend()
-            self.axs[1, 1].set_title('Control Actions')
-            self.axs[1, 1].set_xlabel('Time (min)')
-            self.axs[1, 1].set_ylabel('Value')
-
-            plt.tight_layout()
-            plt.draw()
-            plt.pause(0.01)
-
-        return self.fig 
+        else:
+            # Off-screen: a bare Agg canvas, without pyplot or a GUI backend
+            from matplotlib.figure import Figure
+            from matplotlib.backends.backend_agg import FigureCanvasAgg
+            self.fig = Figure(figsize=(12, 8))
+            FigureCanvasAgg(self.fig)
+            self.axs = self.fig.subplots(2, 2)
+        self._render_mode = mode
+        self.fig.suptitle("CSTR Control System")
+
+        # Configure subplots
+        self.axs[0, 0].set_title('Product B Concentration')
+        self.axs[0, 0].set_xlabel('Time (min)')
+        self.axs[0, 0].set_ylabel('Cb (mol/m³)')
+        self.axs[0, 0].set_ylim(0.0, 1.0)
+
+        self.axs[0, 1].set_title('Reactor Volume')
+        self.axs[0, 1].set_xlabel('Time (min)')
+        self.axs[0, 1].set_ylabel('Volume (m³)')
+        self.axs[0, 1].set_ylim(80.0, 120.0)
+
+        self.axs[1, 0].set_title('Reactor Temperature')
+        self.axs[1, 0].set_xlabel('Time (min)')
+        self.axs[1, 0].set_ylabel('Temperature (K)')
+        self.axs[1, 0].set_ylim(300.0, 400.0)
+
+        self.axs[1, 1].set_title('Control Actions')
+        self.axs[1, 1].set_xlabel('Time (min)')
+        self.axs[1, 1].set_ylabel('Value')
+        self.axs[1, 1].set_ylim(80.0, 460.0)
+
+        for ax in self.axs.flat:
+            ax.set_xlim(0.0, self.sim_steps * self.dt)
+
+        # Each series has a full line (drawn on full redraws) and an animated
+        # segment line that only carries the points added since the last frame
+        series = [
+            (self.axs[0, 0], 'Cb', 'b-', 'Actual Cb'),
+            (self.axs[0, 0], 'setpoint_Cb', 'r--', 'Setpoint'),
+            (self.axs[0, 1], 'V', 'g-', 'Actual Volume'),
+            (self.axs[0, 1], 'setpoint_V', 'r--', 'Setpoint'),
+            (self.axs[1, 0], 'T', 'r-', 'Reactor Temp'),
+            (self.axs[1, 1], 'Tc', 'b-', 'Cooling Temp'),
+            (self.axs[1, 1], 'Fin', 'g-', 'Inlet Flow'),
+        ]
+        self._render_series = []
+        for ax, field, style, label in series:
+            line, = ax.plot([], [], style, label=label)
+            segment, = ax.plot([], [], style, animated=True)
+            self._render_series.append((ax, field, line, segment))
+        for ax in self.axs.flat:
+            ax.legend(loc='upper right')
+
+        self.fig.tight_layout()
+        self._backgrounds = None
+        self._drawn = 0
+        self._needs_redraw = True
+        self._redrawing = False
+        # The cached backgrounds are stale after any redraw we did not trigger (e.g. a resize)
+        self.fig.canvas.mpl_connect('draw_event', self._on_draw)
+
+    def _on_draw(self, event):
+        if not self._redrawing:
+            self._needs_redraw = True
+
+    def _exceeds_limits(self, start, stop):
+        """
+        Check whether the points recorded in [start, stop) leave the current axis limits,
+        and widen the limits if they do.
+        """
+        if stop <= start:
+            return False
+        exceeded = False
+        t_max = self.history['time'][stop - 1]
+        x_min, x_max = self.axs[0, 0].get_xlim()
+        if t_max > x_max:
+            for ax in self.axs.flat:
+                ax.set_xlim(x_min, max(2 * x_max, t_max))
+            exceeded = True
+        for ax, field, line, segment in self._render_series:
+            values = self.history[field][start:stop]
+            low, high = ax.get_ylim()
+            v_min, v_max = np.nanmin(values), np.nanmax(values)
+            if v_min < low or v_max > high:
+                margin = 0.1 * (max(high, v_max) - min(low, v_min))
+                ax.set_ylim(min(low, v_min - margin), max(high, v_max + margin))
+                exceeded = True
+        return exceeded
+
+    def _redraw(self):
+        """
+        Full redraw of the figure, then cache the axes backgrounds for blitting.
+        """
+        n = len(self.history)
+        time = self.history['time']
+        for ax, field, line, segment in self._render_series:
+            line.set_data(time, self.history[field])
+            segment.set_data([], [])
+        if n > 0:
+            self._exceeds_limits(0, n)
+
+        self._redrawing = True
+        self.fig.canvas.draw()
+        self._redrawing = False
+        self._backgrounds = {ax: self.fig.canvas.copy_from_bbox(ax.bbox) for ax in self.axs.flat}
+        self._drawn = n
+        self._needs_redraw = False
+
+    def _draw_new_points(self, n):
+        """
+        Blit the points recorded since the last frame onto the cached backgrounds.
+        """
+        start = self._drawn - 1 # overlap one point so the segments join up
+        time = self.history['time'][start:n]
+        canvas = self.fig.canvas
+        for ax in self.axs.flat:
+            canvas.restore_region(self._backgrounds[ax])
+        for ax, field, line, segment in self._render_series:
+            segment.set_data(time, self.history[field][start:n])
+            ax.draw_artist(segment)
+        for ax in self.axs.flat:
+            canvas.blit(ax.bbox)
+            self._backgrounds[ax] = canvas.copy_from_bbox(ax.bbox)
+        self._drawn = n
     
 
     # -----------------------------------------
@@ -600,11 +2472,469 @@ class CSTRRLEnv(gym.Env):
         """
         Close the environment and clean up resources.
         """
-        if hasattr(self, 'fig') and self.fig is not None:
-            plt.close(self.fig)
+        if self.history is not None:
+            self.history.finalize()
+
+        self.close_figure()
+
+    def close_figure(self):
+        """
+        Close the render figure, if any.
+        """
+        if self.fig is not None:
+            if self._render_mode == 'human':
+                plt = _pyplot()
+                plt.close(self.fig)
+                plt.ioff()
             self.fig = None
-            plt.ioff()
 
 
 
-            
\ No newline at end of file
+            
+
+
+##############################################
+# 7. Vectorized CSTR Environment
+##############################################
+
+class VectorCSTREnv(VectorEnv):
+    """
+    A batched version of CSTRRLEnv that steps N independent reactors in one NumPy call.
+
+    The states, process parameters, delay buffers and PID histories of all reactors
+    are kept as (N, ...) arrays, and the dynamics (batch_cstr_dynamics) and controller
+    (PID_velocity_batch) are evaluated over the whole batch at once. With the default
+    odeint backend the N reactors are integrated as one block-diagonal ODE system, so
+    the banded Jacobian keeps the integration cost linear in N.
+
+    Each reactor follows the same semantics as CSTRRLEnv (parameter uncertainty,
+    measurement noise, actuator and transport delays, disturbances). Episodes are
+    reset automatically on the step after they terminate (gymnasium NEXT_STEP mode).
+
+    Observation (per reactor) and Action (per reactor) are the same as in CSTRRLEnv.
+    """
+    metadata = {"autoreset_mode": AutoresetMode.NEXT_STEP}
+
+    # Nominal values of the uncertain process parameters
+    nominal_params = CSTRRLEnv.nominal_params
+
+    def __init__(self, num_envs, simulation_steps=100, dt=1.0,
+                 uncertainty_level=0.1,
+                 noise_level=0.02,
+                 actuator_delay_steps=1,
+                 transport_delay_steps=2,
+                 enable_disturbances=True,
+                 integrator='odeint',
+                 integrator_options=None,
+                 seed=None,
+                 scenario_bank=None,
+                 disturbance_spacing='doubling'):
+        super(VectorCSTREnv, self).__init__()
+
+        # Per-instance random streams (parameters, noise, disturbances), as in CSTRRLEnv
+        self.seed(seed)
+
+        self.num_envs = num_envs
+
+        # simulate parameters
+        self.sim_steps = simulation_steps
+        self.dt = dt
+
+        # Integrator backend, applied to the whole batch at once
+        self.integrator = make_integrator(integrator, **(integrator_options or {}))
+
+        # Uncertainty and noise parameters
+        self.uncertainty_level = uncertainty_level
+        self.noise_level = noise_level
+
+        # Delay Parameters
+        self.actuator_delay_steps = actuator_delay_steps
+        self.transport_delay_steps = transport_delay_steps
+
+        # Disturbance Parameters
+        self.enable_disturbances = enable_disturbances
+        self.disturbance_interval = 20
+        self.disturbance_spacing = disturbance_spacing
+
+        # Steps of the disturbance events (the same for every reactor), followed by a
+        # sentinel that is never reached, so the next event of each reactor is an array lookup
+        self.disturbance_steps = np.append(
+            disturbance_steps(simulation_steps, self.disturbance_interval, disturbance_spacing),
+            np.iinfo(np.int64).max)
+
+        # Spaces of a single reactor (identical to CSTRRLEnv) and of the whole batch
+        self.single_action_space = spaces.Box(low=-1, high=1, shape=(6,), dtype=np.float64)
+        self.single_observation_space = spaces.Box(
+            low=np.array([0.0, 300.0, 80.0, 0.0, 300.0, 80.0, 0.0, 80.0]),
+            high=np.array([1.0, 400.0, 120.0, 1.0, 400.0, 120.0, 1.0, 120.0]),
+            dtype=np.float64
+        )
+        self.action_space = batch_space(self.single_action_space, num_envs)
+        self.observation_space = batch_space(self.single_observation_space, num_envs)
+
+        # PID gain scaling: map normalized action to actual PID gains
+        self.pid_lower = np.array([-5, 0, 0.02, 0, 0, 0.01])
+        self.pid_upper = np.array([25, 20, 10, 1, 2, 1])
+
+        # Setpoints for the controlled variables (constant case)
+        self.setpoint_Cb = 0.70
+        self.setpoint_V  = 100.0
+
+        # Initial reactor conditions x = [Ca, Cb, Cc, T, V] and default control [Tc, Fin]
+        self.x0 = np.array([0.8, 0.0, 0.0, 325.0, 100.0])
+        self.default_u = np.array([300.0, 100.0])
+
+        # Batched reactor states
+        self.state = np.tile(self.x0, (num_envs, 1))
+        self.true_state = np.tile(self.x0, (num_envs, 1))
+        self.current_step = np.zeros(num_envs, dtype=np.int64)
+
+        # Batched uncertain parameters, one array of shape (N,) per parameter
+        self.process_params = {key: np.full(num_envs, nominal)
+                               for key, nominal in self.nominal_params.items()}
+
+        # Batched PID histories (two most recent entries, most recent last)
+        self.e_history = np.zeros((num_envs, 2, 2))
+        self.u_history = np.tile(self.default_u, (num_envs, 2, 1))
+
+        # Batched delay lines; each row is a circular buffer with its own head (oldest entry)
+        self.measurement_buffer = np.tile(self.x0, (num_envs, max(1, transport_delay_steps), 1))
+        self.control_buffer = np.tile(self.default_u, (num_envs, max(1, actuator_delay_steps), 1))
+        self._measurement_head = np.zeros(num_envs, dtype=np.int64)
+        self._control_head = np.zeros(num_envs, dtype=np.int64)
+
+        # Batched disturbance timing: index of the next event in disturbance_steps and
+        # step of the pending cooling system fix (-1 means none; one per reactor, as the
+        # events are disturbance_interval > COOLING_UPSET_STEPS apart)
+        self._disturbance_event = np.zeros(num_envs, dtype=np.int64)
+        self.next_cooling_fix = np.full(num_envs, -1, dtype=np.int64)
+
+        # Scenario replayed by every reactor (-1: random) and its next disturbance event
+        self.set_scenario_bank(scenario_bank)
+        self.scenario_ids = np.full(num_envs, -1, dtype=np.int64)
+        self._scenario_event = np.zeros(num_envs, dtype=np.int64)
+
+        # Reactors whose episode ended on the previous step and are reset on this one
+        self._autoreset_envs = np.zeros(num_envs, dtype=bool)
+
+    def seed(self, seed=None):
+        """
+        Create the per-instance random number generators (see CSTRRLEnv.seed).
+        """
+        self.seed_sequence, self.params_rng, self.noise_rng, self.disturbance_rng = _spawn_rngs(seed)
+
+    def set_scenario_bank(self, scenario_bank=None):
+        """
+        Use a CSTR_scenarios.ScenarioBank (or the path of a saved one) for
+        reset(options={'scenario_ids': ...}), see CSTRRLEnv.set_scenario_bank.
+        """
+        if isinstance(scenario_bank, (str, os.PathLike)):
+            from CSTR_scenarios import ScenarioBank
+            scenario_bank = ScenarioBank.load(scenario_bank)
+        if scenario_bank is not None:
+            scenario_bank.check_env(self)
+        self.scenario_bank = scenario_bank
+
+    # -----------------------------------------
+    # Define reset function
+    # -----------------------------------------
+    def reset(self, seed=None, options=None):
+        """
+        Reset all reactors (or those selected by options['reset_mask']) to the initial state.
+        A seed re-creates the random streams; without one they continue.
+        options['scenario_ids'] (one id per reset reactor) takes the process parameters
+        and disturbance schedules from the scenario bank; the measurement noise stays a
+        batch-wide stream, and automatic resets draw random parameters again.
+        """
+        if seed is not None:
+            self.seed(seed)
+
+        if options is not None and 'reset_mask' in options:
+            rows = np.flatnonzero(options['reset_mask'])
+        else:
+            rows = np.arange(self.num_envs)
+
+        obs = self._observations()
+        obs[rows] = self._reset_rows(rows, None if options is None else options.get('scenario_ids'))
+        self._autoreset_envs[rows] = False
+
+        return obs, {}
+
+    def _reset_rows(self, rows, scenario_ids=None):
+        """
+        Reset the reactors in `rows` (to the scenarios `scenario_ids`, if given) and
+        return their initial observations.
+        """
+        n = rows.size
+
+        self.state[rows] = self.x0
+        self.true_state[rows] = self.x0
+        self.current_step[rows] = 0
+
+        # Reset disturbance timing
+        self._disturbance_event[rows] = 0
+        self.next_cooling_fix[rows] = -1
+
+        # Draw the uncertain parameters of all reset reactors in one call
+        if scenario_ids is None:
+            draws = self.params_rng.random((len(self.nominal_params), n))
+            for draw, (key, nominal) in zip(draws, self.nominal_params.items()):
+                self.process_params[key][rows] = nominal * (1 + self.uncertainty_level * (draw - 0.5))
+            self.scenario_ids[rows] = -1
+        else:
+            if self.scenario_bank is None:
+                raise ValueError("options['scenario_ids'] requires a scenario_bank")
+            scenario_ids = np.broadcast_to(scenario_ids, (n,))
+            for key, value in self.scenario_bank.params(scenario_ids).items():
+                self.process_params[key][rows] = value
+            self.scenario_ids[rows] = scenario_ids
+        self._scenario_event[rows] = 0
+
+        # Reset PID histories and delay lines
+        self.u_history[rows] = self.default_u
+        self.control_buffer[rows] = self.default_u
+        self._control_head[rows] = 0
+
+        measured_state = self.apply_measurement_noise(self.state[rows])
+        self.measurement_buffer[rows] = measured_state[:, None, :]
+        self._measurement_head[rows] = 0
+
+        initial_error = self._errors(measured_state)
+        self.e_history[rows] = initial_error[:, None, :]
+
+        return self._observations(measured_state, measured_state)
+
+    # -----------------------------------------
+    # Add noise to measurements
+    # -----------------------------------------
+    def apply_measurement_noise(self, states):
+        """
+        Add relative noise to a batch of state measurements of shape (n, 5).
+        """
+        noise = states * self.noise_level * self.noise_rng.standard_normal(states.shape)
+        # Ensure no negative concentrations or volumes
+        return np.maximum(0, states + noise)
+
+    # -----------------------------------------
+    # Apply disturbances
+    # -----------------------------------------
+    def apply_disturbances(self, rows):
+        """
+        Apply random disturbances to the reactors in `rows` and return the disturbance codes
+        (indices into DISTURBANCE_NAMES).
+        """
+        n = rows.size
+        disturbance_type = self.disturbance_rng.integers(0, 3, size=n)
+        magnitude = 1 + 0.1 * (self.disturbance_rng.random(n) - 0.5)
+
+        # Reactors replaying a scenario take the next event of its schedule
+        if self.scenario_bank is not None:
+            ids, event = self.scenario_ids[rows], self._scenario_event[rows]
+            scheduled = (ids >= 0) & (event < self.scenario_bank.n_events)
+            if scheduled.any():
+                events = self.scenario_bank.data[ids[scheduled]]
+                k = event[scheduled]
+                disturbance_type[scheduled] = events['disturbance_type'][np.arange(k.size), k]
+                magnitude[scheduled] = 1 + 0.1 * (events['disturbance_draw'][np.arange(k.size), k] - 0.5)
+            self._scenario_event[rows] += 1
+
+        # Feed temperature step
+        feed_T = rows[disturbance_type == 0]
+        self.process_params['Tf'][feed_T] *= magnitude[disturbance_type == 0]
+
+        # Feed concentration step
+        feed_C = rows[disturbance_type == 1]
+        self.process_params['Caf'][feed_C] *= magnitude[disturbance_type == 1]
+
+        # Brief cooling system upset (restored after 3 steps)
+        cooling = rows[disturbance_type == 2]
+        self.process_params['UA'][cooling] *= 0.8
+        self.next_cooling_fix[cooling] = self.current_step[cooling] + COOLING_UPSET_STEPS
+
+        return disturbance_type
+
+    # -----------------------------------------
+    # Define step function
+    # -----------------------------------------
+    def step(self, actions):
+        """
+        Step every reactor with its own action (shape (N, 6)).
+        Reactors that terminated on the previous step are reset instead.
+        """
+        actions = np.asarray(actions, dtype=np.float64).reshape(self.num_envs, 6)
+
+        obs = np.empty((self.num_envs, 8))
+        rewards = np.zeros(self.num_envs)
+        terminations = np.zeros(self.num_envs, dtype=bool)
+        truncations = np.zeros(self.num_envs, dtype=bool)
+
+        pid_gains = ((actions + 1) / 2) * (self.pid_upper - self.pid_lower) + self.pid_lower
+        control_action = np.zeros((self.num_envs, 2))
+        disturbance = np.full(self.num_envs, -1, dtype=np.int64)
+
+        autoreset = self._autoreset_envs
+        reset_rows = np.flatnonzero(autoreset)
+        if reset_rows.size:
+            obs[reset_rows] = self._reset_rows(reset_rows)
+
+        rows = np.flatnonzero(~autoreset)
+        if rows.size:
+            (obs[rows], rewards[rows], terminations[rows],
+             control_action[rows], disturbance[rows]) = self._step_rows(rows, pid_gains[rows])
+
+        self._autoreset_envs = terminations | truncations
+
+        stepped = ~autoreset
+        infos = {
+            "pid_gains": pid_gains, "_pid_gains": stepped,
+            "control_action": control_action, "_control_action": stepped,
+            "true_state": self.true_state.copy(), "_true_state": stepped,
+            "disturbance": disturbance, "_disturbance": disturbance >= 0,
+        }
+
+        return obs, rewards, terminations, truncations, infos
+
+    def step_rows(self, rows, actions, reset=None, scenario_ids=None):
+        """
+        Step (or reset) only the reactors in `rows`, leaving the others untouched.
+        Inputs: rows - distinct reactor indices
+                actions - normalized actions, one row of 6 per reactor
+                reset - optional mask of reactors to reset instead of stepping;
+                        reactors marked by request_reset or that terminated on their
+                        previous step are reset as well
+                scenario_ids - optional scenario id per reactor for the resets (-1: random)
+        Returns obs, rewards, terminations, truncations, infos for `rows`; infos holds
+        the 'true_state' of every selected reactor and the 'reset' mask.
+        """
+        rows = np.asarray(rows, dtype=np.int64).reshape(-1)
+        actions = np.asarray(actions, dtype=np.float64).reshape(rows.size, 6)
+
+        obs = np.empty((rows.size, 8))
+        rewards = np.zeros(rows.size)
+        terminations = np.zeros(rows.size, dtype=bool)
+        truncations = np.zeros(rows.size, dtype=bool)
+
+        resetting = self._autoreset_envs[rows].copy()
+        if reset is not None:
+            resetting |= np.asarray(reset, dtype=bool)
+        if resetting.any():
+            reset_rows = rows[resetting]
+            if scenario_ids is None:
+                scenario = np.full(reset_rows.size, -1, dtype=np.int64)
+            else:
+                scenario = np.broadcast_to(np.asarray(scenario_ids, dtype=np.int64), (rows.size,))[resetting]
+            with_scenario = scenario >= 0
+            part = np.empty((reset_rows.size, 8))
+            if with_scenario.any():
+                part[with_scenario] = self._reset_rows(reset_rows[with_scenario], scenario[with_scenario])
+            if not with_scenario.all():
+                part[~with_scenario] = self._reset_rows(reset_rows[~with_scenario])
+            obs[resetting] = part
+            self._autoreset_envs[reset_rows] = False
+
+        stepping = ~resetting
+        if stepping.any():
+            step_rows = rows[stepping]
+            pid_gains = ((actions[stepping] + 1) / 2) * (self.pid_upper - self.pid_lower) + self.pid_lower
+            obs[stepping], rewards[stepping], terminations[stepping], _, _ = self._step_rows(step_rows, pid_gains)
+            self._autoreset_envs[step_rows] = terminations[stepping] | truncations[stepping]
+
+        infos = {"true_state": self.true_state[rows], "reset": resetting}
+
+        return obs, rewards, terminations, truncations, infos
+
+    def request_reset(self, rows):
+        """
+        Mark the reactors in `rows` to start a new episode on their next step
+        (the same automatic reset that follows a terminated episode).
+        """
+        self._autoreset_envs[np.asarray(rows, dtype=np.int64)] = True
+
+    def _step_rows(self, rows, pid_gains):
+        """
+        Advance the reactors in `rows` by one control interval.
+        """
+        step = self.current_step[rows]
+
+        # Get the current (possibly delayed and noisy) measurements
+        measurement_head = self._measurement_head[rows]
+        measured_state = self.measurement_buffer[rows, measurement_head]
+
+        # Compute the error based on measurement
+        current_error = self._errors(measured_state)
+
+        # Determine control action using velocity PID (hold the last action for the first two steps)
+        u_history = self.u_history[rows]
+        control_action = PID_velocity_batch(pid_gains, current_error, self.e_history[rows], u_history, self.dt)
+        warmup = step < 2
+        control_action[warmup] = u_history[warmup, -1]
+
+        # Swap the new control action into the actuator delay line
+        control_head = self._control_head[rows]
+        delayed_control = self.control_buffer[rows, control_head]
+        self.control_buffer[rows, control_head] = control_action
+        self._control_head[rows] = (control_head + 1) % self.control_buffer.shape[1]
+
+        # Store the new control action and error in history
+        self.u_history[rows, 0] = u_history[:, 1]
+        self.u_history[rows, 1] = control_action
+        self.e_history[rows, 0] = self.e_history[rows, 1]
+        self.e_history[rows, 1] = current_error
+
+        # Apply disturbances if enabled
+        disturbance = np.full(rows.size, -1, dtype=np.int64)
+        if self.enable_disturbances:
+            due = step >= self.disturbance_steps[self._disturbance_event[rows]]
+            if due.any():
+                disturbance[due] = self.apply_disturbances(rows[due])
+                self._disturbance_event[rows[due]] += 1
+
+            # Fix cooling systems whose upset is over
+            fixed = rows[self.next_cooling_fix[rows] == step]
+            self.process_params['UA'][fixed] /= 0.8
+            self.next_cooling_fix[fixed] = -1
+
+        # Save current state before integration
+        prev_state = self.true_state[rows]
+
+        # Simulate all selected reactors as one batch
+        params = {key: value[rows] for key, value in self.process_params.items()}
+        new_state = self.integrator.integrate(batch_cstr_dynamics, prev_state, self.dt,
+                                              args=(delayed_control, params), jac=batch_cstr_jacobian,
+                                              params=params)
+        self.true_state[rows] = new_state
+
+        # Apply measurement noise and swap it into the transport delay line
+        self.measurement_buffer[rows, measurement_head] = self.apply_measurement_noise(new_state)
+        self._measurement_head[rows] = (measurement_head + 1) % self.measurement_buffer.shape[1]
+        self.state[rows] = measured_state
+
+        # Compute reward: negative sum of squared errors on the true state
+        reward = -np.sum(self._errors(new_state) ** 2, axis=1)
+
+        obs = self._observations(measured_state, prev_state)
+
+        self.current_step[rows] += 1
+        done = self.current_step[rows] >= self.sim_steps
+
+        return obs, reward, done, control_action, disturbance
+
+    def _errors(self, states):
+        """
+        Setpoint errors [e_Cb, e_V] for a batch of states.
+        """
+        return np.stack([self.setpoint_Cb - states[:, 1],
+                         self.setpoint_V - states[:, 4]], axis=1)
+
+    def _observations(self, current=None, previous=None):
+        """
+        Build observations [Cb, T, V, Cb_prev, T_prev, V_prev, Cb_setpoint, V_setpoint].
+        """
+        if current is None:
+            current, previous = self.state, self.true_state
+        obs = np.empty((current.shape[0], 8))
+        obs[:, 0:3] = current[:, [1, 3, 4]]
+        obs[:, 3:6] = previous[:, [1, 3, 4]]
+        obs[:, 6] = self.setpoint_Cb
+        obs[:, 7] = self.setpoint_V
+        return obs
@@ -0,0 +1,266 @@
+###########################
+# import
+###########################
+
+import numpy as np
+from scipy.linalg import cho_factor, cho_solve, expm
+from scipy.optimize import root
+
+from CSTR_model_plus import U_LOWER, U_UPPER, _cstr_jacobian, batch_cstr_dynamics
+from CSTR_operating_point import PARAM_NAMES, OperatingPointCache, linearize, solve_steady_state
+
+
+
+##############################################
+# 1. Operating point for the setpoints
+##############################################
+
+def solve_target(params, setpoint_Cb, V=100.0, x_guess=None, Tc_guess=350.0):
+    """
+    Steady state x_ss and inputs u_ss = [Tc, Fin] at which the reactor holds Cb = setpoint_Cb
+    at volume V (which requires Fin = Fout = 100). Returns (x_ss, u_ss).
+    """
+    Fin = 100.0
+    p = [params[name] for name in PARAM_NAMES]
+
+    # Unknowns z = [Ca, Cc, T, Tc] with Cb fixed at the setpoint
+    def unpack(z):
+        return np.array([z[0], setpoint_Cb, z[1], z[2], V]), np.array([z[3], Fin])
+
+    def fun(z):
+        x, u = unpack(z)
+        return batch_cstr_dynamics(x[None], 0.0, u[None], params)[0, :4]
+
+    def jac(z):
+        x, u = unpack(z)
+        J = np.empty((4, 4))
+        J[:, :3] = _cstr_jacobian(x, u, *p)[:4, [0, 2, 3]]
+        J[:, 3] = _cstr_jacobian(x, u, *p, wrt_inputs=True)[:4, 0]
+        return J
+
+    if x_guess is None:
+        x_guess = solve_steady_state(params, [Tc_guess, Fin], V)
+    z0 = np.array([x_guess[0], x_guess[2], x_guess[3], Tc_guess])
+
+    solution = root(fun, z0, jac=jac, method='hybr')
+    if not solution.success:
+        raise RuntimeError(f"Operating point solve failed: {solution.message}")
+    return unpack(solution.x)
+
+
+
+##############################################
+# 2. Condensed linear MPC
+##############################################
+
+class LinearMPC:
+    """
+    Linear model predictive controller for [Cb, V] around the setpoint operating point.
+
+    The CSTR is linearized at the steady state that holds the setpoints, discretized
+    with the control interval dt (zero-order hold), and the states are condensed out
+    of the horizon, so each step solves a box-constrained QP in the input moves only:
+
+        min_v  sum_k q_Cb (Cb_k - Cb_sp)^2 + q_V (V_k - V_sp)^2 + r |v_k|^2 + s |v_k - v_k-1|^2
+        s.t.   U_LOWER <= u_k <= U_UPPER
+
+    where v are the input deviations from the operating point, scaled by half the input
+    ranges. The noisy measurements are filtered by a fixed-gain observer on the same
+    linear model (filter_gain=1 uses the raw measurements), and measurement and
+    actuator delays are compensated by predicting the state at which the new action
+    takes effect, `delay` steps ahead of the measurement, from the actions already
+    sent but not yet seen in the measurement. The prediction matrices and the Cholesky
+    factorizations of the QP and ADMM systems are computed once per operating point
+    (set_operating_point) and kept for up to `cache_size` operating points, keyed by
+    the process parameters quantized as in CSTR_operating_point.OperatingPointCache
+    (relative spacing `cache_resolution`, solved at the grid point), so resets to a
+    previously seen reactor skip the solve, expm and factorizations. Each step only
+    needs a few small matrix-vector products and triangular solves. The QP is
+    warm-started from the shifted previous solution and skips ADMM entirely when the
+    unconstrained optimum is feasible.
+    """
+    # Attributes that depend only on the operating point; they are replaced, never modified
+    _operating_point_attrs = ('x_ss', 'u_ss', '_Ad', '_Bd', '_P_x', '_P_u', '_G_x', '_G_u', '_d',
+                              '_H_factor', '_K_factor', '_lower', '_upper')
+    # Attributes that change from step to step
+    _runtime_attrs = ('_x_est', '_pending', '_z', '_w', 'iterations')
+
+    def __init__(self, dt=1.0, setpoint_Cb=0.70, setpoint_V=100.0, horizon=10, delay=0,
+                 q=(1.0, 1.0), r=1e-4, s=1.0, filter_gain=(0.3, 0.3, 0.3, 0.3, 0.01),
+                 rho=0.1, relaxation=1.6, max_iter=200, tol=1e-6, cache_size=256,
+                 cache_resolution=1e-4):
+        self.dt = dt
+        self.setpoint_Cb = setpoint_Cb
+        self.setpoint_V = setpoint_V
+        self.horizon = horizon
+        self.delay = delay                        # steps from measurement to action taking effect
+        self.q = np.asarray(q, dtype=np.float64)  # output weights [Cb, V]
+        self.r = r                                # input weight (scaled deviations)
+        self.s = s                                # move weight (scaled changes)
+        self.filter_gain = np.asarray(filter_gain) # observer gain(s) on the measurement innovation
+        self.rho = rho                            # ADMM penalty (on the equilibrated QP)
+        self.relaxation = relaxation              # ADMM over-relaxation factor
+        self.max_iter = max_iter
+        self.tol = tol
+
+        self.u_scale = (U_UPPER - U_LOWER) / 2
+        for name in self._operating_point_attrs:
+            setattr(self, name, None) # set by set_operating_point
+        self.iterations = 0 # ADMM iterations of the last step
+        # Actions sent but not yet seen in the measurement, oldest first; the oldest one
+        # acted between the previous and the current measurement
+        self._pending = np.zeros((delay + 1, 2))
+        self._x_est = None
+        self._z = np.zeros(2 * horizon)
+        self._w = np.zeros(2 * horizon)
+
+        # Operating points seen so far (the setpoints are fixed, so only the process
+        # parameters enter the key; its input slots are unused)
+        self.cache = OperatingPointCache(maxsize=cache_size, resolution=cache_resolution)
+
+    def set_operating_point(self, params):
+        """
+        Linearize at the setpoint operating point of `params` and precompute the
+        condensed prediction matrices and the ADMM factorization (or take them from
+        the cache).
+        """
+        cache = self.cache
+        key = cache._key(params, (0.0, 0.0), self.setpoint_V)
+        entry = cache.entries.get(key)
+        if entry is not None:
+            cache.entries.move_to_end(key)
+            cache.hits += 1
+        else:
+            cache.misses += 1
+            entry = self._operating_point(cache._grid_point(key)[0])
+            cache._insert(key, entry)
+        self.__dict__.update(entry)
+        self.reset()
+
+    def _operating_point(self, params):
+        """
+        Setpoint operating point of `params` and the matrices derived from it, as a dict
+        of the _operating_point_attrs.
+        """
+        x_guess = None if self.x_ss is None else self.x_ss
+        Tc_guess = 350.0 if self.u_ss is None else self.u_ss[0]
+        x_ss, u_ss = solve_target(params, self.setpoint_Cb, self.setpoint_V, x_guess, Tc_guess)
+        A, B = linearize(x_ss, u_ss, params)
+        B = B * self.u_scale
+
+        # Zero-order-hold discretization through the augmented matrix exponential
+        M = np.zeros((7, 7))
+        M[:5, :5], M[:5, 5:] = A, B
+        E = expm(M * self.dt)
+        Ad, Bd = E[:5, :5], E[:5, 5:]
+
+        # Condensed predictions of [Cb, V] over the horizon: Y = Phi dx0 + Gamma v
+        N, C = self.horizon, np.zeros((2, 5))
+        C[0, 1] = C[1, 4] = 1.0
+        powers = [np.eye(5)]
+        for _ in range(max(N, self.delay)):
+            powers.append(Ad @ powers[-1])
+
+        # Delay compensation: x_pred = P_x dx + P_u (pending actions, oldest first)
+        P_x = powers[self.delay]
+        P_u = np.hstack([powers[self.delay - 1 - i] @ Bd for i in range(self.delay)]) \
+            if self.delay else np.zeros((5, 0))
+        Phi = np.vstack([C @ powers[k + 1] for k in range(N)])
+        Gamma = np.zeros((2 * N, 2 * N))
+        for k in range(N):
+            for j in range(k + 1):
+                Gamma[2 * k:2 * k + 2, 2 * j:2 * j + 2] = C @ powers[k - j] @ Bd
+
+        # Move differences D v - (v_prev, 0, ...), and the cost matrices
+        D = np.eye(2 * N) - np.eye(2 * N, k=-2)
+        Q = np.diag(np.tile(self.q, N))
+        H = 2 * (Gamma.T @ Q @ Gamma + self.r * np.eye(2 * N) + self.s * D.T @ D)
+
+        # Linear term g = G_x dx0 + G_u v_prev
+        G_x = 2 * Gamma.T @ Q @ Phi
+        G_u = -2 * self.s * D.T[:, :2]
+
+        # The QP is solved in the equilibrated variables v / d (unit diagonal Hessian), which
+        # makes ADMM converge in a few tens of iterations. H and H + rho I are small, fixed
+        # and positive definite, so they are Cholesky-factorized once.
+        d = 1 / np.sqrt(np.diag(H))
+        H = d[:, None] * H * d[None, :]
+
+        return {
+            'x_ss': x_ss, 'u_ss': u_ss, '_Ad': Ad, '_Bd': Bd, '_P_x': P_x, '_P_u': P_u,
+            '_G_x': d[:, None] * G_x, '_G_u': d[:, None] * G_u, '_d': d,
+            '_H_factor': cho_factor(H), '_K_factor': cho_factor(H + self.rho * np.eye(2 * N)),
+            '_lower': np.tile((U_LOWER - u_ss) / self.u_scale, N) / d,
+            '_upper': np.tile((U_UPPER - u_ss) / self.u_scale, N) / d,
+        }
+
+    def reset(self, u0=None, x0=None):
+        """
+        Forget the warm start and the state estimate (e.g. at the beginning of an episode).
+        u0 is the action currently applied and x0 the initial state, if known.
+        """
+        n = 2 * self.horizon
+        self._z = np.zeros(n)
+        self._w = np.zeros(n)
+        self._pending[:] = 0.0 if u0 is None else (np.asarray(u0) - self.u_ss) / self.u_scale
+        self._x_est = None if x0 is None else np.asarray(x0) - self.x_ss
+
+    def get_state(self):
+        """
+        Observer estimate, pending actions and ADMM warm start, with references to the
+        matrices of the current operating point (which are replaced, never modified).
+        """
+        state = {name: getattr(self, name) for name in self._operating_point_attrs + self._runtime_attrs}
+        state['_pending'] = self._pending.copy()
+        return state
+
+    def set_state(self, state):
+        for name in self._operating_point_attrs + self._runtime_attrs:
+            setattr(self, name, state[name])
+        self._pending = state['_pending'].copy()
+
+    def control(self, x, u_prev):
+        """
+        Control action [Tc, Fin] for the measured state x given the previous action u_prev.
+        """
+        # Observer update at the time of the measurement
+        dx = x - self.x_ss
+        if self._x_est is not None:
+            predicted = self._Ad @ self._x_est + self._Bd @ self._pending[0]
+            dx = predicted + self.filter_gain * (dx - predicted)
+        self._x_est = dx
+
+        # Predict the state at which the new action takes effect
+        if self.delay:
+            dx = self._P_x @ dx + self._P_u @ self._pending[1:].ravel()
+
+        v_prev = (np.asarray(u_prev) - self.u_ss) / self.u_scale
+        g = self._G_x @ dx + self._G_u @ v_prev
+
+        v = -cho_solve(self._H_factor, g)
+        if np.all(v >= self._lower) and np.all(v <= self._upper):
+            self.iterations = 0
+            z = v
+            self._w = np.zeros_like(v)
+        else:
+            # ADMM on the box constraints, warm-started from the shifted previous solution
+            z = np.concatenate([self._z[2:], self._z[-2:]])
+            w = np.concatenate([self._w[2:], self._w[-2:]])
+            rho, alpha = self.rho, self.relaxation
+            for i in range(self.max_iter):
+                v = cho_solve(self._K_factor, rho * (z - w) - g)
+                v = alpha * v + (1 - alpha) * z
+                z_prev = z
+                z = np.clip(v + w, self._lower, self._upper)
+                w = w + v - z
+                if (np.max(np.abs(v - z)) < self.tol
+                        and np.max(np.abs(z - z_prev)) < self.tol):
+                    break
+            self.iterations = i + 1
+            self._w = w
+        self._z = z
+
+        u = np.clip(self.u_ss + z[:2] * self._d[:2] * self.u_scale, U_LOWER, U_UPPER)
+        self._pending[:-1] = self._pending[1:]
+        self._pending[-1] = (u - self.u_ss) / self.u_scale
+        return u
@@ -0,0 +1,190 @@
+###########################
+# import
+###########################
+
+import os
+from collections import OrderedDict
+
+import numpy as np
+from scipy.integrate import odeint
+from scipy.optimize import root
+
+from CSTR_model_plus import CSTRRLEnv, _cstr_jacobian, batch_cstr_dynamics
+
+
+
+##############################################
+# 1. Steady state and linearization
+##############################################
+
+# Order of the process parameters in cache keys
+PARAM_NAMES = tuple(CSTRRLEnv.nominal_params)
+
+
+def _residual(x, u, params):
+    """
+    CSTR right-hand side for one reactor, shape (5,).
+    """
+    return batch_cstr_dynamics(x[None], 0.0, u[None], params)[0]
+
+
+def linearize(x, u, params):
+    """
+    Linearization dx/dt ~ A (x - x_ss) + B (u - u_ss) of custom_cstr_dynamics around (x, u).
+    Returns (A, B) with shapes (5, 5) and (5, 2).
+    """
+    p = [params[name] for name in PARAM_NAMES]
+    return _cstr_jacobian(x, u, *p), _cstr_jacobian(x, u, *p, wrt_inputs=True)
+
+
+def solve_steady_state(params, u, V=100.0, x_guess=None, settle_time=20.0, tol=1e-10):
+    """
+    Steady state [Ca, Cb, Cc, T, V] of custom_cstr_dynamics for the process parameters
+    `params` (dict as CSTRRLEnv.process_params) and constant inputs u = [Tc, Fin].
+
+    The volume integrates Fin - Fout, so it is held at V and only the material and
+    energy balances are solved (at Fin = Fout = 100 this is a true equilibrium).
+    Without a guess, the reactor is first integrated from a fresh feed for settle_time
+    minutes so that the root solver starts in the basin of the stable operating point.
+    """
+    u = np.asarray(u, dtype=np.float64)
+    p = [params[name] for name in PARAM_NAMES]
+
+    def fun(z):
+        return _residual(np.append(z, V), u, params)[:4]
+
+    def jac(z):
+        return _cstr_jacobian(np.append(z, V), u, *p)[:4, :4]
+
+    if x_guess is None:
+        z0 = np.array([params['Caf'], 0.0, 0.0, params['Tf']])
+        z0 = odeint(lambda z, t: fun(z), z0, [0.0, settle_time], Dfun=lambda z, t: jac(z))[-1]
+    else:
+        z0 = np.asarray(x_guess, dtype=np.float64)[:4]
+
+    solution = root(fun, z0, jac=jac, method='hybr', options={'xtol': tol})
+    if not solution.success:
+        raise RuntimeError(f"Steady state solve failed: {solution.message}")
+    return np.append(solution.x, V)
+
+
+
+##############################################
+# 2. Operating-point cache
+##############################################
+
+class OperatingPointCache:
+    """
+    Memoized steady states and linearizations keyed by quantized process parameters.
+
+    Queries are snapped to a grid with relative spacing `resolution` in every process
+    parameter, input and volume, and solved exactly at the grid point, so a cached
+    entry does not depend on which query created it. Up to `maxsize` entries are kept
+    in least-recently-used order. A miss is warm-started from the steady state of the
+    nearest cached entry (which also keeps the solution on the same branch of a
+    multi-stable reactor) and only falls back to a cold start if that fails.
+
+    If `path` is given, the cache is loaded from that .npz file when it exists and
+    written back by save().
+    """
+    # Reference scales used to quantize the keys: process parameters, Tc, Fin and V
+    scales = np.array(list(CSTRRLEnv.nominal_params.values()) + [300.0, 100.0, 100.0])
+
+    def __init__(self, maxsize=4096, resolution=1e-4, path=None):
+        self.maxsize = maxsize
+        self.resolution = resolution
+        self.path = path
+        self.entries = OrderedDict() # key tuple -> (x_ss, A, B)
+        self.hits = 0
+        self.misses = 0
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _key(self, params, u, V):
+        values = np.array([params[name] for name in PARAM_NAMES] + [u[0], u[1], V])
+        return tuple(np.rint(values / (self.scales * self.resolution)).astype(np.int64).tolist())
+
+    def _grid_point(self, key):
+        values = np.array(key) * self.scales * self.resolution
+        return dict(zip(PARAM_NAMES, values[:5])), values[5:7], values[7]
+
+    def get(self, params, u, V=100.0):
+        """
+        Steady state and linearization for process parameters `params` and inputs u = [Tc, Fin].
+        Returns read-only arrays (x_ss, A, B) with shapes (5,), (5, 5) and (5, 2).
+        """
+        key = self._key(params, u, V)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        grid_params, grid_u, grid_V = self._grid_point(key)
+        neighbor = self._nearest(key)
+        try:
+            x_ss = solve_steady_state(grid_params, grid_u, grid_V,
+                                      x_guess=None if neighbor is None else neighbor[0])
+        except RuntimeError:
+            if neighbor is None:
+                raise
+            x_ss = solve_steady_state(grid_params, grid_u, grid_V)
+
+        A, B = linearize(x_ss, grid_u, grid_params)
+        entry = (x_ss, A, B)
+        for array in entry:
+            array.setflags(write=False)
+        self._insert(key, entry)
+        return entry
+
+    def _nearest(self, key):
+        """
+        Cached entry closest to `key` in the quantized parameter space, or None.
+        """
+        if not self.entries:
+            return None
+        keys = np.array(list(self.entries))
+        nearest = np.argmin(np.sum((keys - np.array(key)) ** 2, axis=1))
+        return self.entries[tuple(keys[nearest].tolist())]
+
+    def _insert(self, key, entry):
+        self.entries[key] = entry
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = self.misses = 0
+
+    def save(self, path=None):
+        """
+        Write the cached entries (least recently used first) to an .npz file
+        (default: the path the cache was created with).
+        """
+        path = path or self.path
+        if path is None:
+            raise ValueError("no path given and cache has no default path")
+        keys = np.array(list(self.entries), dtype=np.int64).reshape(-1, len(self.scales))
+        entries = list(self.entries.values())
+        np.savez(path, resolution=self.resolution, keys=keys,
+                 x=np.array([e[0] for e in entries]).reshape(-1, 5),
+                 A=np.array([e[1] for e in entries]).reshape(-1, 5, 5),
+                 B=np.array([e[2] for e in entries]).reshape(-1, 5, 2))
+
+    def load(self, path):
+        """
+        Add the entries of an .npz file written by save() (with the same resolution).
+        """
+        with np.load(path) as data:
+            if float(data['resolution']) != self.resolution:
+                raise ValueError(f"{path} was saved with resolution {float(data['resolution'])}, "
+                                 f"not {self.resolution}")
+            for key, x_ss, A, B in zip(data['keys'], data['x'], data['A'], data['B']):
+                entry = (x_ss, A, B)
+                for array in entry:
+                    array.setflags(write=False)
+                self._insert(tuple(key.tolist()), entry)
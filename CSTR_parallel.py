@@ -0,0 +1,365 @@
+###########################
+# import
+###########################
+
+import multiprocessing as mp
+import os
+import warnings
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+from gymnasium.vector import AutoresetMode, VectorEnv
+from gymnasium.vector.utils import batch_space
+
+from scipy.integrate import ODEintWarning
+
+from CSTR_model_plus import CSTRRLEnv, DISTURBANCE_NAMES, INTEGRATION_ERRORS
+
+
+
+##############################################
+# 1. Shared-memory buffers
+##############################################
+
+# Per-environment arrays shared between the main process and the workers: (name, item shape, dtype)
+SHARED_FIELDS = (
+    ('actions', (6,), np.float64),
+    ('obs', (8,), np.float64),
+    ('rewards', (), np.float64),
+    ('terminations', (), np.bool_),
+    ('truncations', (), np.bool_),
+    ('true_state', (5,), np.float64),
+    ('disturbance', (), np.int64),  # index into DISTURBANCE_NAMES, -1 for none
+    ('failed', (), np.bool_),       # the integrator failed and the environment was reset
+    ('seeds', (), np.int64),
+    ('has_seed', (), np.bool_),
+    ('reset_mask', (), np.bool_),
+)
+
+# Single-byte commands sent through the worker pipes (no pickling)
+STEP, RESET, CLOSE, DONE = b's', b'r', b'c', b'k'
+
+
+def _shared_size(num_envs):
+    """
+    Number of bytes needed for all shared arrays, each aligned to 8 bytes.
+    """
+    size = 0
+    for _, shape, dtype in SHARED_FIELDS:
+        nbytes = num_envs * int(np.prod(shape)) * np.dtype(dtype).itemsize
+        size += -(-nbytes // 8) * 8
+    return size
+
+
+def _shared_views(buffer, num_envs):
+    """
+    Map the shared arrays onto a shared memory buffer, returned as a dict of (num_envs, ...) arrays.
+    """
+    views = {}
+    offset = 0
+    for name, shape, dtype in SHARED_FIELDS:
+        array = np.ndarray((num_envs,) + shape, dtype=dtype, buffer=buffer, offset=offset)
+        views[name] = array
+        offset += -(-array.nbytes // 8) * 8
+    return views
+
+
+
+##############################################
+# 2. Worker process
+##############################################
+
+def _worker(conn, shm_name, num_envs, start, stop, env_kwargs, seed, cpu):
+    """
+    Step the environments [start, stop) on command, reading actions from and writing
+    results into shared memory. Replies DONE after every command.
+    """
+    if cpu is not None and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, {cpu})
+
+    # odeint warnings are integrator failures here (caught as INTEGRATION_ERRORS below);
+    # the worker process is ours, so the filter is installed once for its whole life
+    warnings.simplefilter('error', ODEintWarning)
+
+    shm = SharedMemory(name=shm_name)
+    buffers = _shared_views(shm.buf, num_envs)
+    envs = [CSTRRLEnv(**env_kwargs) for _ in range(start, stop)]
+    autoreset = np.zeros(stop - start, dtype=bool)
+
+    def reset_env(i, env_seed=None):
+        obs, _ = envs[i - start].reset(seed=env_seed)
+        buffers['obs'][i] = obs
+        buffers['true_state'][i] = envs[i - start].true_state
+        autoreset[i - start] = False
+
+    try:
+        # Environments of a (re)started worker begin with a fresh episode
+        for i in range(start, stop):
+            reset_env(i, None if seed is None else seed + i)
+        conn.send_bytes(DONE)
+
+        while True:
+            command = conn.recv_bytes()
+
+            if command == STEP:
+                for i in range(start, stop):
+                    env = envs[i - start]
+                    buffers['rewards'][i] = 0.0
+                    buffers['terminations'][i] = False
+                    buffers['truncations'][i] = False
+                    buffers['disturbance'][i] = -1
+                    buffers['failed'][i] = False
+
+                    if autoreset[i - start]:
+                        reset_env(i)
+                        continue
+
+                    try:
+                        obs, reward, terminated, truncated, info = env.step(buffers['actions'][i])
+                        if not np.all(np.isfinite(env.true_state)):
+                            raise FloatingPointError("non-finite reactor state")
+                    except INTEGRATION_ERRORS:
+                        # Integrator failure: report it, truncate the episode and start over;
+                        # any other exception is a bug and ends the worker
+                        reset_env(i)
+                        buffers['truncations'][i] = True
+                        buffers['failed'][i] = True
+                        continue
+
+                    buffers['obs'][i] = obs
+                    buffers['rewards'][i] = reward
+                    buffers['terminations'][i] = terminated
+                    buffers['truncations'][i] = truncated
+                    buffers['true_state'][i] = env.true_state
+                    if info['disturbance'] is not None:
+                        buffers['disturbance'][i] = DISTURBANCE_NAMES.index(info['disturbance'])
+                    autoreset[i - start] = terminated or truncated
+
+            elif command == RESET:
+                for i in range(start, stop):
+                    if buffers['reset_mask'][i]:
+                        reset_env(i, int(buffers['seeds'][i]) if buffers['has_seed'][i] else None)
+
+            elif command == CLOSE:
+                break
+
+            conn.send_bytes(DONE)
+    finally:
+        for env in envs:
+            env.close()
+        del buffers
+        shm.close()
+        conn.close()
+
+
+
+##############################################
+# 3. Shared-memory multiprocess vector environment
+##############################################
+
+class SharedMemoryVectorCSTREnv(VectorEnv):
+    """
+    An asynchronous vector environment that steps CSTRRLEnv instances in worker processes.
+
+    Each worker owns a fixed, contiguous block of environments. Actions, observations,
+    rewards, flags and infos live in shared-memory NumPy arrays, and the workers are
+    driven by single-byte commands, so nothing is pickled per step. Since the
+    integration in CSTRRLEnv.step holds the GIL, processes (rather than threads) are
+    what lets rollouts use all cores.
+
+    If the integrator of an environment fails (one of INTEGRATION_ERRORS, an odeint
+    warning or a non-finite state), that environment is reset and reported as truncated
+    with infos['failed'] set; other exceptions end the worker. If a worker
+    process dies, it is restarted and its environments start new episodes.
+
+    Episodes are reset automatically on the step after they end (gymnasium NEXT_STEP mode).
+    """
+    metadata = {"autoreset_mode": AutoresetMode.NEXT_STEP}
+
+    def __init__(self, num_envs, num_workers=None, env_kwargs=None, seed=None,
+                 pin_workers=False, context=None, timeout=None):
+        super(SharedMemoryVectorCSTREnv, self).__init__()
+
+        self.num_envs = num_envs
+        self.num_workers = min(num_envs, num_workers or os.cpu_count() or 1)
+        self.env_kwargs = dict(env_kwargs or {})
+        self.env_kwargs.setdefault('record_history', False)
+        self.pin_workers = pin_workers
+        self.timeout = timeout
+        self._seed = seed
+        self._ctx = mp.get_context(context)
+
+        # Spaces of a single reactor (from a throwaway instance) and of the whole batch
+        env = CSTRRLEnv(**dict(self.env_kwargs, record_history=False))
+        self.single_action_space = env.action_space
+        self.single_observation_space = env.observation_space
+        self.action_space = batch_space(self.single_action_space, num_envs)
+        self.observation_space = batch_space(self.single_observation_space, num_envs)
+        env.close()
+
+        # Shared buffers for the whole batch
+        self._shm = SharedMemory(create=True, size=_shared_size(num_envs))
+        self._buffers = _shared_views(self._shm.buf, num_envs)
+
+        # Contiguous block of environments pinned to each worker
+        bounds = np.linspace(0, num_envs, self.num_workers + 1).astype(int)
+        self._slices = list(zip(bounds[:-1], bounds[1:]))
+        self._workers = [None] * self.num_workers
+        self._conns = [None] * self.num_workers
+        self.restarts = np.zeros(self.num_workers, dtype=np.int64)
+        for w in range(self.num_workers):
+            self._start_worker(w, seed)
+        self._wait(range(self.num_workers))
+
+        self._waiting = False
+
+    def _start_worker(self, w, seed):
+        start, stop = self._slices[w]
+        parent_conn, child_conn = self._ctx.Pipe()
+        cpu = None
+        if self.pin_workers and hasattr(os, 'sched_getaffinity'):
+            cpus = sorted(os.sched_getaffinity(0))
+            cpu = cpus[w % len(cpus)]
+        process = self._ctx.Process(
+            target=_worker, name=f"CSTRWorker-{w}", daemon=True,
+            args=(child_conn, self._shm.name, self.num_envs, start, stop,
+                  self.env_kwargs, seed, cpu))
+        process.start()
+        child_conn.close()
+        self._workers[w] = process
+        self._conns[w] = parent_conn
+
+    def _restart_worker(self, w):
+        """
+        Replace a dead worker; its environments start new episodes and are reported as failed.
+        """
+        process = self._workers[w]
+        if process.is_alive():
+            process.terminate()
+        process.join()
+        self._conns[w].close()
+        self.restarts[w] += 1
+
+        # Keep restarts reproducible but on fresh random streams
+        seed = None if self._seed is None else self._seed + int(self.restarts[w]) * self.num_envs
+        self._start_worker(w, seed)
+        self._wait([w], restart=False)
+
+        start, stop = self._slices[w]
+        self._buffers['rewards'][start:stop] = 0.0
+        self._buffers['terminations'][start:stop] = False
+        self._buffers['truncations'][start:stop] = True
+        self._buffers['disturbance'][start:stop] = -1
+        self._buffers['failed'][start:stop] = True
+
+    def _send(self, command):
+        for w in range(self.num_workers):
+            try:
+                self._conns[w].send_bytes(command)
+            except (BrokenPipeError, OSError):
+                pass # detected and handled by _wait
+
+    def _wait(self, workers, restart=True):
+        """
+        Wait for the DONE reply of each worker, restarting workers that died.
+        """
+        for w in workers:
+            conn, process = self._conns[w], self._workers[w]
+            waited = 0.0
+            while True:
+                try:
+                    if conn.poll(0.1):
+                        conn.recv_bytes()
+                        break
+                except (EOFError, OSError):
+                    pass # pipe closed: the worker died
+                else:
+                    waited += 0.1
+                    if process.is_alive() and (self.timeout is None or waited < self.timeout):
+                        continue
+                # The worker died or timed out
+                if not restart:
+                    raise RuntimeError(f"CSTR worker {w} failed to start")
+                self._restart_worker(w)
+                break
+
+    # -----------------------------------------
+    # Define reset function
+    # -----------------------------------------
+    def reset(self, seed=None, options=None):
+        """
+        Reset all environments (or those selected by options['reset_mask']).
+        An int seed seeds environment i with seed + i.
+        """
+        if seed is not None:
+            self._seed = seed
+        mask = np.ones(self.num_envs, dtype=bool)
+        if options is not None and 'reset_mask' in options:
+            mask = np.asarray(options['reset_mask'], dtype=bool)
+
+        self._buffers['reset_mask'][:] = mask
+        self._buffers['has_seed'][:] = seed is not None
+        if seed is not None:
+            self._buffers['seeds'][:] = seed + np.arange(self.num_envs)
+
+        self._send(RESET)
+        self._wait(range(self.num_workers))
+
+        return self._buffers['obs'].copy(), {}
+
+    # -----------------------------------------
+    # Define step functions
+    # -----------------------------------------
+    def step_async(self, actions):
+        """
+        Write the actions (shape (N, 6)) into shared memory and start all workers.
+        """
+        if self._waiting:
+            raise RuntimeError("step_async called again before step_wait")
+        self._buffers['actions'][:] = np.asarray(actions, dtype=np.float64).reshape(self.num_envs, 6)
+        self._send(STEP)
+        self._waiting = True
+
+    def step_wait(self):
+        """
+        Wait for all workers and return (obs, rewards, terminations, truncations, infos).
+        """
+        self._wait(range(self.num_workers))
+        self._waiting = False
+
+        buffers = self._buffers
+        disturbance = buffers['disturbance'].copy()
+        infos = {
+            "true_state": buffers['true_state'].copy(),
+            "_true_state": np.ones(self.num_envs, dtype=bool),
+            "disturbance": disturbance, "_disturbance": disturbance >= 0,
+            "failed": buffers['failed'].copy(), "_failed": buffers['failed'].copy(),
+        }
+        return (buffers['obs'].copy(), buffers['rewards'].copy(), buffers['terminations'].copy(),
+                buffers['truncations'].copy(), infos)
+
+    def step(self, actions):
+        """
+        Step every environment with its own action (shape (N, 6)).
+        """
+        self.step_async(actions)
+        return self.step_wait()
+
+    # -----------------------------------------
+    # Define close function
+    # -----------------------------------------
+    def close_extras(self, **kwargs):
+        """
+        Stop the workers and release the shared memory.
+        """
+        if self._waiting:
+            self._wait(range(self.num_workers))
+        self._send(CLOSE)
+        for process, conn in zip(self._workers, self._conns):
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+            conn.close()
+        self._buffers = None
+        self._shm.close()
+        self._shm.unlink()
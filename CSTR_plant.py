@@ -0,0 +1,461 @@
+###########################
+# import
+###########################
+
+import gymnasium as gym
+from gymnasium import spaces
+import numpy as np
+from scipy import sparse
+from scipy.integrate import odeint
+
+from CSTR_model_plus import (COOLING_UPSET_STEPS, CSTRRLEnv, OdeintIntegrator, PID_velocity_batch,
+                             RK4Integrator, RingBuffer, _cstr_jacobian, _flatten_batch, _spawn_rngs,
+                             batch_cstr_dynamics, disturbance_steps)
+
+
+
+##############################################
+# 1. Plant topology
+##############################################
+
+class PlantTopology:
+    """
+    How the M reactor units of a plant are linked by their streams.
+
+    upstream[m] is the unit whose outflow feeds unit m, or -1 if unit m takes fresh feed
+    (concentration Caf and temperature Tf of its own process parameters). A unit fed by
+    another one receives that unit's composition [Ca, Cb, Cc] and temperature; the feed
+    flow rate stays the unit's own manipulated input Fin (the difference to the upstream
+    outflow is balanced by a bypass or make-up stream), so every unit keeps its PID loops.
+    """
+    def __init__(self, upstream):
+        self.upstream = np.asarray(upstream, dtype=np.int64)
+        M = self.upstream.size
+        if np.any((self.upstream < -1) | (self.upstream >= M)) or np.any(self.upstream == np.arange(M)):
+            raise ValueError("upstream[m] must be -1 or the index of another unit")
+        self.fed = np.flatnonzero(self.upstream >= 0)  # units fed by another unit
+        self.sources = self.upstream[self.fed]          # and the units feeding them
+
+        # Bandwidths of the Jacobian of the flattened (5 M) state: the coupling from unit
+        # j to unit m lies 5 * (m - j) entries off the diagonal
+        offset = self.fed - self.sources
+        self.ml = 4 + 5 * max(0, offset.max(initial=0))
+        self.mu = 4 + 5 * max(0, -offset.min(initial=0))
+
+    @property
+    def num_units(self):
+        return self.upstream.size
+
+    @classmethod
+    def series(cls, M):
+        """
+        A train of M units, unit m fed by unit m - 1 (unit 0 takes fresh feed).
+        """
+        return cls(np.arange(M) - 1)
+
+    @classmethod
+    def parallel(cls, M):
+        """
+        M independent units, all on fresh feed.
+        """
+        return cls(np.full(M, -1))
+
+    @classmethod
+    def trains(cls, n_trains, length):
+        """
+        n_trains parallel trains of `length` units in series (units numbered train by train).
+        """
+        upstream = np.arange(n_trains * length) - 1
+        upstream[::length] = -1
+        return cls(upstream)
+
+    def inlet(self, x, params):
+        """
+        Feed composition and temperature [Ca_in, Cb_in, Cc_in, T_in] of every unit, shape (M, 4).
+        """
+        inlet = np.zeros((x.shape[0], 4))
+        inlet[:, 0] = params['Caf']
+        inlet[:, 3] = params['Tf']
+        inlet[self.fed] = x[self.sources, :4]
+        return inlet
+
+
+
+##############################################
+# 2. Coupled plant dynamics
+##############################################
+
+def plant_dynamics(x, t, u, params, topology):
+    """
+    Right-hand side of the coupled plant.
+
+    Inputs:
+      x: array of shape (M, 5) with the states [Ca, Cb, Cc, T, V] of the units
+      u: array of shape (M, 2) with the control inputs [Tc, Fin] of the units
+      params: dict of (M,) arrays with the process parameters of the units
+      topology: PlantTopology
+
+    Every unit follows batch_cstr_dynamics with its inlet stream in place of the fresh
+    feed; products B and C carried in from upstream add to their balances.
+    Returns an array of shape (M, 5).
+    """
+    inlet = topology.inlet(x, params)
+    dxdt = batch_cstr_dynamics(x, t, u, dict(params, Caf=inlet[:, 0], Tf=inlet[:, 3]))
+
+    # Products B and C in the inlet stream (zero for fresh feed)
+    Fin_V = u[:, 1] / x[:, 4]
+    dxdt[:, 1] += Fin_V * inlet[:, 1]
+    dxdt[:, 2] += Fin_V * inlet[:, 2]
+    return dxdt
+
+
+def _plant_jacobian_blocks(x, u, params, topology):
+    """
+    Own (M, 5, 5) Jacobian blocks of the units and the derivative Fin / V of the first
+    four balances of every fed unit with respect to the same states of its upstream unit.
+    """
+    inlet = topology.inlet(x, params)
+    J = _cstr_jacobian(x, u, inlet[:, 3], inlet[:, 0], params['UA'], params['k0_AB'], params['k0_BC'])
+    Fin, V = u[:, 1], x[:, 4]
+    J[:, 1, 4] -= Fin * inlet[:, 1] / V**2
+    J[:, 2, 4] -= Fin * inlet[:, 2] / V**2
+    return J, (Fin / V)[topology.fed]
+
+
+class PlantJacobian:
+    """
+    Analytic Jacobian of plant_dynamics for one topology, with the index arrays of its
+    non-zeros precomputed: banded(...) in the layout odeint expects for (ml, mu) =
+    (topology.ml, topology.mu), and csr(...) as a scipy.sparse matrix. The Jacobian has
+    25 M + 4 (number of fed units) non-zeros at most, so both cost O(M).
+    """
+    def __init__(self, topology):
+        self.topology = topology
+        M, mu = topology.num_units, topology.mu
+
+        # Own blocks: J[5 m + a, 5 m + b]
+        a, b = np.indices((5, 5))
+        own_rows = (5 * np.arange(M)[:, None, None] + a).ravel()
+        own_cols = (5 * np.arange(M)[:, None, None] + b).ravel()
+
+        # Coupling: J[5 m + k, 5 upstream[m] + k] for the compositions and temperature
+        k = np.arange(4)
+        coupling_rows = (5 * topology.fed[:, None] + k).ravel()
+        coupling_cols = (5 * topology.sources[:, None] + k).ravel()
+
+        self.rows = np.concatenate([own_rows, coupling_rows])
+        self.cols = np.concatenate([own_cols, coupling_cols])
+        self.band_rows = self.rows - self.cols + mu
+        self.shape = (5 * M, 5 * M)
+        self.band_shape = (topology.ml + mu + 1, 5 * M)
+
+    def _values(self, x, u, params):
+        J, coupling = _plant_jacobian_blocks(x, u, params, self.topology)
+        return np.concatenate([J.ravel(), np.repeat(coupling, 4)])
+
+    def banded(self, y, t, u, params):
+        """
+        Banded Jacobian of the flattened plant state y (odeint Dfun).
+        """
+        x = y.reshape(-1, 5)
+        band = np.zeros(self.band_shape)
+        band[self.band_rows, self.cols] = self._values(x, u, params)
+        return band
+
+    def csr(self, x, t, u, params):
+        """
+        Jacobian of the flattened plant state as a scipy.sparse CSR matrix.
+        """
+        return sparse.csr_matrix((self._values(x, u, params), (self.rows, self.cols)), shape=self.shape)
+
+
+class BandedOdeintIntegrator(OdeintIntegrator):
+    """
+    odeint (LSODA) on the flattened state of a coupled (M, 5) system with a banded
+    Jacobian (lower and upper bandwidths ml, mu), so that every LU factorization and
+    solve costs O(M) instead of O(M^3). jac must return the banded Jacobian.
+    """
+    name = 'odeint_banded'
+
+    def __init__(self, ml, mu, rtol=None, atol=None):
+        self.ml = ml
+        self.mu = mu
+        super(BandedOdeintIntegrator, self).__init__(rtol, atol)
+
+    def integrate(self, fun, x, dt, args=(), jac=None, params=None):
+        y, info = odeint(_flatten_batch(fun, x.shape), x.ravel(), [0, dt], args=args, Dfun=jac,
+                         full_output=True, rtol=self.rtol, atol=self.atol, ml=self.ml, mu=self.mu)
+        self._count_odeint(info)
+        return y[1].reshape(x.shape)
+
+
+
+##############################################
+# 3. Centralized plant environment
+##############################################
+
+class CSTRPlantEnv(gym.Env):
+    """
+    A Gym environment for a plant of M CSTR units linked in series, in parallel or by
+    any PlantTopology, every unit with its own uncertain process parameters, velocity
+    PID loops, delay lines, measurement noise and disturbances (as in CSTRRLEnv).
+
+    The plant is one coupled ODE of 5 M states, integrated with a banded analytic
+    Jacobian ('odeint') or with RK4 ('rk4'), so the cost of a step grows linearly in M.
+
+    Observation:
+      Array of shape (M, 8): the CSTRRLEnv observation of every unit (measured [Cb, T, V],
+      previous true [Cb, T, V], setpoints)
+    Action:
+      Array of shape (M, 6): normalized PID gains of every unit, as in CSTRRLEnv
+    Reward:
+      Sum over the units of the negative squared setpoint errors of the true state;
+      info['unit_rewards'] holds the per-unit rewards, so the environment can also be
+      used with one agent per unit (single_observation_space, single_action_space).
+    """
+    metadata = {"render_modes": []}
+
+    # Nominal values of the uncertain process parameters
+    nominal_params = CSTRRLEnv.nominal_params
+
+    def __init__(self, num_units=4, topology='series', simulation_steps=100, dt=1.0,
+                 uncertainty_level=0.1,
+                 noise_level=0.02,
+                 actuator_delay_steps=1,
+                 transport_delay_steps=2,
+                 enable_disturbances=True,
+                 disturbance_spacing='doubling',
+                 integrator='odeint',
+                 integrator_options=None,
+                 seed=None):
+        super(CSTRPlantEnv, self).__init__()
+
+        # Per-instance random streams (parameters, noise, disturbances), as in CSTRRLEnv
+        self.seed(seed)
+
+        # Plant layout: 'series', 'parallel' or a PlantTopology
+        if topology == 'series':
+            topology = PlantTopology.series(num_units)
+        elif topology == 'parallel':
+            topology = PlantTopology.parallel(num_units)
+        elif not isinstance(topology, PlantTopology):
+            raise ValueError(f"Unknown topology {topology!r}, expected 'series', 'parallel' or a PlantTopology")
+        self.topology = topology
+        self.num_units = M = topology.num_units
+        self.jacobian = PlantJacobian(topology)
+
+        # simulate parameters
+        self.sim_steps = simulation_steps
+        self.dt = dt
+
+        # Integrator backend for the coupled plant
+        if integrator == 'odeint':
+            self.integrator = BandedOdeintIntegrator(topology.ml, topology.mu, **(integrator_options or {}))
+        elif integrator == 'rk4':
+            self.integrator = RK4Integrator(**(integrator_options or {}))
+        else:
+            raise ValueError(f"Unknown integrator '{integrator}', expected 'odeint' or 'rk4'")
+
+        # Uncertainty and noise parameters
+        self.uncertainty_level = uncertainty_level
+        self.noise_level = noise_level
+
+        # Delay Parameters
+        self.actuator_delay_steps = actuator_delay_steps
+        self.transport_delay_steps = transport_delay_steps
+
+        # Disturbance Parameters (the same event steps for every unit, with its own draws)
+        self.enable_disturbances = enable_disturbances
+        self.disturbance_interval = 20
+        self.disturbance_steps = disturbance_steps(simulation_steps, self.disturbance_interval,
+                                                   disturbance_spacing)
+
+        # Spaces of a single unit (identical to CSTRRLEnv) and of the whole plant
+        self.single_action_space = spaces.Box(low=-1, high=1, shape=(6,), dtype=np.float64)
+        self.single_observation_space = spaces.Box(
+            low=np.array([0.0, 300.0, 80.0, 0.0, 300.0, 80.0, 0.0, 80.0]),
+            high=np.array([1.0, 400.0, 120.0, 1.0, 400.0, 120.0, 1.0, 120.0]),
+            dtype=np.float64
+        )
+        self.action_space = spaces.Box(low=-1, high=1, shape=(M, 6), dtype=np.float64)
+        self.observation_space = spaces.Box(
+            low=np.tile(self.single_observation_space.low, (M, 1)),
+            high=np.tile(self.single_observation_space.high, (M, 1)),
+            dtype=np.float64
+        )
+
+        # PID gain scaling, setpoints and initial conditions (per unit, as in CSTRRLEnv)
+        self.pid_lower = np.array([-5, 0, 0.02, 0, 0, 0.01])
+        self.pid_upper = np.array([25, 20, 10, 1, 2, 1])
+        self.setpoint_Cb = np.full(M, 0.70)
+        self.setpoint_V = np.full(M, 100.0)
+        self.x0 = np.array([0.8, 0.0, 0.0, 325.0, 100.0])
+        self.default_u = np.array([300.0, 100.0])
+
+        # Plant state and process parameters, (M, ...) arrays
+        self.true_state = np.tile(self.x0, (M, 1))
+        self.state = self.true_state.copy()
+        self.process_params = {key: np.full(M, value) for key, value in self.nominal_params.items()}
+        self.current_step = 0
+
+        # PID histories (M, 2, 2), most recent last
+        self.e_history = np.zeros((M, 2, 2))
+        self.u_history = np.tile(self.default_u, (M, 2, 1))
+
+        # Delay lines: all units step together, so one ring buffer of (M, ...) items each
+        self.measurement_buffer = RingBuffer(max(1, transport_delay_steps), (M, 5))
+        self.control_buffer = RingBuffer(max(1, actuator_delay_steps), (M, 2))
+
+        # Disturbance draws of the episode (n_events, M) and pending cooling fixes (-1: none)
+        self._disturbance_types = None
+        self._disturbance_draws = None
+        self._disturbance_event = 0
+        self.next_cooling_fix = np.full(M, -1, dtype=np.int64)
+
+    def seed(self, seed=None):
+        """
+        Create the per-instance random number generators (see CSTRRLEnv.seed).
+        """
+        self.seed_sequence, self.params_rng, self.noise_rng, self.disturbance_rng = _spawn_rngs(seed)
+
+    # -----------------------------------------
+    # Define reset function
+    # -----------------------------------------
+    def reset(self, seed=None, options=None):
+        """
+        Reset every unit to the initial state with new process parameters and disturbances.
+        """
+        if seed is not None:
+            self.seed(seed)
+        M = self.num_units
+
+        self.true_state[:] = self.x0
+        self.current_step = 0
+
+        # Uncertain parameters and disturbance events of all units, in whole-array draws
+        draws = self.params_rng.random((len(self.nominal_params), M))
+        for draw, (key, nominal) in zip(draws, self.nominal_params.items()):
+            self.process_params[key] = nominal * (1 + self.uncertainty_level * (draw - 0.5))
+        n_events = self.disturbance_steps.size
+        self._disturbance_types = self.disturbance_rng.integers(0, 3, size=(n_events, M))
+        self._disturbance_draws = self.disturbance_rng.random((n_events, M))
+        self._disturbance_event = 0
+        self.next_cooling_fix[:] = -1
+
+        # PID histories and delay lines
+        self.u_history[:] = self.default_u
+        self.control_buffer.fill(self.default_u)
+        measured_state = self.apply_measurement_noise(self.true_state)
+        self.measurement_buffer.fill(measured_state)
+        self.state = measured_state
+        self.e_history[:] = self._errors(measured_state)[:, None, :]
+
+        return self._observations(measured_state, measured_state), {}
+
+    # -----------------------------------------
+    # Noise and disturbances
+    # -----------------------------------------
+    def apply_measurement_noise(self, states):
+        """
+        Add relative noise to the (M, 5) state measurements.
+        """
+        noise = states * self.noise_level * self.noise_rng.standard_normal(states.shape)
+        # Ensure no negative concentrations or volumes
+        return np.maximum(0, states + noise)
+
+    def _scheduled_disturbances(self, step):
+        """
+        Apply the disturbance events due at `step` (one event per unit, drawn at reset)
+        and the cooling fixes that end at `step`. Returns the disturbance codes (M,),
+        -1 for none. Feed disturbances (Tf, Caf) only act on, and are only reported for,
+        units that take fresh feed.
+        """
+        disturbance = np.full(self.num_units, -1, dtype=np.int64)
+        if not self.enable_disturbances:
+            return disturbance
+        event = self._disturbance_event
+        if event < self.disturbance_steps.size and step >= self.disturbance_steps[event]:
+            disturbance = self._disturbance_types[event].copy()
+            # Units fed from upstream take no fresh feed, so feed upsets do not reach them
+            disturbance[(disturbance < 2) & (self.topology.upstream >= 0)] = -1
+            magnitude = 1 + 0.1 * (self._disturbance_draws[event] - 0.5)
+            self.process_params['Tf'][disturbance == 0] *= magnitude[disturbance == 0]
+            self.process_params['Caf'][disturbance == 1] *= magnitude[disturbance == 1]
+            self.process_params['UA'][disturbance == 2] *= 0.8
+            self.next_cooling_fix[disturbance == 2] = step + COOLING_UPSET_STEPS
+            self._disturbance_event += 1
+
+        # Fix cooling systems whose upset is over
+        fixed = self.next_cooling_fix == step
+        self.process_params['UA'][fixed] /= 0.8
+        self.next_cooling_fix[fixed] = -1
+        return disturbance
+
+    # -----------------------------------------
+    # Define step function
+    # -----------------------------------------
+    def step(self, action):
+        """
+        Advance the whole plant by one control interval with the (M, 6) normalized gains.
+        """
+        action = np.asarray(action, dtype=np.float64).reshape(self.num_units, 6)
+        pid_gains = ((action + 1) / 2) * (self.pid_upper - self.pid_lower) + self.pid_lower
+
+        # Velocity PID of every unit on its delayed, noisy measurement
+        measured_state = self.measurement_buffer[0]
+        current_error = self._errors(measured_state)
+        if self.current_step < 2:
+            control_action = self.u_history[:, -1].copy()
+        else:
+            control_action = PID_velocity_batch(pid_gains, current_error, self.e_history, self.u_history, self.dt)
+
+        # Actuator delay line and PID histories
+        delayed_control = self.control_buffer.push(control_action)
+        self.u_history[:, 0] = self.u_history[:, 1]
+        self.u_history[:, 1] = control_action
+        self.e_history[:, 0] = self.e_history[:, 1]
+        self.e_history[:, 1] = current_error
+
+        disturbance = self._scheduled_disturbances(self.current_step)
+
+        # Integrate the coupled plant
+        prev_state = self.true_state
+        params = self.process_params
+        self.true_state = self.integrator.integrate(plant_dynamics, prev_state, self.dt,
+                                                    args=(delayed_control, params, self.topology),
+                                                    jac=self._banded_jacobian, params=params)
+
+        # Measurement noise and transport delay line
+        self.state = self.measurement_buffer.push(self.apply_measurement_noise(self.true_state))
+        self.current_step += 1
+
+        unit_rewards = -np.sum(self._errors(self.true_state) ** 2, axis=1)
+        obs = self._observations(self.state, prev_state)
+        done = self.current_step >= self.sim_steps
+
+        info = {
+            "unit_rewards": unit_rewards,
+            "pid_gains": pid_gains,
+            "control_action": control_action,
+            "true_state": self.true_state,
+            "disturbance": disturbance,
+            "nfev": self.integrator.last_nfev,
+        }
+        return obs, float(unit_rewards.sum()), done, False, info
+
+    def _banded_jacobian(self, y, t, u, params, topology):
+        return self.jacobian.banded(y, t, u, params)
+
+    def _errors(self, states):
+        """
+        Setpoint errors [e_Cb, e_V] of every unit.
+        """
+        return np.stack([self.setpoint_Cb - states[:, 1],
+                         self.setpoint_V - states[:, 4]], axis=1)
+
+    def _observations(self, measured_state, prev_state):
+        """
+        (M, 8) observations: measured [Cb, T, V], previous true [Cb, T, V] and setpoints.
+        """
+        return np.concatenate([measured_state[:, [1, 3, 4]], prev_state[:, [1, 3, 4]],
+                               self.setpoint_Cb[:, None], self.setpoint_V[:, None]], axis=1)
@@ -0,0 +1,157 @@
+###########################
+# import
+###########################
+
+import json
+import os
+
+import numpy as np
+
+from CSTR_model_plus import CSTRRLEnv
+
+
+
+##############################################
+# 1. Scenario layout
+##############################################
+
+# Order of the process parameters in a scenario
+PARAM_NAMES = tuple(CSTRRLEnv.nominal_params)
+
+
+def scenario_dtype(n_events):
+    """
+    Structured dtype of one scenario with room for `n_events` disturbance events:
+    the process parameters, the disturbance types (indices into DISTURBANCE_NAMES) and
+    uniform magnitude draws in the order CSTRRLEnv applies them, and the seed of the
+    measurement noise stream.
+    """
+    return np.dtype([(name, np.float64) for name in PARAM_NAMES] + [
+        ('disturbance_type', np.int8, (n_events,)),
+        ('disturbance_draw', np.float64, (n_events,)),
+        ('noise_seed', np.uint64),
+    ])
+
+
+
+##############################################
+# 2. Scenario bank
+##############################################
+
+class ScenarioBank:
+    """
+    A fixed set of pre-sampled episodes for domain randomization and evaluation.
+
+    Every scenario fixes everything random about an episode: the uncertain process
+    parameters, the disturbance schedule and the measurement noise. Environments replay
+    scenario i with reset(options={'scenario_id': i}), so evaluation sets are
+    deterministic and shared between runs and processes. The bank is one structured
+    array (scenario_dtype) saved as .npy next to a small .json with its settings, and
+    loaded as a read-only memory map. params(ids) gathers the parameters of many
+    scenarios into contiguous arrays for the batched simulators.
+    """
+    def __init__(self, data, meta):
+        self.data = data
+        self.meta = meta
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    def __getitem__(self, scenario_id):
+        return self.data[scenario_id]
+
+    @property
+    def n_events(self):
+        return self.data.dtype['disturbance_type'].shape[0]
+
+    # -----------------------------------------
+    # Generation and persistence
+    # -----------------------------------------
+    @classmethod
+    def generate(cls, n_scenarios, seed=0, simulation_steps=100, uncertainty_level=0.1,
+                 disturbance_interval=20, disturbance_spacing='doubling'):
+        """
+        Sample n_scenarios scenarios with the distributions of CSTRRLEnv (parameters
+        uniform within +-uncertainty_level/2 of nominal, one disturbance event per
+        disturbance_interval steps of a simulation_steps episode), in whole-array draws.
+        The scenarios are meant for environments with the same settings (check_env).
+        """
+        rng = np.random.default_rng(seed)
+        n_events = simulation_steps // disturbance_interval + 1
+        data = np.zeros(n_scenarios, dtype=scenario_dtype(n_events))
+
+        draws = rng.random((len(PARAM_NAMES), n_scenarios))
+        for draw, (name, nominal) in zip(draws, CSTRRLEnv.nominal_params.items()):
+            data[name] = nominal * (1 + uncertainty_level * (draw - 0.5))
+        data['disturbance_type'] = rng.integers(0, 3, size=(n_scenarios, n_events))
+        data['disturbance_draw'] = rng.random((n_scenarios, n_events))
+        data['noise_seed'] = rng.integers(0, 2 ** 63, size=n_scenarios)
+
+        meta = {'seed': seed, 'simulation_steps': simulation_steps,
+                'uncertainty_level': uncertainty_level, 'disturbance_interval': disturbance_interval,
+                'disturbance_spacing': disturbance_spacing}
+        return cls(data, meta)
+
+    @staticmethod
+    def _meta_path(path):
+        return os.path.splitext(path)[0] + '.json'
+
+    def save(self, path):
+        """
+        Write the bank to `path` (.npy) and its settings to the .json next to it.
+        """
+        np.save(path, self.data)
+        with open(self._meta_path(path), 'w') as f:
+            json.dump(self.meta, f, indent=2)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Open a bank written by save(), memory-mapped read-only unless mmap=False.
+        """
+        data = np.load(path, mmap_mode='r' if mmap else None)
+        with open(cls._meta_path(path)) as f:
+            meta = json.load(f)
+        return cls(data, meta)
+
+    def check_env(self, env):
+        """
+        Raise a ValueError if the bank was generated for other environment settings
+        (episode length, uncertainty level, disturbance interval or spacing) than those
+        of `env` (a CSTRRLEnv or VectorCSTREnv). Settings missing from the meta data
+        are not checked.
+        """
+        settings = {'simulation_steps': env.sim_steps, 'uncertainty_level': env.uncertainty_level,
+                    'disturbance_interval': env.disturbance_interval,
+                    'disturbance_spacing': env.disturbance_spacing}
+        mismatched = [f"{name}={self.meta[name]!r} (env: {value!r})" for name, value in settings.items()
+                      if name in self.meta and self.meta[name] != value]
+        if mismatched:
+            raise ValueError("Scenario bank was generated for other environment settings: "
+                             + ", ".join(mismatched))
+
+    # -----------------------------------------
+    # Access
+    # -----------------------------------------
+    def process_params(self, scenario_id):
+        """
+        The process parameters of one scenario as a new dict (as CSTRRLEnv.process_params,
+        which disturbances modify in place).
+        """
+        scenario = self.data[scenario_id]
+        return {name: scenario[name] for name in PARAM_NAMES}
+
+    def params(self, scenario_ids):
+        """
+        The process parameters of many scenarios as a dict of contiguous (n,) arrays
+        (as VectorCSTREnv.process_params).
+        """
+        rows = self.data[np.asarray(scenario_ids)]
+        return {name: np.ascontiguousarray(rows[name]) for name in PARAM_NAMES}
+
+    def disturbance_schedule(self, scenario_id):
+        """
+        (types, magnitude draws) of the disturbance events of one scenario, in order.
+        """
+        scenario = self.data[scenario_id]
+        return np.array(scenario['disturbance_type'], dtype=np.int64), np.array(scenario['disturbance_draw'])
@@ -0,0 +1,201 @@
+###########################
+# import
+###########################
+
+import numpy as np
+from scipy.integrate import odeint
+
+from CSTR_model_plus import U_LOWER, U_UPPER, RingBuffer, _cstr_jacobian
+
+
+
+##############################################
+# 1. Parameter Jacobian of the CSTR model
+##############################################
+
+def cstr_param_jacobian(x, u, Tf, Caf, UA, k0_AB, k0_BC):
+    """
+    Jacobian of the CSTR right-hand side with respect to the process parameters
+    [Tf, Caf, UA, k0_AB, k0_BC], shape (5, 5).
+    """
+    Tc, Fin = u[0], u[1]
+    Ca, Cb, Cc, T, V = x
+
+    # Fixed parameters (as in custom_cstr_dynamics)
+    rho = 1000       # Density (kg/m^3)
+    Cp = 0.239       # Heat capacity (J/kg-K)
+    mdelH_AB = 5e3   # Heat of reaction A -> B (J/mol)
+    EoverR_AB = 8750 # Activation energy over gas constant A -> B (K)
+    mdelH_BC = 4e3   # Heat of reaction B -> C (J/mol)
+    EoverR_BC = 10750# Activation energy over gas constant B -> C (K)
+
+    # d(rA)/d(k0_AB) and d(rB)/d(k0_BC)
+    drA = np.exp(-EoverR_AB / T) * Ca
+    drB = np.exp(-EoverR_BC / T) * Cb
+
+    J = np.zeros((5, 5))
+    J[0, 1] = Fin / V
+    J[0, 3] = -drA
+    J[1, 3] = drA
+    J[1, 4] = -drB
+    J[2, 4] = drB
+    J[3, 0] = Fin / V
+    J[3, 2] = (Tc - T) / (V * rho * Cp)
+    J[3, 3] = (mdelH_AB / (rho * Cp)) * drA
+    J[3, 4] = (mdelH_BC / (rho * Cp)) * drB
+    return J
+
+
+
+##############################################
+# 2. Differentiable episode
+##############################################
+
+def _raw_pid(Ks, e, e_history, dt):
+    """
+    Unclamped PID_velocity increments [dTc, dFin].
+    """
+    Kp = Ks[0::3]
+    Ki = Ks[1::3] + 1e-8
+    Kd = Ks[2::3] + 1e-8
+    return (Kp * (e - e_history[-1])
+            + (Kp / Ki) * e * dt
+            - Kp * Kd * (e - 2 * e_history[-1] + e_history[-2]) / dt)
+
+
+def _pid_sensitivity(Ks, e, e_history, dt):
+    """
+    Partial derivatives of the unclamped PID_velocity increments [dTc, dFin] with respect
+    to the gains (2, 6) and to the current and two previous errors of the own loop (2, 3).
+    """
+    dK = np.zeros((2, 6))
+    de = np.zeros((2, 3))
+    for loop in range(2):
+        Kp, Ki, Kd = Ks[3 * loop], Ks[3 * loop + 1] + 1e-8, Ks[3 * loop + 2] + 1e-8
+        e0, e1, e2 = e[loop], e_history[-1, loop], e_history[-2, loop]
+        second_difference = (e0 - 2 * e1 + e2) / dt
+        dK[loop, 3 * loop] = (e0 - e1) + e0 * dt / Ki - Kd * second_difference
+        dK[loop, 3 * loop + 1] = -(Kp / Ki ** 2) * e0 * dt
+        dK[loop, 3 * loop + 2] = -Kp * second_difference
+        de[loop] = [Kp + Kp * dt / Ki - Kp * Kd / dt, -Kp + 2 * Kp * Kd / dt, -Kp * Kd / dt]
+    return dK, de
+
+
+def episode_gradient(env, actions, seed=None, wrt_params=False, rtol=1e-8, atol=1e-10):
+    """
+    Run one episode of `env` (a CSTRRLEnv with the PID controller) with fixed normalized
+    PID gains and return its cost and the gradient of the cost by forward sensitivities.
+
+    The cost is the sum of the squared setpoint errors of the true state, i.e. minus the
+    episode return of env.rollout(actions, seed). Alongside the state, every integration
+    interval carries its sensitivities dx/dtheta through the augmented variational
+    system dS/dt = J_x S + J_u du/dtheta (+ J_p dp/dtheta), and the sensitivities are
+    propagated through the PID_velocity update (zero where the clamp is active), the
+    delay lines, the PID histories and the measurement noise. Noise and disturbances
+    are the fixed draws of the seed, so one augmented episode replaces the 7 or more
+    perturbed episodes of a finite-difference gradient. The augmented system is always
+    integrated with odeint at (rtol, atol); the env's own integrator and its history
+    recorder are not used.
+
+    Inputs:
+      actions: normalized PID gains of shape (6,), as for step()
+      wrt_params: also return the gradient with respect to the process parameters drawn
+                  at reset (env.process_params, before any disturbance)
+
+    Returns (cost, grad, extra): grad has shape (6,) (with respect to the actions) and
+    extra is a dict with 'grad_gains' (with respect to the PID gains), 'grad_params'
+    (dict, if wrt_params) and 'rewards'.
+    """
+    if env.mpc is not None:
+        raise ValueError("episode_gradient needs the PID inner controller")
+
+    actions = np.asarray(actions, dtype=np.float64)
+    gain_scale = (env.pid_upper - env.pid_lower) / 2
+    Ks = (actions + 1) * gain_scale + env.pid_lower
+
+    env.reset(seed=seed)
+    names = list(env.process_params)
+    p0 = np.array([env.process_params[name] for name in names])
+    P = 6 + (len(names) if wrt_params else 0)
+
+    # Sensitivity buffers, parallel to the environment's delay lines and PID histories
+    S_x = np.zeros((5, P))
+    S_measurement = RingBuffer(env.measurement_buffer.capacity, (5, P))
+    S_control = RingBuffer(env.control_buffer.capacity, (2, P))
+    S_u = RingBuffer(env.u_history.capacity, (2, P))
+    S_e = RingBuffer(env.e_history.capacity, (2, P))
+    setpoints = np.array([env.setpoint_Cb, env.setpoint_V])
+
+    def augmented(y, t, u, S_u_applied, p, dp):
+        x, S = y[:5], y[5:].reshape(5, P)
+        f = env.custom_cstr_dynamics(x, t, u)
+        dS = _cstr_jacobian(x, u, *p) @ S + _cstr_jacobian(x, u, *p, wrt_inputs=True) @ S_u_applied
+        if wrt_params:
+            dS[:, 6:] += cstr_param_jacobian(x, u, *p) * dp
+        return np.concatenate([f, dS.ravel()])
+
+    cost = 0.0
+    grad = np.zeros(P)
+    rewards = np.empty(env.sim_steps)
+    for k in range(env.sim_steps):
+        # Measurement, error and its sensitivity
+        measured_state = env.measurement_buffer[0]
+        dm = S_measurement[0]
+        current_error = setpoints - measured_state[[1, 4]]
+        d_error = -dm[[1, 4]]
+
+        # Velocity PID and its sensitivity (zero where the clamp is active)
+        if env.current_step < 2:
+            control_action = env.u_history[-1].copy()
+            d_control = S_u[-1].copy()
+        else:
+            e_history = env.e_history.to_array()
+            unclamped = env.u_history[-1] + _raw_pid(Ks, current_error, e_history, env.dt)
+            control_action = np.clip(unclamped, U_LOWER, U_UPPER)
+            dK, de = _pid_sensitivity(Ks, current_error, e_history, env.dt)
+            d_control = S_u[-1].copy()
+            d_control[:, :6] += dK
+            for loop in range(2):
+                d_control[loop] += (de[loop, 0] * d_error[loop] + de[loop, 1] * S_e[-1][loop]
+                                    + de[loop, 2] * S_e[-2][loop])
+            d_control[(unclamped < U_LOWER) | (unclamped > U_UPPER)] = 0.0
+
+        # Delay line and histories
+        delayed_control = env.control_buffer.push(control_action)
+        d_delayed = S_control.push(d_control)
+        env.u_history.push(control_action)
+        S_u.push(d_control)
+        env.e_history.push(current_error)
+        S_e.push(d_error)
+
+        # Disturbances (the scheduled events of step())
+        env._scheduled_disturbances(env.current_step)
+
+        # Augmented integration of the state and its sensitivities; the current parameters
+        # are the drawn ones times the disturbance factors, so dp/dp0 = p / p0
+        p = np.array([env.process_params[name] for name in names])
+        y0 = np.concatenate([env.true_state, S_x.ravel()])
+        y = odeint(augmented, y0, [0, env.dt], args=(delayed_control, d_delayed, p, p / p0),
+                   rtol=rtol, atol=atol)[1]
+        env.true_state, S_x = y[:5].copy(), y[5:].reshape(5, P)
+
+        # Measurement noise (zero sensitivity where the measurement is clipped at 0)
+        x = env.true_state
+        z = env._next_noise()
+        noisy_state = x + x * env.noise_level * z
+        env.state = env.measurement_buffer.push(np.maximum(0, noisy_state))
+        S_measurement.push(np.where((noisy_state > 0)[:, None],
+                                    (1 + env.noise_level * z)[:, None] * S_x, 0.0))
+
+        # Cost and its gradient
+        error = setpoints - x[[1, 4]]
+        cost += np.sum(error ** 2)
+        grad += -2 * error @ S_x[[1, 4]]
+        rewards[k] = -np.sum(error ** 2)
+        env.current_step += 1
+
+    extra = {'grad_gains': grad[:6], 'rewards': rewards}
+    if wrt_params:
+        extra['grad_params'] = dict(zip(names, grad[6:]))
+    return cost, grad[:6] * gain_scale, extra
+
@@ -0,0 +1,295 @@
+###########################
+# import
+###########################
+
+import asyncio
+import socket
+import struct
+import time
+
+import numpy as np
+
+from CSTR_model_plus import RingBuffer, VectorCSTREnv
+
+
+
+##############################################
+# 1. Binary framing
+##############################################
+
+# Fixed-size little-endian frames, so every message is a single readexactly() call.
+# Request: opcode, argument (scenario id for RESET, -1 for a random episode), action
+REQUEST = struct.Struct('<c7xq6d')
+# Response: opcode, terminated, truncated, obs, reward, true state
+RESPONSE = struct.Struct('<c??5x8dd5d')
+# Metrics response: opcode, clients, queue depth, requests, batches, mean batch size,
+# and latency percentiles p50, p95, p99 (seconds)
+METRICS = struct.Struct('<c7x8d')
+
+STEP, RESET, METRICS_REQUEST, CLOSE, ERROR = b's', b'r', b'm', b'c', b'e'
+
+NO_ACTION = (0.0,) * 6
+
+
+
+##############################################
+# 2. Server
+##############################################
+
+class EnvServer:
+    """
+    asyncio server that hosts a pool of CSTR reactors (one VectorCSTREnv) for remote actors.
+
+    Every client connection owns one reactor of the pool. Requests that arrive while a
+    batch is being collected are served together: all pending resets in one masked
+    reset and all pending steps in one batched integration of exactly those reactors.
+    A batch is dispatched as soon as every connected client is waiting, or `max_wait`
+    seconds after its first request, whichever comes first, which bounds the latency a
+    slow client can add to the others.
+
+    Messages use fixed-size binary frames (REQUEST, RESPONSE, METRICS). A reactor that
+    terminated is reset on its next STEP (its reward is then 0), as in VectorCSTREnv.
+    If a batch raises, every request in it is answered with an ERROR frame and its
+    reactors start a new episode on their next request.
+    Serve on a Unix domain socket (address is a path) or TCP ((host, port)).
+    """
+    def __init__(self, num_envs=64, env_kwargs=None, seed=None, max_wait=1e-3, latency_window=4096):
+        self.env = VectorCSTREnv(num_envs, seed=seed, **(env_kwargs or {}))
+        self.env.reset()
+        self.max_wait = max_wait
+        self._free = list(range(num_envs - 1, -1, -1))
+        self._clients = 0
+        self._pending = [] # (row, opcode, argument, action, future, received)
+        self._wakeup = None
+        self._server = None
+
+        # Metrics
+        self.requests = 0
+        self.batches = 0
+        self.max_queue_depth = 0
+        self.failed_batches = 0
+        self._latency = RingBuffer(latency_window)
+        self._latency_count = 0
+
+    # -----------------------------------------
+    # Serving
+    # -----------------------------------------
+    async def start(self, address):
+        """
+        Start listening on `address` (a Unix socket path or a (host, port) tuple).
+        """
+        self._wakeup = asyncio.Event()
+        self._batcher = asyncio.ensure_future(self._batch_loop())
+        if isinstance(address, tuple):
+            self._server = await asyncio.start_server(self._handle, *address)
+        else:
+            self._server = await asyncio.start_unix_server(self._handle, address)
+        return self._server
+
+    async def serve(self, address):
+        """
+        Serve until cancelled.
+        """
+        server = await self.start(address)
+        async with server:
+            await server.serve_forever()
+
+    def run(self, address):
+        """
+        Blocking entry point: asyncio.run(self.serve(address)).
+        """
+        asyncio.run(self.serve(address))
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        self._batcher.cancel()
+
+    async def _handle(self, reader, writer):
+        """
+        One client connection: allocate a reactor, then answer its requests in order.
+        """
+        sock = writer.get_extra_info('socket')
+        if sock is not None and sock.family in (socket.AF_INET, socket.AF_INET6):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if not self._free:
+            writer.write(RESPONSE.pack(ERROR, False, False, *np.zeros(14)))
+            writer.close()
+            return
+        row = self._free.pop()
+        self.env.request_reset([row]) # a new client starts a new episode
+        self._clients += 1
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    frame = await reader.readexactly(REQUEST.size)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                opcode, argument, *action = REQUEST.unpack(frame)
+                if opcode == CLOSE:
+                    break
+                if opcode == METRICS_REQUEST:
+                    writer.write(METRICS.pack(METRICS_REQUEST, *self._metrics_tuple()))
+                elif opcode not in (STEP, RESET) or (opcode == RESET and argument >= 0
+                                                     and self.env.scenario_bank is None):
+                    writer.write(RESPONSE.pack(ERROR, False, False, *np.zeros(14)))
+                else:
+                    future = loop.create_future()
+                    self._pending.append((row, opcode, argument, action, future, time.perf_counter()))
+                    self._wakeup.set()
+                    writer.write(await future)
+                await writer.drain()
+        finally:
+            self._clients -= 1
+            self._free.append(row)
+            self._wakeup.set()
+            writer.close()
+
+    # -----------------------------------------
+    # Batching
+    # -----------------------------------------
+    async def _batch_loop(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if not self._pending:
+                continue
+
+            # Collect until every client is waiting or the oldest request waited max_wait
+            deadline = self._pending[0][5] + self.max_wait
+            while len(self._pending) < self._clients:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                self._wakeup.clear()
+
+            batch, self._pending = self._pending, []
+            try:
+                self._serve_batch(batch)
+            except Exception:
+                self._fail_batch(batch)
+
+    def _serve_batch(self, batch):
+        """
+        Apply one batch of requests to the reactor pool and resolve their futures.
+        """
+        env = self.env
+        self.batches += 1
+        self.requests += len(batch)
+        self.max_queue_depth = max(self.max_queue_depth, len(batch))
+
+        rows = np.array([request[0] for request in batch], dtype=np.int64)
+        is_reset = np.array([request[1] == RESET for request in batch])
+        actions = np.array([request[3] for request in batch])
+
+        scenario = np.array([request[2] for request in batch], dtype=np.int64)
+
+        # Explicit resets, and reactors that terminated on their previous step, start over
+        obs, rewards, done, _, info = env.step_rows(rows, actions, reset=is_reset, scenario_ids=scenario)
+        true_states = info['true_state']
+        now = time.perf_counter()
+        for i, (row, opcode, _, _, future, received) in enumerate(batch):
+            self._latency.push(now - received)
+            self._latency_count += 1
+            if not future.done():
+                future.set_result(RESPONSE.pack(opcode, bool(done[i]), False, *obs[i], rewards[i],
+                                                *true_states[i]))
+
+    def _fail_batch(self, batch):
+        """
+        A batch raised (e.g. an integrator failure): answer all of its requests with an
+        ERROR frame and start new episodes on their reactors, whose state is undefined.
+        """
+        self.failed_batches += 1
+        rows = np.array([request[0] for request in batch], dtype=np.int64)
+        self.env.request_reset(rows)
+        error = RESPONSE.pack(ERROR, False, False, *np.zeros(14))
+        for request in batch:
+            if not request[4].done():
+                request[4].set_result(error)
+
+    # -----------------------------------------
+    # Metrics
+    # -----------------------------------------
+    def _metrics_tuple(self):
+        latency = self._latency.data[:min(self._latency_count, self._latency.capacity)]
+        p50, p95, p99 = np.percentile(latency, [50, 95, 99]) if latency.size else (0.0, 0.0, 0.0)
+        return (self._clients, len(self._pending), self.requests, self.batches,
+                self.requests / max(1, self.batches), p50, p95, p99)
+
+    def metrics(self):
+        """
+        Connected clients, current queue depth, served requests and batches, mean batch
+        size, largest batch, failed batches and request latency percentiles (seconds)
+        over the last `latency_window` requests.
+        """
+        names = ('clients', 'queue_depth', 'requests', 'batches', 'mean_batch_size',
+                 'latency_p50', 'latency_p95', 'latency_p99')
+        metrics = dict(zip(names, self._metrics_tuple()))
+        metrics['max_queue_depth'] = self.max_queue_depth
+        metrics['failed_batches'] = self.failed_batches
+        return metrics
+
+
+
+##############################################
+# 3. Client
+##############################################
+
+class EnvClient:
+    """
+    Blocking client of an EnvServer (one reactor of the pool), with the gymnasium
+    reset/step interface of CSTRRLEnv. info holds the 'true_state' only.
+    """
+    def __init__(self, address):
+        if isinstance(address, tuple):
+            self._sock = socket.create_connection(address)
+            self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        else:
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._sock.connect(address)
+        self._buffer = bytearray(max(RESPONSE.size, METRICS.size))
+
+    def _request(self, opcode, argument=-1, action=NO_ACTION, response=RESPONSE):
+        self._sock.sendall(REQUEST.pack(opcode, argument, *action))
+        view = memoryview(self._buffer)[:response.size]
+        received = 0
+        while received < response.size:
+            n = self._sock.recv_into(view[received:])
+            if n == 0:
+                raise ConnectionError("EnvServer closed the connection")
+            received += n
+        fields = response.unpack(view)
+        if fields[0] == ERROR:
+            raise RuntimeError("EnvServer rejected the request (no free reactor, unknown "
+                               "request, scenario id without a scenario bank or a failed "
+                               "batch, after which the next request starts a new episode)")
+        return fields
+
+    def reset(self, scenario_id=-1):
+        fields = self._request(RESET, scenario_id)
+        return np.array(fields[3:11]), {'true_state': np.array(fields[12:17])}
+
+    def step(self, action):
+        fields = self._request(STEP, -1, tuple(np.asarray(action, dtype=np.float64)))
+        return (np.array(fields[3:11]), fields[11], fields[1], fields[2],
+                {'true_state': np.array(fields[12:17])})
+
+    def metrics(self):
+        fields = self._request(METRICS_REQUEST, response=METRICS)
+        names = ('clients', 'queue_depth', 'requests', 'batches', 'mean_batch_size',
+                 'latency_p50', 'latency_p95', 'latency_p99')
+        return dict(zip(names, fields[1:]))
+
+    def close(self):
+        try:
+            self._sock.sendall(REQUEST.pack(CLOSE, -1, *NO_ACTION))
+        except OSError:
+            pass
+        self._sock.close()
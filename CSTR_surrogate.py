@@ -0,0 +1,306 @@
+###########################
+# import
+###########################
+
+import numpy as np
+
+from CSTR_model_plus import CSTRRLEnv, Integrator, batch_cstr_dynamics, make_integrator
+
+
+
+##############################################
+# 1. Logging transitions
+##############################################
+
+# Order of the process parameters in the surrogate inputs
+PARAM_NAMES = tuple(CSTRRLEnv.nominal_params)
+
+
+def _stack_params(params, n):
+    """
+    Process parameters (dict of scalars or (n,) arrays) as an (n, 5) array.
+    """
+    return np.stack([np.broadcast_to(params[name], (n,)) for name in PARAM_NAMES], axis=1)
+
+
+class TransitionLogger(Integrator):
+    """
+    Wraps an integrator backend and logs every transition it computes:
+    (state, control, process parameters) -> next state.
+    """
+    name = 'logger'
+
+    def __init__(self, integrator='odeint', **options):
+        self.integrator = make_integrator(integrator, **options)
+        self.dt = None
+        self._log = {'x': [], 'u': [], 'params': [], 'x_next': []}
+        super(TransitionLogger, self).__init__()
+
+    def integrate(self, fun, x, dt, args=(), jac=None, params=None):
+        x_next = self.integrator.integrate(fun, x, dt, args, jac, params)
+        self._count(self.integrator.last_nfev)
+
+        if self.dt is not None and dt != self.dt:
+            raise ValueError(f"All logged transitions must share one time step, got {dt} and {self.dt}")
+        self.dt = dt
+        x2 = np.atleast_2d(x)
+        self._log['x'].append(x2.copy())
+        self._log['u'].append(np.atleast_2d(args[0]).copy())
+        self._log['params'].append(_stack_params(params, x2.shape[0]))
+        self._log['x_next'].append(np.atleast_2d(x_next).copy())
+        return x_next
+
+    def transitions(self):
+        """
+        The logged transitions as a dict of arrays 'x', 'u', 'params', 'x_next' and the time step 'dt'.
+        """
+        data = {key: np.concatenate(value) if value else np.empty((0, 0))
+                for key, value in self._log.items()}
+        data['dt'] = self.dt
+        return data
+
+
+def collect_transitions(episodes=50, env_kwargs=None, seed=0, integrator='odeint'):
+    """
+    Log the transitions of `episodes` CSTRRLEnv episodes driven by uniformly random
+    normalized PID gains (a new gain vector every episode), integrated with `integrator`.
+    """
+    logger = TransitionLogger(integrator)
+    env = CSTRRLEnv(**dict(env_kwargs or {}, record_history=False, integrator=logger))
+    rng = np.random.default_rng(seed)
+    for episode in range(episodes):
+        env.rollout(rng.uniform(-1, 1, 6), seed=seed + episode)
+    env.close()
+    return logger.transitions()
+
+
+
+##############################################
+# 2. Local-linear surrogate backend
+##############################################
+
+def _squared_distances(z, centers):
+    """
+    Squared Euclidean distances between the rows of z (n, d) and centers (k, d).
+    """
+    return np.maximum(0.0, (z ** 2).sum(axis=1)[:, None] - 2 * z @ centers.T
+                      + (centers ** 2).sum(axis=1)[None, :])
+
+
+class SurrogateIntegrator(Integrator):
+    """
+    Data-driven backend that predicts the state after one control interval.
+
+    The inputs z = (state, control, process parameters, dx/dt) are standardized and split
+    into regions by k-means; each region has its own ridge-regression model of the state
+    increment x(dt) - x(0), linear in z. The right-hand side dx/dt at x(0) is a cheap
+    physics feature that captures most of the Arrhenius nonlinearity. A prediction costs
+    one RHS evaluation, one nearest-center search and one small matrix product for the
+    whole batch, instead of an ODE solve.
+
+    Error monitor: a query farther from its center than the training data of that region
+    (the `coverage` quantile of the training distances times `radius_scale`), a non-finite
+    prediction or a different time step is outside the trained region, and those rows are
+    integrated by the `fallback` backend instead. The largest validation error of each
+    region (on held-out transitions) is kept in `region_error`; regions whose error exceeds
+    `tolerance` (per state, optional) always fall back, which bounds the one-step error.
+
+    Fit with SurrogateIntegrator.fit(collect_transitions(...)), then pass the instance
+    as `integrator` to CSTRRLEnv, VectorCSTREnv or PIDTuner.
+    """
+    name = 'surrogate'
+
+    def __init__(self, model, fallback='odeint', radius_scale=1.5, tolerance=None):
+        self.model = model
+        self.dt = float(model['dt'])
+        self.fallback = make_integrator(fallback)
+        self.radius_scale = radius_scale
+        self.tolerance = tolerance
+
+        # Squared acceptance radius of every region (negative: region disabled)
+        self._radius2 = (radius_scale * model['radius']) ** 2
+        if tolerance is not None:
+            too_large = np.any(model['region_error'] > np.asarray(tolerance), axis=1)
+            self._radius2 = np.where(too_large, -1.0, self._radius2)
+        super(SurrogateIntegrator, self).__init__()
+
+    def reset_stats(self):
+        super(SurrogateIntegrator, self).reset_stats()
+        self.n_predicted = 0 # transitions predicted by the surrogate
+        self.n_fallback = 0  # transitions integrated by the fallback backend
+
+    @property
+    def region_error(self):
+        return self.model['region_error']
+
+    # -----------------------------------------
+    # Fitting
+    # -----------------------------------------
+    @classmethod
+    def fit(cls, transitions, n_regions=128, ridge=1e-6, coverage=0.99, validation=0.1,
+            iterations=25, seed=0, **options):
+        """
+        Fit the surrogate to transitions as returned by collect_transitions.
+        Extra options are passed to the constructor.
+        """
+        rng = np.random.default_rng(seed)
+        params = dict(zip(PARAM_NAMES, transitions['params'].T))
+        rhs = batch_cstr_dynamics(transitions['x'], 0.0, transitions['u'], params)
+        inputs = np.hstack([transitions['x'], transitions['u'], transitions['params'], rhs])
+        targets = transitions['x_next'] - transitions['x']
+
+        # Hold out transitions to measure the error of every region
+        order = rng.permutation(inputs.shape[0])
+        n_val = int(validation * inputs.shape[0])
+        val, train = order[:n_val], order[n_val:]
+
+        mean, std = inputs[train].mean(axis=0), inputs[train].std(axis=0) + 1e-12
+        target_scale = targets[train].std(axis=0) + 1e-12
+        z = (inputs[train] - mean) / std
+
+        # k-means (Lloyd iterations from random training points)
+        centers = z[rng.choice(z.shape[0], n_regions, replace=False)]
+        for _ in range(iterations):
+            labels = np.argmin(_squared_distances(z, centers), axis=1)
+            for k in range(n_regions):
+                members = labels == k
+                if members.any():
+                    centers[k] = z[members].mean(axis=0)
+        distances = _squared_distances(z, centers)
+        labels = np.argmin(distances, axis=1)
+        distances = np.sqrt(distances[np.arange(z.shape[0]), labels])
+
+        # Ridge regression of the scaled increments on [1, z] in every region
+        d = z.shape[1] + 1
+        coefs = np.zeros((n_regions, d, targets.shape[1]))
+        radius = np.zeros(n_regions) # empty regions never accept a query
+        for k in range(n_regions):
+            members = labels == k
+            if not members.any():
+                continue
+            Z = np.hstack([np.ones((members.sum(), 1)), z[members]])
+            Y = targets[train][members] / target_scale
+            coefs[k] = np.linalg.solve(Z.T @ Z + ridge * np.eye(d), Z.T @ Y)
+            radius[k] = np.quantile(distances[members], coverage)
+
+        model = {'dt': transitions['dt'], 'mean': mean, 'std': std, 'target_scale': target_scale,
+                 'centers': centers, 'coefs': coefs, 'radius': radius,
+                 'region_error': np.zeros((n_regions, targets.shape[1]))}
+
+        # Largest absolute validation error of every region (state units)
+        surrogate = cls(model)
+        predicted, accepted, val_labels = surrogate._predict(transitions['x'][val], inputs[val])
+        error = np.abs(predicted - transitions['x_next'][val])
+        for k in range(n_regions):
+            members = accepted & (val_labels == k)
+            if members.any():
+                model['region_error'][k] = error[members].max(axis=0)
+        return cls(model, **options)
+
+    # -----------------------------------------
+    # Prediction
+    # -----------------------------------------
+    def _predict(self, x, inputs):
+        """
+        Predicted next states for a batch of states x (N, 5) and surrogate inputs (N, 17).
+        Returns (x_next, accepted, regions), where accepted marks rows inside the trained region.
+        """
+        model = self.model
+        z = (inputs - model['mean']) / model['std']
+        distances = _squared_distances(z, model['centers'])
+        labels = np.argmin(distances, axis=1)
+        accepted = distances[np.arange(z.shape[0]), labels] <= self._radius2[labels]
+
+        coefs = model['coefs'][labels]
+        increment = coefs[:, 0] + np.einsum('nd,ndo->no', z, coefs[:, 1:])
+        x_next = x + increment * model['target_scale']
+        accepted &= np.all(np.isfinite(x_next), axis=1)
+        return x_next, accepted, labels
+
+    def predict(self, x, u, params):
+        """
+        Predicted next states of a batch (x (N, 5), u (N, 2), params (N, 5) array or dict).
+        Returns (x_next, accepted), where accepted marks rows inside the trained region.
+        """
+        if not isinstance(params, dict):
+            params = dict(zip(PARAM_NAMES, np.asarray(params).T))
+        rhs = batch_cstr_dynamics(x, 0.0, u, params)
+        inputs = np.hstack([x, u, _stack_params(params, x.shape[0]), rhs])
+        return self._predict(x, inputs)[:2]
+
+    def _predict_one(self, x, u, params, rhs):
+        """
+        Fast path of _predict for a single reactor; returns None outside the trained region.
+        """
+        model = self.model
+        z = (np.concatenate([x, u, [params[name] for name in PARAM_NAMES], rhs])
+             - model['mean']) / model['std']
+        distances = ((model['centers'] - z) ** 2).sum(axis=1)
+        k = distances.argmin()
+        if distances[k] > self._radius2[k]:
+            return None
+        coefs = model['coefs'][k]
+        x_next = x + (coefs[0] + z @ coefs[1:]) * model['target_scale']
+        return x_next if np.all(np.isfinite(x_next)) else None
+
+    def integrate(self, fun, x, dt, args=(), jac=None, params=None):
+        if params is None or dt != self.dt:
+            return self._fall_back(fun, x, dt, args, jac, params, x.shape[0] if x.ndim > 1 else 1)
+
+        rhs = fun(x, 0.0, *args)
+        if x.ndim == 1:
+            x_next = self._predict_one(x, args[0], params, rhs)
+            if x_next is None:
+                return self._fall_back(fun, x, dt, args, jac, params, 1, rhs_evaluated=True)
+            self.n_predicted += 1
+            self._count(1)
+            return x_next
+
+        inputs = np.hstack([x, args[0], _stack_params(params, x.shape[0]), rhs])
+        x_next, accepted, _ = self._predict(x, inputs)
+        self.n_predicted += int(accepted.sum())
+        if accepted.all():
+            self._count(1)
+            return x_next
+
+        # Integrate the rows outside the trained region with the real model
+        rows = np.flatnonzero(~accepted)
+        x_next[rows] = self._fall_back(fun, x[rows], dt, _take_rows(args, rows, x.shape[0]), jac,
+                                       _take_rows(params, rows, x.shape[0]), rows.size,
+                                       rhs_evaluated=True)
+        return x_next
+
+    def _fall_back(self, fun, x, dt, args, jac, params, n, rhs_evaluated=False):
+        """
+        Integrate with the fallback backend and count the call once, including the RHS
+        evaluation of the surrogate inputs if one was made.
+        """
+        x_next = self.fallback.integrate(fun, x, dt, args, jac, params)
+        self.n_fallback += n
+        self._count(self.fallback.last_nfev + (1 if rhs_evaluated else 0))
+        return x_next
+
+    # -----------------------------------------
+    # Persistence
+    # -----------------------------------------
+    def save(self, path):
+        np.savez(path, **self.model)
+
+    @classmethod
+    def load(cls, path, **options):
+        with np.load(path) as data:
+            model = {key: data[key] for key in data.files}
+        return cls(model, **options)
+
+
+def _take_rows(value, rows, n):
+    """
+    Select batch rows of integrator arguments (arrays with n rows, dicts, tuples of those).
+    """
+    if isinstance(value, dict):
+        return {key: _take_rows(item, rows, n) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return tuple(_take_rows(item, rows, n) for item in value)
+    if isinstance(value, np.ndarray) and value.ndim > 0 and value.shape[0] == n:
+        return value[rows]
+    return value
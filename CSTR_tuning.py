@@ -0,0 +1,280 @@
+###########################
+# import
+###########################
+
+import numpy as np
+
+from CSTR_model_plus import (COOLING_UPSET_STEPS, CSTRRLEnv, PID_velocity_batch, batch_cstr_dynamics,
+                             batch_cstr_jacobian, disturbance_steps, make_integrator)
+
+
+
+##############################################
+# 1. Scenarios
+##############################################
+
+def make_scenarios(seeds, env_kwargs=None):
+    """
+    Draw the random part of one episode per seed, exactly as CSTRRLEnv(seed=seed).reset()
+    with predraw_noise does: the uncertain process parameters, the measurement noise
+    of every step and the disturbance events.
+
+    All candidates are evaluated on the same scenarios (common random numbers), so their
+    costs differ only because of the gains.
+
+    Returns a dict with
+      'params': dict of (S,) arrays of process parameters
+      'noise': (S, sim_steps + 1, 5) standard normal noise (row 0 is the initial measurement)
+      'disturbance_types', 'disturbance_draws': (S, n_events) pre-drawn disturbance events
+    """
+    env_kwargs = dict(env_kwargs or {}, record_history=False, predraw_noise=True)
+    params, noise, types, draws = [], [], [], []
+    for seed in seeds:
+        env = CSTRRLEnv(**env_kwargs)
+        env.reset(seed=int(seed))
+        params.append(env.process_params)
+        noise.append(env._noise_block)
+        types.append(env._disturbance_draws[0])
+        draws.append(env._disturbance_draws[1])
+        env.close()
+
+    return {
+        'params': {key: np.array([p[key] for p in params]) for key in CSTRRLEnv.nominal_params},
+        'noise': np.stack(noise),
+        'disturbance_types': np.stack(types),
+        'disturbance_draws': np.stack(draws),
+    }
+
+
+
+##############################################
+# 2. Batched gain evaluation
+##############################################
+
+# Outcome of each candidate in PIDTuner.evaluate
+FINISHED, DIVERGED, PRUNED = 0, 1, 2
+
+
+class PIDTuner:
+    """
+    Evaluates many candidate PID gain vectors on a fixed set of scenarios at once.
+
+    All K x S closed-loop episodes (K candidates, S scenario seeds) are simulated as one
+    batch of reactors: the dynamics, the Jacobian and the velocity PID are evaluated
+    over the whole batch with NumPy, and the integrator advances all reactors in one call.
+    The episodes follow CSTRRLEnv (parameter uncertainty, noise, delays, disturbances)
+    with the random draws of make_scenarios, so candidate k on seed s reproduces
+    CSTRRLEnv(predraw_noise=True).rollout(gains[k], seed=s) up to integrator tolerance.
+
+    The cost of an episode is the sum of the squared setpoint errors of the true state,
+    i.e. minus the episode return. Candidates are dropped from the batch early when
+    - they diverge (non-finite state or temperature runaway), or
+    - they are clearly dominated: since the cost only grows during an episode, a
+      candidate whose partial cost already exceeds `incumbent_cost` (e.g. the best cost
+      found so far by the search) cannot beat it, and one whose partial cost exceeds
+      `prune_ratio` times the best partial cost of the batch is very unlikely to.
+    """
+    def __init__(self, seeds, env_kwargs=None, integrator='odeint', integrator_options=None,
+                 prune_ratio=10.0, check_every=10, max_temperature=500.0):
+        self.seeds = np.asarray(seeds)
+        self.env_kwargs = dict(env_kwargs or {})
+        self.integrator = make_integrator(integrator, **(integrator_options or {}))
+        self.prune_ratio = prune_ratio     # None disables pruning against the batch
+        self.check_every = check_every     # steps between pruning checks
+        self.max_temperature = max_temperature
+
+        # Episode settings, read from an environment built with the same arguments
+        env = CSTRRLEnv(**dict(self.env_kwargs, record_history=False))
+        self.sim_steps = env.sim_steps
+        self.dt = env.dt
+        self.noise_level = env.noise_level
+        self.actuator_delay_steps = env.actuator_delay_steps
+        self.transport_delay_steps = env.transport_delay_steps
+        self.enable_disturbances = env.enable_disturbances
+        self.disturbance_interval = env.disturbance_interval
+        # Disturbance event steps, followed by a sentinel that is never reached
+        self.disturbance_steps = np.append(
+            disturbance_steps(env.sim_steps, env.disturbance_interval, env.disturbance_spacing),
+            np.iinfo(np.int64).max)
+        self.pid_lower, self.pid_upper = env.pid_lower, env.pid_upper
+        self.setpoints = np.array([env.setpoint_Cb, env.setpoint_V])
+        self.x0 = env.x0.copy()
+        self.default_u = np.array([300.0, 100.0])
+        env.close()
+
+        self.scenarios = make_scenarios(self.seeds, self.env_kwargs)
+
+    @property
+    def num_scenarios(self):
+        return self.seeds.size
+
+    def scale(self, actions):
+        """
+        Map normalized actions in [-1, 1] (shape (K, 6)) to PID gains.
+        """
+        return ((np.asarray(actions) + 1) / 2) * (self.pid_upper - self.pid_lower) + self.pid_lower
+
+    def evaluate(self, actions, incumbent_cost=None, batch_size=None):
+        """
+        Score K candidate gain vectors (normalized as CSTRRLEnv actions, shape (K, 6)).
+
+        Inputs:
+          incumbent_cost: mean cost to beat; candidates that provably cannot are pruned
+          batch_size: evaluate at most this many candidates at a time (bounds memory)
+
+        Returns a dict with
+          'mean', 'std', 'max': (K,) statistics of the episode cost over the scenarios
+                                (inf for diverged candidates; for pruned candidates,
+                                the statistics of the partial costs, a lower bound)
+          'costs': (K, S) episode costs
+          'status': (K,) FINISHED, DIVERGED or PRUNED
+          'steps': (K,) number of steps simulated before the candidate was dropped
+        """
+        actions = np.atleast_2d(np.asarray(actions, dtype=np.float64))
+        K = actions.shape[0]
+        batch_size = batch_size or K
+
+        costs = np.empty((K, self.num_scenarios))
+        status = np.empty(K, dtype=np.int64)
+        steps = np.empty(K, dtype=np.int64)
+        for start in range(0, K, batch_size):
+            stop = min(K, start + batch_size)
+            # Overflows of diverging candidates are expected; they are detected and dropped
+            with np.errstate(over='ignore', invalid='ignore'):
+                costs[start:stop], status[start:stop], steps[start:stop] = \
+                    self._simulate(self.scale(actions[start:stop]), incumbent_cost)
+            # Later batches only need to beat the best finished candidate so far
+            finished = status[:stop] == FINISHED
+            if finished.any():
+                best = costs[:stop][finished].mean(axis=1).min()
+                incumbent_cost = best if incumbent_cost is None else min(incumbent_cost, best)
+
+        diverged = status == DIVERGED
+        return {
+            'mean': costs.mean(axis=1),
+            'std': np.where(diverged, np.inf, np.where(diverged[:, None], 0.0, costs).std(axis=1)),
+            'max': costs.max(axis=1),
+            'costs': costs,
+            'status': status,
+            'steps': steps,
+        }
+
+    def _simulate(self, pid_gains, incumbent_cost):
+        """
+        Run the K x S episodes of one batch of candidates (PID gains of shape (K, 6)).
+        """
+        K, S = pid_gains.shape[0], self.num_scenarios
+        scenarios = self.scenarios
+
+        costs = np.zeros((K, S))
+        status = np.full(K, FINISHED, dtype=np.int64)
+        steps = np.full(K, self.sim_steps, dtype=np.int64)
+
+        # Reactor n = k * S + s runs candidate k on scenario s; rows of dropped candidates
+        # are removed from all batch arrays, `candidate` and `scenario` map rows back
+        candidate = np.repeat(np.arange(K), S)
+        scenario = np.tile(np.arange(S), K)
+        gains = pid_gains[candidate]
+        params = {key: value[scenario] for key, value in scenarios['params'].items()}
+        noise = scenarios['noise']
+
+        # Reactor states, PID histories and delay lines; all reactors step in lockstep,
+        # so the circular delay lines share one head
+        N = K * S
+        true_state = np.tile(self.x0, (N, 1))
+        measured = np.maximum(0, true_state + true_state * self.noise_level * noise[scenario, 0])
+        measurement_buffer = np.repeat(measured[:, None, :], max(1, self.transport_delay_steps), axis=1)
+        control_buffer = np.tile(self.default_u, (N, max(1, self.actuator_delay_steps), 1))
+        measurement_head = control_head = 0
+        e_history = np.repeat((self.setpoints - measured[:, [1, 4]])[:, None, :], 2, axis=1)
+        u_history = np.tile(self.default_u, (N, 2, 1))
+        row_costs = np.zeros(N)
+
+        # Disturbance timing is the same for all reactors
+        next_cooling_fix = np.full(N, -1, dtype=np.int64)
+        event = 0
+
+        def drop(keep):
+            nonlocal candidate, scenario, gains, params, true_state, measurement_buffer, \
+                control_buffer, e_history, u_history, row_costs, next_cooling_fix
+            candidate, scenario, gains = candidate[keep], scenario[keep], gains[keep]
+            params = {key: value[keep] for key, value in params.items()}
+            true_state, row_costs = true_state[keep], row_costs[keep]
+            measurement_buffer, control_buffer = measurement_buffer[keep], control_buffer[keep]
+            e_history, u_history = e_history[keep], u_history[keep]
+            next_cooling_fix = next_cooling_fix[keep]
+
+        for step in range(self.sim_steps):
+            if candidate.size == 0:
+                break
+
+            # Velocity PID on the delayed, noisy measurements (hold the last action for two steps)
+            measured = measurement_buffer[:, measurement_head]
+            error = self.setpoints - measured[:, [1, 4]]
+            if step < 2:
+                control = u_history[:, -1].copy()
+            else:
+                control = PID_velocity_batch(gains, error, e_history, u_history, self.dt)
+
+            # Actuator delay line and PID histories
+            delayed_control = control_buffer[:, control_head].copy()
+            control_buffer[:, control_head] = control
+            control_head = (control_head + 1) % control_buffer.shape[1]
+            u_history[:, 0], u_history[:, 1] = u_history[:, 1], control
+            e_history[:, 0], e_history[:, 1] = e_history[:, 1], error
+
+            # Disturbances (same events for all candidates of a scenario)
+            if self.enable_disturbances:
+                if step >= self.disturbance_steps[event]:
+                    kind = scenarios['disturbance_types'][scenario, event]
+                    magnitude = 1 + 0.1 * (scenarios['disturbance_draws'][scenario, event] - 0.5)
+                    params['Tf'][kind == 0] *= magnitude[kind == 0]
+                    params['Caf'][kind == 1] *= magnitude[kind == 1]
+                    params['UA'][kind == 2] *= 0.8
+                    next_cooling_fix[kind == 2] = step + COOLING_UPSET_STEPS
+                    event += 1
+                fixed = next_cooling_fix == step
+                params['UA'][fixed] /= 0.8
+                next_cooling_fix[fixed] = -1
+
+            # Integrate all reactors at once
+            true_state = self.integrator.integrate(batch_cstr_dynamics, true_state, self.dt,
+                                                   args=(delayed_control, params), jac=batch_cstr_jacobian,
+                                                   params=params)
+
+            # Measurement noise and transport delay line
+            measurement_buffer[:, measurement_head] = np.maximum(
+                0, true_state + true_state * self.noise_level * noise[scenario, step + 1])
+            measurement_head = (measurement_head + 1) % measurement_buffer.shape[1]
+
+            row_costs += np.sum((self.setpoints - true_state[:, [1, 4]]) ** 2, axis=1)
+
+            # Drop diverging candidates right away
+            bad = ~np.all(np.isfinite(true_state), axis=1) | (true_state[:, 3] > self.max_temperature)
+            if bad.any():
+                diverged = np.unique(candidate[bad])
+                status[diverged] = DIVERGED
+                steps[diverged] = step + 1
+                costs[diverged] = np.inf
+                drop(~np.isin(candidate, diverged))
+
+            # Periodically drop dominated candidates
+            if (step + 1) % self.check_every == 0 and step + 1 < self.sim_steps and candidate.size:
+                partial = np.zeros((K, S))
+                partial[candidate, scenario] = row_costs
+                alive = np.unique(candidate)
+                mean_partial = partial[alive].mean(axis=1)
+                dominated = np.zeros(alive.size, dtype=bool)
+                if incumbent_cost is not None:
+                    dominated |= mean_partial > incumbent_cost
+                if self.prune_ratio is not None and mean_partial.min() > 0:
+                    dominated |= mean_partial > self.prune_ratio * mean_partial.min()
+                if dominated.any():
+                    pruned = alive[dominated]
+                    status[pruned] = PRUNED
+                    steps[pruned] = step + 1
+                    costs[pruned] = partial[pruned]
+                    drop(~np.isin(candidate, pruned))
+
+        costs[candidate, scenario] = row_costs
+        return costs, status, steps
@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+
+from CSTR_model_plus import CSTRRLEnv
+
+ACTION = np.array([0.1, -0.5, -0.9, 0.3, 0.0, -0.5])
+
+
+def run_steps(env, actions, seed):
+    """
+    Reset with `seed` and step through `actions` (one row per step) until done.
+    Returns the observations and rewards.
+    """
+    obs, _ = env.reset(seed=seed)
+    observations, rewards = [obs.copy()], []
+    for action in actions:
+        obs, reward, done, _, _ = env.step(action)
+        observations.append(obs.copy())
+        rewards.append(reward)
+        if done:
+            break
+    return np.array(observations), np.array(rewards)
+
+
+@pytest.mark.parametrize("kwargs", [dict(), dict(predraw_noise=True), dict(integrator='rk4'),
+                                    dict(actuator_delay_steps=3, transport_delay_steps=1)])
+def test_rollout_matches_step(kwargs):
+    actions = np.random.default_rng(0).uniform(-1, 1, (50, 6))
+    env, reference = CSTRRLEnv(simulation_steps=50, **kwargs), CSTRRLEnv(simulation_steps=50, **kwargs)
+    for schedule in (actions[0], actions):
+        _, rewards = run_steps(reference, actions if schedule.ndim > 1 else np.tile(schedule, (50, 1)), seed=5)
+        trajectory, rollout_rewards = env.rollout(schedule, seed=5)
+        np.testing.assert_array_equal(rollout_rewards, rewards)
+        assert trajectory.tobytes() == reference.history.records.tobytes()
+
+
+def test_predrawn_noise_matches_drawing_on_the_fly():
+    actions = np.tile(ACTION, (40, 1))
+    obs, rewards = run_steps(CSTRRLEnv(simulation_steps=40), actions, seed=3)
+    obs_predrawn, rewards_predrawn = run_steps(CSTRRLEnv(simulation_steps=40, predraw_noise=True), actions, seed=3)
+    np.testing.assert_array_equal(obs_predrawn, obs)
+    np.testing.assert_array_equal(rewards_predrawn, rewards)
+
+
+@pytest.mark.parametrize("kwargs", [dict(), dict(predraw_noise=True), dict(integrator='rk4'),
+                                    dict(integrator='ivp'), dict(action_repeat=3), dict(controller='mpc')])
+def test_low_allocation_is_bit_identical(kwargs):
+    actions = np.random.default_rng(1).uniform(-1, 1, (40, 6))
+    env = CSTRRLEnv(simulation_steps=40, **kwargs)
+    buffered = CSTRRLEnv(simulation_steps=40, low_allocation=True, **kwargs)
+    np.testing.assert_array_equal(run_steps(buffered, actions, seed=4)[0], run_steps(env, actions, seed=4)[0])
+    assert buffered.history.records.tobytes() == env.history.records.tobytes()
+
+
+@pytest.mark.parametrize("integrator", ['odeint', 'rk4', 'ivp'])
+def test_action_repeat_restart_matches_single_steps(integrator):
+    single = CSTRRLEnv(simulation_steps=40, integrator=integrator)
+    held = CSTRRLEnv(simulation_steps=40, integrator=integrator, action_repeat=4, continuous_repeat=False)
+    _, rewards = run_steps(single, np.tile(ACTION, (40, 1)), seed=2)
+    _, held_rewards = run_steps(held, np.tile(ACTION, (10, 1)), seed=2)
+    np.testing.assert_allclose(held_rewards, rewards.reshape(10, 4).sum(axis=1), rtol=1e-12)
+    assert held.history.records.tobytes() == single.history.records.tobytes()
+
+
+@pytest.mark.parametrize("integrator", ['odeint', 'ivp'])
+def test_action_repeat_session_matches_single_steps_to_tolerance(integrator):
+    # The session only agrees to the solver tolerance, which compounds over the closed loop
+    options = dict(rtol=1e-10, atol=1e-12)
+    single = CSTRRLEnv(simulation_steps=40, integrator=integrator, integrator_options=options)
+    held = CSTRRLEnv(simulation_steps=40, integrator=integrator, integrator_options=options, action_repeat=4)
+    _, rewards = run_steps(single, np.tile(ACTION, (40, 1)), seed=2)
+    _, held_rewards = run_steps(held, np.tile(ACTION, (10, 1)), seed=2)
+    np.testing.assert_allclose(held_rewards, rewards.reshape(10, 4).sum(axis=1), rtol=1e-6)
+    np.testing.assert_allclose(held.history['Cb'], single.history['Cb'], rtol=1e-6)
+
+
+@pytest.mark.parametrize("kwargs", [dict(), dict(integrator='ivp'), dict(controller='mpc'),
+                                    dict(predraw_noise=True, actuator_delay_steps=3)])
+def test_snapshot_restores_bit_for_bit(kwargs):
+    actions = np.random.default_rng(2).uniform(-1, 1, (60, 6))
+    env = CSTRRLEnv(simulation_steps=60, seed=0, **kwargs)
+    env.reset(seed=5)
+    for action in actions[:20]:
+        env.step(action)
+    snapshot = env.get_state()
+
+    def branch():
+        return [env.step(action)[:2] for action in actions[20:]]
+
+    first = branch()
+    history = env.history.records.copy()
+    env.set_state(snapshot)
+    second = branch()
+    for (obs, reward), (obs_again, reward_again) in zip(first, second):
+        np.testing.assert_array_equal(obs_again, obs)
+        assert reward_again == reward
+    assert env.history.records.tobytes() == history.tobytes()
+
+
+def test_snapshot_survives_a_reset_to_other_parameters():
+    env = CSTRRLEnv(simulation_steps=40, controller='mpc')
+    env.reset(seed=1)
+    env.step(ACTION)
+    snapshot = env.get_state()
+    rewards = [env.step(ACTION)[1] for _ in range(10)]
+    env.reset(seed=7)
+    env.step(ACTION)
+    env.set_state(snapshot)
+    assert [env.step(ACTION)[1] for _ in range(10)] == rewards
@@ -0,0 +1,48 @@
+import numpy as np
+
+from CSTR_model_plus import CSTRRLEnv, batch_cstr_dynamics, batch_cstr_input_jacobian, batch_cstr_jacobian
+from CSTR_sensitivity import episode_gradient
+
+
+def finite_differences(fun, x, h=1e-6):
+    """
+    Forward differences of fun (an array function of the last axis of x) for every entry of x.
+    """
+    f0 = fun(x)
+    J = np.empty(f0.shape + (x.shape[-1],))
+    for j in range(x.shape[-1]):
+        step = h * np.maximum(1.0, np.abs(x[..., j]))
+        xp = x.copy()
+        xp[..., j] += step
+        J[..., j] = (fun(xp) - f0) / step[..., None]
+    return J
+
+
+def test_analytic_jacobians_match_finite_differences():
+    rng = np.random.default_rng(0)
+    x = np.array([0.8, 0.2, 0.05, 340.0, 100.0]) * rng.uniform(0.9, 1.1, (6, 5))
+    u = np.array([300.0, 100.0]) * rng.uniform(0.95, 1.05, (6, 2))
+    params = {key: value * rng.uniform(0.95, 1.05, 6) for key, value in CSTRRLEnv.nominal_params.items()}
+    J = batch_cstr_jacobian(x, 0.0, u, params)
+    J_fd = finite_differences(lambda z: batch_cstr_dynamics(z, 0.0, u, params), x)
+    np.testing.assert_allclose(J, J_fd, rtol=1e-4, atol=1e-6)
+    J_u = batch_cstr_input_jacobian(x, 0.0, u, params)
+    J_u_fd = finite_differences(lambda v: batch_cstr_dynamics(x, 0.0, v, params), u)
+    np.testing.assert_allclose(J_u, J_u_fd, rtol=1e-4, atol=1e-6)
+
+
+def test_episode_gradient_matches_finite_differences():
+    action = np.array([0.1, -0.5, -0.9, 0.3, 0.0, -0.5])
+    env = CSTRRLEnv(simulation_steps=30, record_history=False, seed=0,
+                    integrator_options=dict(rtol=1e-11, atol=1e-12))
+    cost, gradient, _ = episode_gradient(env, action, seed=3, rtol=1e-11, atol=1e-12)
+    assert np.isclose(cost, -env.rollout(action, seed=3)[1].sum(), rtol=1e-8)
+
+    h = 1e-6
+    fd = np.empty(6)
+    for i in range(6):
+        up, down = action.copy(), action.copy()
+        up[i] += h
+        down[i] -= h
+        fd[i] = (env.rollout(down, seed=3)[1].sum() - env.rollout(up, seed=3)[1].sum()) / (2 * h)
+    np.testing.assert_allclose(gradient, fd, rtol=1e-4, atol=1e-6 * np.abs(fd).max())
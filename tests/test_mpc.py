@@ -0,0 +1,37 @@
+import numpy as np
+
+from CSTR_model_plus import CSTRRLEnv
+from CSTR_mpc import LinearMPC
+
+
+def controls(mpc, n=50):
+    rng = np.random.default_rng(0)
+    out = []
+    for _ in range(n):
+        x = mpc.x_ss * (1 + 0.5 * (rng.random(5) - 0.5))
+        out.append(mpc.control(x, mpc.u_ss + rng.uniform(-50, 50, 2)))
+    return np.array(out)
+
+
+def test_cached_operating_point_matches_a_fresh_controller():
+    params = {key: value * 1.03 for key, value in CSTRRLEnv.nominal_params.items()}
+    mpc = LinearMPC()
+    mpc.set_operating_point(params)
+    mpc.set_operating_point(CSTRRLEnv.nominal_params)
+    mpc.set_operating_point(params)
+    assert (mpc.cache.hits, mpc.cache.misses) == (1, 2)
+
+    fresh = LinearMPC()
+    fresh.set_operating_point(params)
+    np.testing.assert_array_equal(controls(mpc), controls(fresh))
+
+
+def test_state_round_trip():
+    mpc = LinearMPC(delay=2)
+    mpc.set_operating_point(CSTRRLEnv.nominal_params)
+    controls(mpc, 5)
+    state = mpc.get_state()
+    first = controls(mpc)
+    mpc.set_operating_point({key: value * 0.97 for key, value in CSTRRLEnv.nominal_params.items()})
+    mpc.set_state(state)
+    np.testing.assert_array_equal(controls(mpc), first)
@@ -0,0 +1,61 @@
+import numpy as np
+
+from CSTR_model_plus import batch_cstr_dynamics
+from CSTR_plant import CSTRPlantEnv, PlantJacobian, PlantTopology, plant_dynamics
+
+ACTION = np.array([0.1, -0.5, -0.9, 0.3, 0.0, -0.5])
+
+
+def test_parallel_plant_matches_batch_dynamics():
+    topology = PlantTopology.parallel(5)
+    x = np.tile([0.5, 0.3, 0.1, 340.0, 100.0], (5, 1))
+    u = np.tile([300.0, 101.0], (5, 1))
+    params = {key: np.full(5, value) for key, value in CSTRPlantEnv.nominal_params.items()}
+    np.testing.assert_array_equal(plant_dynamics(x, 0, u, params, topology), batch_cstr_dynamics(x, 0, u, params))
+
+
+def test_plant_jacobian_matches_finite_differences():
+    rng = np.random.default_rng(0)
+    for topology in [PlantTopology.series(4), PlantTopology.trains(2, 3), PlantTopology([2, -1, -1, 0])]:
+        M = topology.num_units
+        x = np.tile([0.5, 0.3, 0.1, 340.0, 100.0], (M, 1)) * rng.uniform(0.9, 1.1, (M, 5))
+        u = np.tile([300.0, 101.0], (M, 1)) * rng.uniform(0.99, 1.01, (M, 2))
+        params = {key: value * rng.uniform(0.95, 1.05, M) for key, value in CSTRPlantEnv.nominal_params.items()}
+        jacobian = PlantJacobian(topology)
+        J = jacobian.csr(x, 0, u, params).toarray()
+
+        f0 = plant_dynamics(x, 0, u, params, topology).ravel()
+        J_fd = np.empty_like(J)
+        for j in range(5 * M):
+            h = 1e-6 * max(1.0, abs(x.flat[j]))
+            xp = x.ravel().copy()
+            xp[j] += h
+            J_fd[:, j] = (plant_dynamics(xp.reshape(M, 5), 0, u, params, topology).ravel() - f0) / h
+        np.testing.assert_allclose(J, J_fd, rtol=1e-3, atol=1e-3)
+
+        # The banded form holds the same entries
+        band = jacobian.banded(x.ravel(), 0, u, params)
+        for i, j in zip(*np.nonzero(J)):
+            assert band[i - j + topology.mu, j] == J[i, j]
+
+
+def test_single_unit_trains_match_parallel_units():
+    parallel = CSTRPlantEnv(3, 'parallel', seed=0)
+    trains = CSTRPlantEnv(3, PlantTopology.trains(3, 1), seed=0)
+    np.testing.assert_array_equal(trains.reset(seed=2)[0], parallel.reset(seed=2)[0])
+    for _ in range(30):
+        np.testing.assert_array_equal(trains.step(np.tile(ACTION, (3, 1)))[0],
+                                      parallel.step(np.tile(ACTION, (3, 1)))[0])
+
+
+def test_feed_disturbances_only_reach_fresh_feed_units():
+    env = CSTRPlantEnv(4, 'series', simulation_steps=100, seed=3)
+    env.reset(seed=3)
+    Tf, Caf = env.process_params['Tf'].copy(), env.process_params['Caf'].copy()
+    fed = env.topology.upstream >= 0
+    done = False
+    while not done:
+        _, _, done, _, info = env.step(np.tile(ACTION, (4, 1)))
+        assert not np.isin(info['disturbance'][fed], [0, 1]).any()
+    np.testing.assert_array_equal(env.process_params['Tf'][fed], Tf[fed])
+    np.testing.assert_array_equal(env.process_params['Caf'][fed], Caf[fed])
@@ -0,0 +1,66 @@
+import json
+import os
+
+import numpy as np
+
+from CSTR_dataset import OfflineDataset, generate_dataset
+from CSTR_model_plus import CSTRRLEnv, VectorCSTREnv
+from CSTR_parallel import SharedMemoryVectorCSTREnv
+from CSTR_scenarios import ScenarioBank
+
+ACTION = np.array([0.1, -0.5, -0.9, 0.3, 0.0, -0.5])
+
+
+def test_scenario_replays_independently_of_the_env_seed(tmp_path):
+    bank = ScenarioBank.generate(20, seed=1)
+    bank.save(tmp_path / 'bank.npy')
+    env = CSTRRLEnv(seed=0, scenario_bank=str(tmp_path / 'bank.npy'), record_history=False)
+    other = CSTRRLEnv(seed=99, scenario_bank=bank, record_history=False, predraw_noise=True)
+    rewards = env.rollout(ACTION, options={'scenario_id': 7})[1]
+    np.testing.assert_array_equal(other.rollout(ACTION, seed=5, options={'scenario_id': 7})[1], rewards)
+    assert not np.array_equal(env.rollout(ACTION, options={'scenario_id': 8})[1], rewards)
+
+
+def test_vector_env_replays_the_same_scenarios():
+    # Noise-free, as the vector env draws its measurement noise as one batch-wide stream
+    bank = ScenarioBank.generate(20, seed=1)
+    kwargs = dict(noise_level=0.0, integrator='rk4')
+    venv = VectorCSTREnv(3, scenario_bank=bank, seed=0, **kwargs)
+    venv.reset(options={'scenario_ids': [7, 8, 7]})
+    rewards = np.array([venv.step(np.tile(ACTION, (3, 1)))[1] for _ in range(100)])
+    env = CSTRRLEnv(scenario_bank=bank, record_history=False, **kwargs)
+    np.testing.assert_allclose(rewards[:, 1], env.rollout(ACTION, options={'scenario_id': 8})[1], rtol=1e-9)
+    np.testing.assert_array_equal(rewards[:, 0], rewards[:, 2])
+
+
+def test_resumed_dataset_is_byte_identical(tmp_path):
+    kwargs = dict(simulation_steps=20, integrator='rk4')
+    generate_dataset(tmp_path / 'full', 6, 'random', kwargs, seed=3, episodes_per_shard=2, num_workers=0)
+    resumed = tmp_path / 'resumed'
+    generate_dataset(resumed, 6, 'random', kwargs, seed=3, episodes_per_shard=2, num_workers=0)
+
+    # Drop a finished shard as if the run had been interrupted before writing it
+    with open(resumed / 'manifest.json') as f:
+        manifest = json.load(f)
+    lost = manifest['shards'].pop(1)
+    with open(resumed / 'manifest.json', 'w') as f:
+        json.dump(manifest, f)
+    os.remove(resumed / lost['file'])
+    generate_dataset(resumed, 6, 'random', kwargs, seed=3, episodes_per_shard=2, num_workers=0)
+
+    full, again = OfflineDataset(tmp_path / 'full'), OfflineDataset(resumed)
+    assert again.complete and len(again) == len(full)
+    for shard, other in zip(full.shards(), again.shards()):
+        assert shard.tobytes() == other.tobytes()
+
+
+def test_shared_memory_env_matches_single_env():
+    venv = SharedMemoryVectorCSTREnv(4, num_workers=2, env_kwargs=dict(simulation_steps=20), seed=0)
+    try:
+        venv.reset(seed=10)
+        rewards = np.array([venv.step(np.tile(ACTION, (4, 1)))[1] for _ in range(20)])
+    finally:
+        venv.close()
+    # Environment i is seeded with seed + i
+    env = CSTRRLEnv(simulation_steps=20, record_history=False)
+    np.testing.assert_array_equal(rewards[:, 2], env.rollout(ACTION, seed=12)[1])
@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from CSTR_model_plus import CSTRRLEnv
+from CSTR_tuning import PIDTuner
+
+SEEDS = [1, 2]
+
+
+def rollout_costs(actions, integrator):
+    # Summed step by step, in the order the tuner accumulates its costs
+    env = CSTRRLEnv(predraw_noise=True, record_history=False, integrator=integrator)
+    return np.array([[-np.cumsum(env.rollout(gains, seed=seed)[1])[-1] for seed in SEEDS] for gains in actions])
+
+
+@pytest.mark.parametrize("integrator, rtol", [('rk4', 0.0), ('odeint', 1e-8)])
+def test_tuner_matches_rollout(integrator, rtol):
+    actions = np.random.default_rng(0).uniform(-1, 1, (4, 6))
+    result = PIDTuner(SEEDS, integrator=integrator, prune_ratio=None).evaluate(actions)
+    ok = result['status'] == 0
+    assert ok.any()
+    reference = rollout_costs(actions, integrator)
+    if rtol:
+        np.testing.assert_allclose(result['costs'][ok], reference[ok], rtol=rtol)
+    else:
+        np.testing.assert_array_equal(result['costs'][ok], reference[ok])
+
+
+def test_incumbent_pruning_keeps_the_best_candidate():
+    actions = np.random.default_rng(1).uniform(-1, 1, (50, 6))
+    tuner = PIDTuner(SEEDS, integrator='rk4')
+    result = tuner.evaluate(actions)
+    best = np.argmin(np.where(result['status'] == 0, result['mean'], np.inf))
+    pruned = tuner.evaluate(actions, incumbent_cost=result['mean'][best] * 1.0001)
+    assert pruned['status'][best] == 0
+    assert pruned['mean'][best] == result['mean'][best]
@@ -0,0 +1,71 @@
+import numpy as np
+
+from CSTR_model_plus import (CSTRRLEnv, PID_velocity, PID_velocity_batch, VectorCSTREnv,
+                             batch_cstr_dynamics)
+
+DETERMINISTIC = dict(uncertainty_level=0.0, noise_level=0.0, enable_disturbances=False, simulation_steps=50)
+
+
+def test_batch_dynamics_match_single_reactor():
+    rng = np.random.default_rng(0)
+    env = CSTRRLEnv()
+    x = np.array([0.8, 0.2, 0.05, 340.0, 100.0]) * rng.uniform(0.9, 1.1, (8, 5))
+    u = np.array([300.0, 100.0]) * rng.uniform(0.95, 1.05, (8, 2))
+    params = {key: value * rng.uniform(0.95, 1.05, 8) for key, value in env.nominal_params.items()}
+    batch = batch_cstr_dynamics(x, 0.0, u, params)
+    for n in range(8):
+        single = env.custom_cstr_dynamics(x[n], 0.0, u[n], {key: value[n] for key, value in params.items()})
+        np.testing.assert_allclose(batch[n], single, rtol=1e-12, atol=1e-12)
+
+
+def test_batch_pid_matches_single_pid():
+    rng = np.random.default_rng(1)
+    gains = rng.uniform(0.1, 5.0, (8, 6))
+    e = rng.normal(size=(8, 2))
+    e_history = rng.normal(size=(8, 2, 2))
+    u_prev = np.array([300.0, 100.0]) + rng.normal(size=(8, 2, 2))
+    batch = PID_velocity_batch(gains, e, e_history, u_prev, 1.0)
+    for n in range(8):
+        np.testing.assert_array_equal(batch[n], PID_velocity(gains[n], e[n], e_history[n], u_prev[n], 1.0))
+
+
+def test_vector_env_matches_single_env():
+    action = np.array([0.2, -0.9, -0.99, 0.5, -0.3, -0.8])
+    env, venv = CSTRRLEnv(**DETERMINISTIC), VectorCSTREnv(3, **DETERMINISTIC)
+    obs, _ = env.reset(seed=0)
+    batch_obs, _ = venv.reset(seed=0)
+    np.testing.assert_array_equal(batch_obs, np.tile(obs, (3, 1)))
+    for _ in range(50):
+        obs, reward, done, _, _ = env.step(action)
+        batch_obs, rewards, terminations, _, _ = venv.step(np.tile(action, (3, 1)))
+        np.testing.assert_allclose(batch_obs, np.tile(obs, (3, 1)), rtol=1e-6)
+        np.testing.assert_allclose(rewards, reward, rtol=1e-6, atol=1e-9)
+        assert np.all(terminations == done)
+
+
+def test_step_rows_matches_step():
+    rng = np.random.default_rng(2)
+    venv, masked = VectorCSTREnv(4, simulation_steps=30), VectorCSTREnv(4, simulation_steps=30)
+    np.testing.assert_array_equal(masked.reset(seed=3)[0], venv.reset(seed=3)[0])
+    for _ in range(35):
+        actions = rng.uniform(-1, 1, (4, 6))
+        obs, rewards, terminations, _, infos = venv.step(actions)
+        masked_obs, masked_rewards, masked_terminations, _, masked_infos = masked.step_rows(np.arange(4), actions)
+        np.testing.assert_array_equal(masked_obs, obs)
+        np.testing.assert_array_equal(masked_rewards, rewards)
+        np.testing.assert_array_equal(masked_terminations, terminations)
+        np.testing.assert_array_equal(masked_infos['true_state'], infos['true_state'])
+
+
+def test_step_rows_leaves_other_reactors_untouched():
+    venv = VectorCSTREnv(4, simulation_steps=30)
+    venv.reset(seed=3)
+    true_state = venv.true_state.copy()
+    venv.step_rows([1, 3], np.zeros((2, 6)))
+    np.testing.assert_array_equal(venv.true_state[[0, 2]], true_state[[0, 2]])
+    assert np.all(venv.current_step == [0, 1, 0, 1])
+
+    venv.request_reset([3])
+    _, _, _, _, infos = venv.step_rows([1, 3], np.zeros((2, 6)))
+    np.testing.assert_array_equal(infos['reset'], [False, True])
+    assert np.all(venv.current_step == [0, 2, 0, 0])